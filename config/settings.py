@@ -5,8 +5,77 @@ import os
 @dataclass
 class BotConfig:
     TOKEN: str = os.getenv("TELEGRAM_BOT_TOKEN", "")
+    # Длина одного сообщения со сказкой (лимит Telegram — 4096); длинная сказка делится на части
     MAX_STORY_LENGTH: int = 4000
+    # Лимит на генерацию сказок: один токен раз в COOLDOWN_SECONDS (0 — без лимита), запас STORY_BURST
     COOLDOWN_SECONDS: int = 5
+    STORY_BURST: int = 1
+    # Лимит на озвучку
+    TTS_COOLDOWN_SECONDS: int = 3
+    TTS_BURST: int = 2
+    # Общий лимит на весь бот (запросов в секунду, 0 — без ограничения)
+    GLOBAL_RATE: float = float(os.getenv("BOT_GLOBAL_RATE", "0"))
+    GLOBAL_BURST: int = int(os.getenv("BOT_GLOBAL_BURST", "30"))
+    # Получение обновлений: "polling" (для разработки) или "webhook"
+    MODE: str = os.getenv("BOT_MODE", "polling")
+    # Порт веб-сервера (вебхук, проверки живости и метрики)
+    PORT: int = int(os.getenv("PORT", "5000"))
+    # Публичный адрес сервиса, на него Telegram шлёт обновления: <WEBHOOK_URL>/<WEBHOOK_PATH>
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "telegram")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    # Процессы-обработчики обновлений (шардирование по user_id); 0 — всё в одном процессе
+    WORKERS: int = int(os.getenv("BOT_WORKERS", "0"))
+    # Потоковый вывод сказки с постепенным редактированием сообщения
+    STREAMING: bool = os.getenv("BOT_STREAMING", "1") == "1"
+    # Минимальный интервал между правками сообщения (лимиты Telegram)
+    STREAM_EDIT_INTERVAL: float = 1.5
+
+
+# === Конфигурация хранилища состояния пользователей ===
+@dataclass
+class StateConfig:
+    MAX_USERS: int = int(os.getenv("STATE_MAX_USERS", "10000"))
+    # Сколько ждём описание любимого героя
+    STATE_TTL: int = 600
+    # Сколько храним последнюю сказку для озвучки
+    STORY_TTL: int = 3600
+    # Бэкенд: "memory" или "sqlite" (общий для процессов, переживает перезапуск)
+    BACKEND: str = os.getenv("STATE_BACKEND", "memory")
+    SQLITE_PATH: str = os.getenv("STATE_SQLITE_PATH", "data/state.sqlite3")
+    FLUSH_INTERVAL: float = 0.05
+    BATCH_SIZE: int = 256
+
+
+# === Конфигурация пула готовых сказок для кнопок с темами ===
+@dataclass
+class StoryPoolConfig:
+    # Сколько готовых сказок держим на каждую тему (0 — пул выключен);
+    # при BOT_WORKERS > 1 каждый процесс держит ceil(SIZE / BOT_WORKERS)
+    SIZE: int = int(os.getenv("STORY_POOL_SIZE", "3"))
+    # Скольким разным пользователям можно выдать одну и ту же сказку
+    MAX_USES: int = int(os.getenv("STORY_POOL_MAX_USES", "5"))
+    # Пауза между фоновыми генерациями и проверками простоя
+    REFILL_INTERVAL: float = 2.0
+
+
+# === Конфигурация кэша сказок по своим темам ===
+@dataclass
+class StoryCacheConfig:
+    # Сколько тем держим в кэше (0 — кэш выключен)
+    SIZE: int = int(os.getenv("STORY_CACHE_SIZE", "1000"))
+    # Срок жизни сказки в кэше, секунды
+    TTL: int = int(os.getenv("STORY_CACHE_TTL", "86400"))
+    # Скольким разным пользователям можно выдать одну и ту же сказку
+    MAX_USES: int = int(os.getenv("STORY_CACHE_MAX_USES", "3"))
+    # Семантический кэш: пересказы одной темы (нужен numpy)
+    SEMANTIC: bool = os.getenv("STORY_CACHE_SEMANTIC", "0") == "1"
+    # Файлы индекса: <путь>.vectors (memmap) и <путь>.jsonl ("" — только в памяти)
+    SEMANTIC_PATH: str = os.getenv("STORY_CACHE_SEMANTIC_PATH", "data/semantic_cache")
+    SEMANTIC_CAPACITY: int = int(os.getenv("STORY_CACHE_SEMANTIC_CAPACITY", "5000"))
+    SEMANTIC_DIM: int = 2048
+    # Минимальная косинусная близость промптов для выдачи из кэша
+    SEMANTIC_THRESHOLD: float = float(os.getenv("STORY_CACHE_SEMANTIC_THRESHOLD", "0.5"))
 
 
 # === Конфигурация GigaChat ===
@@ -18,6 +87,40 @@ class GigaChatConfig:
     TIMEOUT: int = 30
     TEMPERATURE: float = 0.7
     MAX_TOKENS: int = 800
+    # Пул клиентов: столько запросов к GigaChat идут одновременно без ожидания клиента
+    POOL_SIZE: int = int(os.getenv("GIGACHAT_POOL_SIZE", "4"))
+    # Токен обновляется в фоне, когда до истечения остаётся меньше этого (секунды)
+    TOKEN_REFRESH_MARGIN: float = 300.0
+    TOKEN_CHECK_INTERVAL: float = 60.0
+
+
+# === Конфигурация OpenAI ===
+@dataclass
+class OpenAIConfig:
+    API_KEY: str = os.getenv("OPENAI_API_KEY", "")
+    BASE_URL: str = os.getenv("OPENAI_BASE_URL", "")
+    MODEL: str = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    TEMPERATURE: float = 0.7
+    MAX_TOKENS: int = 800
+
+
+# === Конфигурация DeepSeek ===
+@dataclass
+class DeepSeekConfig:
+    API_KEY: str = os.getenv("DEEPSEEK_API_KEY", "")
+    BASE_URL: str = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+    MODEL: str = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+    TEMPERATURE: float = 0.7
+    MAX_TOKENS: int = 800
+
+
+# === Конфигурация Gemini ===
+@dataclass
+class GeminiConfig:
+    API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+    MODEL: str = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+    TEMPERATURE: float = 0.7
+    MAX_TOKENS: int = 800
 
 
 # === Конфигурация TTS ===
@@ -29,6 +132,22 @@ class TTSConfig:
     EMOTION: str = "good"
     SPEED: float = 1.0
     FORMAT: str = "mp3"
+    # Длинный текст синтезируется частями параллельно (лимит API — 5000 символов)
+    CHUNK_CHARS: int = 1000
+    MAX_WORKERS: int = 4
+    # Аудио больше этого размера выгружается во временный файл, а не держится в памяти
+    SPILL_BYTES: int = int(os.getenv("TTS_SPILL_BYTES", str(10 * 1024 * 1024)))
+    # Пул HTTP-соединений асинхронного клиента
+    POOL_SIZE: int = int(os.getenv("TTS_POOL_SIZE", "20"))
+    CONNECT_TIMEOUT: float = 5.0
+    REQUEST_TIMEOUT: float = 30.0
+    HTTP2: bool = os.getenv("TTS_HTTP2", "1") == "1"
+    # Кэш озвучки: пустой TTS_CACHE_DIR отключает дисковый уровень
+    CACHE_DIR: str = os.getenv("TTS_CACHE_DIR", "data/tts_cache")
+    CACHE_MAX_BYTES: int = int(os.getenv("TTS_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+    MEMORY_CACHE_BYTES: int = int(os.getenv("TTS_MEMORY_CACHE_BYTES", str(20 * 1024 * 1024)))
+    # Сколько file_id загруженных в Telegram озвучек держать в памяти
+    FILE_ID_CACHE_SIZE: int = 10000
 
 
 # === Конфигурация LLM (выбор провайдера) ===
@@ -36,6 +155,37 @@ class TTSConfig:
 class LLMConfig:
     PROVIDER: str = os.getenv("LLM_PROVIDER", "gigachat")  
     # варианты: "gigachat", "openai", "gemini", "deepseek"
+    # Размер пула потоков для провайдеров без асинхронного клиента
+    MAX_WORKERS: int = int(os.getenv("LLM_MAX_WORKERS", "8"))
+    # Цепочка провайдеров для отказоустойчивости, например "gigachat,deepseek".
+    # Пусто — используется только PROVIDER
+    PROVIDERS: str = os.getenv("LLM_PROVIDERS", "")
+    # Таймаут одного запроса к провайдеру, после него — следующий в цепочке
+    TIMEOUT: float = float(os.getenv("LLM_TIMEOUT", "45"))
+    # Хедж: если провайдер не ответил за свой p95, параллельно спрашиваем следующий
+    HEDGE: bool = os.getenv("LLM_HEDGE", "0") == "1"
+    HEDGE_DEFAULT_DELAY: float = 8.0  # пока статистики задержек мало
+    HEDGE_MIN_DELAY: float = 2.0
+    # Предохранитель: столько ошибок подряд — и провайдер отключается на BREAKER_RESET секунд
+    BREAKER_FAILURES: int = 3
+    BREAKER_RESET: float = 60.0
+    # Склейка одинаковых одновременных запросов в один вызов провайдера
+    COALESCE: bool = os.getenv("LLM_COALESCE", "1") == "1"
+    # Каждому из склеенных запросов — свой вариант сказки
+    DISTINCT_SAMPLES: bool = os.getenv("LLM_DISTINCT_SAMPLES", "0") == "1"
+    COALESCE_WINDOW: float = 0.05
+    # Сколько генераций одновременно идёт к одному провайдеру, остальные ждут в очереди
+    MAX_IN_FLIGHT: int = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+    # Сколько максимум ждать своей очереди
+    MAX_QUEUE_WAIT: float = float(os.getenv("LLM_MAX_QUEUE_WAIT", "60"))
+    # Место в очереди сообщается пользователю не чаще раза в столько секунд
+    QUEUE_POSITION_INTERVAL: float = float(os.getenv("LLM_QUEUE_POSITION_INTERVAL", "5"))
+    # Общий пул соединений OpenAI-совместимых провайдеров (OpenAI, DeepSeek)
+    HTTP_POOL_SIZE: int = int(os.getenv("LLM_HTTP_POOL_SIZE", "20"))
+    HTTP_KEEPALIVE: float = 30.0
+    CONNECT_TIMEOUT: float = 5.0
+    READ_TIMEOUT: float = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+    MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
 
 
 # === Сообщения об ошибках ===
@@ -43,6 +193,7 @@ class LLMConfig:
 class ErrorMessages:
     GENERIC_ERROR: str = "😔 Что-то пошло не так. Попробуй ещё раз!"
     TTS_ERROR: str = "⚠️ Не удалось озвучить сказку."
+    BUSY: str = "🙈 Сейчас очень много желающих послушать сказку. Попробуй чуть позже!"
     DEFAULT: str = "⚠️ Произошла ошибка."
 
 
@@ -50,14 +201,27 @@ class ErrorMessages:
 @dataclass
 class Config:
     bot: BotConfig = field(default_factory=BotConfig)
+    state: StateConfig = field(default_factory=StateConfig)
+    story_pool: StoryPoolConfig = field(default_factory=StoryPoolConfig)
+    story_cache: StoryCacheConfig = field(default_factory=StoryCacheConfig)
     gigachat: GigaChatConfig = field(default_factory=GigaChatConfig)
+    openai: OpenAIConfig = field(default_factory=OpenAIConfig)
+    deepseek: DeepSeekConfig = field(default_factory=DeepSeekConfig)
+    gemini: GeminiConfig = field(default_factory=GeminiConfig)
     tts: TTSConfig = field(default_factory=TTSConfig)
     llm: LLMConfig = field(default_factory=LLMConfig)
     errors: ErrorMessages = field(default_factory=ErrorMessages)
 
+    @property
+    def processes(self) -> int:
+        """Сколько процессов обрабатывают запросы: общие лимиты делятся между ними."""
+        return max(1, self.bot.WORKERS)
+
     def validate(self):
         if not self.bot.TOKEN:
             raise ValueError("TELEGRAM_BOT_TOKEN не задан")
+        if self.bot.MODE == "webhook" and not self.bot.WEBHOOK_URL:
+            raise ValueError("WEBHOOK_URL не задан для режима webhook")
         if not self.gigachat.AUTH_KEY:
             raise ValueError("GIGACHAT_AUTH_KEY не задан")
 
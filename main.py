@@ -1,17 +1,23 @@
 """
 Главный файл приложения Сказкин бот
 """
+import asyncio
 import logging
 import signal
 import sys
-import threading
-import web_server  # импортируем мини-сервер
-import os
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+import web_server  # вебхук, проверки живости и метрики
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
 
 from config.settings import config
-from src.bot.handlers import StoryBotHandlers
-from src.services.gigachat_service import gigachat_service
+from src.bot.dispatcher import UpdateDispatcher, serve_worker
+from src.bot.handlers import StoryBotHandlers, story_cache, story_pool, user_store
+from src.services.story_generator_factory import (
+    aclose_story_generator,
+    close_story_generator,
+    start_story_generator,
+)
+from src.services.tts_service import tts_service
 
 # Настройка логирования
 logging.basicConfig(
@@ -20,6 +26,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Раздача обновлений процессам-обработчикам (если BOT_WORKERS > 0)
+dispatcher = None
+
 def setup_handlers(app):
     """Настройка обработчиков для бота"""
     app.add_handler(CommandHandler("start", StoryBotHandlers.start))
@@ -37,11 +46,92 @@ def setup_handlers(app):
     ))
     app.add_error_handler(StoryBotHandlers.error_handler)
 
-def signal_handler(signum, frame):
-    """Обработчик сигналов для корректного завершения"""
-    logger.info("Получен сигнал завершения, останавливаю бота...")
-    gigachat_service.cleanup()
-    sys.exit(0)
+def attach_semantic_cache():
+    """Семантический кэш (а с ним и numpy) загружается, только если включён"""
+    if not config.story_cache.SEMANTIC:
+        return
+    from src.services.semantic_cache import create_semantic_cache
+
+    story_cache.attach_semantic(create_semantic_cache())
+
+async def on_startup(app):
+    """Запуск фоновых задач после инициализации приложения"""
+    await web_server.start(app, webhook=config.bot.MODE == "webhook")
+    # Клиенты LLM и их токены готовятся до первых запросов
+    await start_story_generator()
+    await story_pool.start()
+    attach_semantic_cache()
+
+async def on_front_startup(app):
+    """Фронтовый процесс: только приём обновлений и веб-сервер"""
+    await web_server.start(
+        app,
+        webhook=config.bot.MODE == "webhook",
+        metrics_source=lambda: {"dispatcher": dispatcher.stats()},
+        sink=dispatcher.dispatch,
+    )
+
+async def on_worker_startup(app):
+    """Процесс-обработчик: фоновые задачи без веб-сервера"""
+    await start_story_generator()
+    await story_pool.start()
+    # Файл индекса достаётся первому процессу, остальные держат кэш в памяти
+    attach_semantic_cache()
+
+async def on_shutdown(app):
+    """Закрытие асинхронных ресурсов при остановке приложения"""
+    await story_pool.stop()
+    story_cache.close()
+    await web_server.stop()
+    await aclose_story_generator()
+    await tts_service.aclose()
+
+async def run_webhook(app, on_start):
+    """Режим вебхука: обновления принимает веб-сервер в том же цикле событий"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await app.initialize()
+    try:
+        await on_start(app)
+        await app.start()
+        webhook_url = f"{config.bot.WEBHOOK_URL.rstrip('/')}/{config.bot.WEBHOOK_PATH.strip('/')}"
+        await app.bot.set_webhook(
+            url=webhook_url,
+            secret_token=config.bot.WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Вебхук установлен: {webhook_url}")
+        await stop_event.wait()
+        logger.info("Получен сигнал завершения, останавливаю бота...")
+    finally:
+        if app.running:
+            await app.stop()
+        await on_shutdown(app)
+        await app.shutdown()
+
+def build_application(post_init, updater: bool = True):
+    """Приложение python-telegram-bot с хуками запуска и остановки"""
+    builder = ApplicationBuilder().token(config.bot.TOKEN).post_init(post_init).post_shutdown(on_shutdown)
+    if not updater:
+        # Обновления приходят от фронтового процесса
+        builder = builder.updater(None)
+    return builder.build()
+
+def run_worker(index, queue):
+    """Точка входа процесса-обработчика"""
+    # Ctrl+C получает вся группа процессов; обработчиков останавливает фронт через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logger.info(f"Процесс-обработчик {index} запускается...")
+    app = build_application(on_worker_startup, updater=False)
+    setup_handlers(app)
+    try:
+        asyncio.run(serve_worker(app, queue, on_worker_startup, on_shutdown))
+    finally:
+        close_story_generator()
+        user_store.close()
 
 def main():
     """Главная функция приложения"""
@@ -50,18 +140,33 @@ def main():
         config.validate()
         logger.info("Конфигурация проверена успешно")
         
-        # Настраиваем обработчики сигналов
-        signal.signal(signal.SIGINT, signal_handler)
-        signal.signal(signal.SIGTERM, signal_handler)
-        
-        # Создаем приложение
-        app = ApplicationBuilder().token(config.bot.TOKEN).build()
+        # SIGINT/SIGTERM останавливают цикл событий штатно: run_polling и
+        # run_webhook сами завершают приложение и вызывают on_shutdown
+        if config.bot.WORKERS > 0:
+            # Фронт принимает обновления и раздаёт их процессам по user_id
+            global dispatcher
+            if config.bot.WORKERS > config.llm.MAX_IN_FLIGHT:
+                logger.warning(
+                    f"BOT_WORKERS={config.bot.WORKERS} больше LLM_MAX_IN_FLIGHT={config.llm.MAX_IN_FLIGHT}: "
+                    f"каждому процессу достаётся одна генерация, всего их будет {config.bot.WORKERS}"
+                )
+            dispatcher = UpdateDispatcher(config.bot.WORKERS, run_worker)
+            dispatcher.start()
+            on_start = on_front_startup
+            app = build_application(on_start)
+            app.add_handler(TypeHandler(Update, dispatcher.forward))
+        else:
+            on_start = on_startup
+            app = build_application(on_start)
+            setup_handlers(app)
         
-        # Настраиваем обработчики
-        setup_handlers(app)
-        
-        logger.info("Бот запускается...")
-        app.run_polling()
+        if config.bot.MODE == "webhook":
+            logger.info("Бот запускается в режиме вебхука...")
+            asyncio.run(run_webhook(app, on_start))
+        else:
+            # Опрос — для локальной разработки
+            logger.info("Бот запускается...")
+            app.run_polling()
         
     except ValueError as e:
         logger.error(f"Ошибка конфигурации: {e}")
@@ -71,15 +176,11 @@ def main():
         sys.exit(1)
     finally:
         # Очистка ресурсов
-        gigachat_service.cleanup()
-
-def run_web_server():
-    web_server.app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
+        if dispatcher:
+            dispatcher.stop()
+        close_story_generator()
+        user_store.close()
 
 if __name__ == "__main__":
-    # Запускаем сервер в отдельном потоке
-    threading.Thread(target=run_web_server, daemon=True).start()
-    
-    # Запускаем бота
     main()
 
@@ -0,0 +1,142 @@
+"""
+Распределение обновлений Telegram по процессам-обработчикам.
+
+Фронтовый процесс получает обновления (опросом или вебхуком) и раскладывает
+их по N процессам через очереди multiprocessing. Шард выбирается по user_id:
+все обновления одного пользователя попадают в один процесс по порядку,
+поэтому его состояние (лимиты запросов, последняя сказка, ожидание героя)
+остаётся согласованным даже с хранилищем в памяти процесса.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+# Поля обновления, в которых Telegram передаёт автора
+_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def shard_key(data: Dict[str, Any]) -> int:
+    """user_id автора обновления, иначе id чата, иначе update_id."""
+    for field in _USER_FIELDS:
+        payload = data.get(field)
+        if not payload:
+            continue
+        user = payload.get("from")
+        if user:
+            return user["id"]
+        chat = payload.get("chat")
+        if chat:
+            return chat["id"]
+    return data.get("update_id", 0)
+
+
+class UpdateDispatcher:
+    """Фронт: запускает процессы-обработчики и раздаёт им обновления."""
+
+    def __init__(self, workers: int, target: Callable[[int, Any], None], queue_size: int = 1000):
+        self.workers = workers
+        self.target = target
+        self.queue_size = queue_size
+        # spawn: дочерние процессы не наследуют потоки и соединения фронта
+        self._ctx = multiprocessing.get_context("spawn")
+        self._queues: List[Any] = []
+        self._processes: List[Any] = []
+        self.dispatched = 0
+        self.rejected = 0
+
+    def start(self):
+        for index in range(self.workers):
+            worker_queue = self._ctx.Queue(maxsize=self.queue_size)
+            process = self._ctx.Process(
+                target=self.target, args=(index, worker_queue), name=f"bot-worker-{index}"
+            )
+            process.start()
+            self._queues.append(worker_queue)
+            self._processes.append(process)
+        logger.info(f"Запущено процессов-обработчиков: {self.workers}")
+
+    def _queue_for(self, data: Dict[str, Any]):
+        return self._queues[shard_key(data) % len(self._queues)]
+
+    def dispatch(self, data: Dict[str, Any]) -> bool:
+        """
+        Отправить обновление (в виде JSON-словаря) в процесс его шарда.
+        False — очередь процесса переполнена, обновление не принято.
+        """
+        try:
+            self._queue_for(data).put_nowait(data)
+        except queue.Full:
+            self.rejected += 1
+            logger.warning(f"Очередь процесса-обработчика переполнена, обновление {data.get('update_id')} отклонено")
+            return False
+        self.dispatched += 1
+        return True
+
+    async def forward(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Обработчик фронтового приложения (режим опроса): всё уходит в процессы-
+        обработчики. Telegram уже считает обновление доставленным, поэтому при
+        заполненной очереди шарда ждём места, а не отбрасываем его.
+        """
+        data = update.to_dict()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._queue_for(data).put, data)
+        self.dispatched += 1
+
+    def stop(self, timeout: float = 10.0):
+        for worker_queue in self._queues:
+            worker_queue.put(None)
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} не завершился за {timeout} с, останавливаю принудительно")
+                process.terminate()
+        self._queues.clear()
+        self._processes.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": sum(process.is_alive() for process in self._processes),
+            "dispatched": self.dispatched,
+            "rejected": self.rejected,
+        }
+
+
+async def serve_worker(
+    app: Application,
+    updates,
+    on_startup: Optional[Callable[[Application], Awaitable[None]]] = None,
+    on_shutdown: Optional[Callable[[Application], Awaitable[None]]] = None,
+):
+    """
+    Цикл процесса-обработчика: приложение без Updater, обновления берутся
+    из очереди фронта. None в очереди — сигнал завершения.
+    """
+    loop = asyncio.get_running_loop()
+    await app.initialize()
+    try:
+        if on_startup:
+            await on_startup(app)
+        await app.start()
+        while True:
+            data = await loop.run_in_executor(None, updates.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(data, app.bot))
+    finally:
+        if app.running:
+            await app.stop()
+        if on_shutdown:
+            await on_shutdown(app)
+        await app.shutdown()
@@ -1,27 +1,80 @@
 """
 Обработчики для Telegram бота
 """
+import asyncio
+import math
 import time
 import logging
-from collections import defaultdict
-from typing import Dict, Any
+from typing import Optional
 
-from telegram import Update
+from telegram import Message, Update
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
 
 from config.settings import config
+from src.services.admission import AdmissionTimeout, get_admission_controller
+from src.services.response_cache import StoryResponseCache
+from src.services.story_generator import StoryStreamError
 from src.services.story_generator_factory import get_story_generator
+from src.services.story_pool import StoryPool
 from src.services.tts_service import tts_service
-from src.utils.formatters import format_story_for_telegram, truncate_text, extract_story_title
+from src.utils.formatters import ParsedStory, parse_story, split_markdown_message, truncate_text
 from src.bot.keyboards import get_main_keyboard, get_tts_keyboard, get_story_actions_keyboard
+from src.bot.rate_limiter import RateLimiter, cooldown_rate
+from src.bot.state_store import UserStateStore, STATE, LAST_STORY
+from src.bot.state_backends import create_state_backend
 
 logger = logging.getLogger(__name__)
 
 # Хранилище состояния пользователей
-user_cooldowns: Dict[int, float] = defaultdict(float)
-user_states: Dict[int, str] = defaultdict(str)
-user_last_story: Dict[int, str] = defaultdict(str)
+user_store = UserStateStore(
+    backend=create_state_backend(),
+    ttls={
+        STATE: config.state.STATE_TTL,
+        LAST_STORY: config.state.STORY_TTL,
+    },
+)
+
+# Ограничение частоты запросов: общее для всех обработчиков.
+# Пользователь всегда попадает в один процесс, а общий лимит делится между процессами
+STORY_SCOPE = "story"
+TTS_SCOPE = "tts"
+rate_limiter = RateLimiter(
+    limits={
+        STORY_SCOPE: (cooldown_rate(config.bot.COOLDOWN_SECONDS), config.bot.STORY_BURST),
+        TTS_SCOPE: (cooldown_rate(config.bot.TTS_COOLDOWN_SECONDS), config.bot.TTS_BURST),
+    },
+    global_rate=config.bot.GLOBAL_RATE / config.processes,
+    global_burst=max(1, config.bot.GLOBAL_BURST // config.processes),
+)
+
+RATE_LIMITED = "⏳ Подожди немного."
+
+# Промпты для кнопок с постоянными темами
+BUTTON_PROMPTS = {
+    "🐾 Про животных": "Придумай сказку про необычных животных.",
+    "🏝 Про приключения": "Придумай сказку о детях в путешествии.",
+    "🔮 Про волшебство": "Придумай волшебную сказку с чудесами."
+}
+
+# Готовые сказки для кнопок: пополняются в фоне, пока бот простаивает.
+# Пул есть в каждом процессе (пользователи распределены по всем), а размер
+# делится между процессами, чтобы фоновых генераций не стало в N раз больше
+story_pool = StoryPool(
+    BUTTON_PROMPTS.values(),
+    size=math.ceil(config.story_pool.SIZE / config.processes),
+    max_uses=config.story_pool.MAX_USES,
+    refill_interval=config.story_pool.REFILL_INTERVAL,
+)
+
+# Готовые сказки по своим темам: похожие запросы («про котика», «Про котика!»)
+# получают уже написанную сказку без обращения к LLM
+story_cache = StoryResponseCache(
+    max_size=config.story_cache.SIZE,
+    ttl=config.story_cache.TTL,
+    max_uses=config.story_cache.MAX_USES,
+)
 
 class StoryBotHandlers:
     """Обработчики для бота сказок"""
@@ -36,25 +89,97 @@ class StoryBotHandlers:
             reply_markup=keyboard
         )
     
+    @staticmethod
+    async def _generate_with_progress(message: Message, prompt: str) -> Optional[str]:
+        """
+        Генерация сказки в потоковом режиме: сообщение-заглушка постепенно
+        дополняется текстом, правки не чаще STREAM_EDIT_INTERVAL.
+        Оборванный поток — None: обрывок не отправляется и не кэшируется.
+        """
+        story_generator = get_story_generator()
+        if not config.bot.STREAMING:
+            return await story_generator.agenerate_story(prompt)
+
+        parts = []
+        last_edit = time.monotonic()
+        try:
+            async for chunk in story_generator.astream_story(prompt):
+                parts.append(chunk)
+                now = time.monotonic()
+                if now - last_edit < config.bot.STREAM_EDIT_INTERVAL:
+                    continue
+                last_edit = now
+                # Черновик без разметки: незакрытые * ломают Markdown
+                preview = truncate_text("".join(parts).replace("*", ""), config.bot.MAX_STORY_LENGTH)
+                try:
+                    await message.edit_text(preview + " ✍️")
+                except TelegramError as e:
+                    logger.debug(f"Не удалось обновить черновик сказки: {e}")
+        except StoryStreamError as e:
+            logger.error(f"Генерация сказки прервана: {e}")
+            return None
+
+        story = "".join(parts).strip()
+        return story or None
+
     @staticmethod
     async def send_story(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str):
-        await update.message.reply_text("📝 Пишу сказку...")
+        # Для кнопок с постоянными темами сказка может быть уже готова
+        pooled_story = story_pool.take(prompt, update.effective_user.id)
+        if pooled_story:
+            await StoryBotHandlers._deliver_story(update, pooled_story)
+            return
 
-        story_generator = get_story_generator()
-        story = story_generator.generate_story(prompt)
+        user_id = update.effective_user.id
+        settings_key = get_story_generator().settings_key()
+        cached_story = story_cache.get(prompt, settings_key, user_id)
+        if cached_story:
+            await StoryBotHandlers._deliver_story(update, cached_story)
+            return
+
+        placeholder = await update.message.reply_text("📝 Пишу сказку...")
+
+        async def show_queue_position(position: int):
+            try:
+                await placeholder.edit_text(f"📝 Пишу сказку...\n⏳ Место в очереди: {position}")
+            except TelegramError as e:
+                logger.debug(f"Не удалось обновить место в очереди: {e}")
+
+        admission = get_admission_controller(settings_key)
+        try:
+            async with admission.slot(user_id, show_queue_position):
+                with story_pool.live_request():
+                    story = await StoryBotHandlers._generate_with_progress(placeholder, prompt)
+        except AdmissionTimeout:
+            await placeholder.edit_text(config.errors.BUSY)
+            return
 
         if not story:
-            await update.message.reply_text(config.errors.GENERIC_ERROR)
+            await placeholder.edit_text(config.errors.GENERIC_ERROR)
             return
 
-        formatted_story = format_story_for_telegram(story)
+        parsed_story = parse_story(story)
+        story_cache.put(prompt, settings_key, parsed_story, user_id)
+        await StoryBotHandlers._deliver_story(update, parsed_story, placeholder)
 
-        if len(formatted_story) > config.bot.MAX_STORY_LENGTH:
-            formatted_story = truncate_text(formatted_story, config.bot.MAX_STORY_LENGTH)
+    @staticmethod
+    async def _deliver_story(update: Update, parsed_story: ParsedStory, placeholder: Optional[Message] = None):
+        """
+        Отправка разобранной сказки (первая часть — правкой заглушки или новым
+        сообщением) и кнопки озвучки. Длинная сказка уходит несколькими
+        сообщениями подряд, без обрезки.
+        """
+        messages = split_markdown_message(parsed_story.markdown, config.bot.MAX_STORY_LENGTH)
 
-        user_last_story[update.effective_user.id] = story
+        user_store.set(update.effective_user.id, LAST_STORY, parsed_story)
 
-        await update.message.reply_text(formatted_story, parse_mode=ParseMode.MARKDOWN)
+        if placeholder:
+            await placeholder.edit_text(messages[0], parse_mode=ParseMode.MARKDOWN)
+        else:
+            await update.message.reply_text(messages[0], parse_mode=ParseMode.MARKDOWN)
+        # Части отправляются строго по очереди: параллельные запросы Telegram может доставить вразнобой
+        for message in messages[1:]:
+            await update.message.reply_text(message, parse_mode=ParseMode.MARKDOWN)
 
         if tts_service.is_available():
             keyboard = get_tts_keyboard()
@@ -64,10 +189,14 @@ class StoryBotHandlers:
     async def handle_tts_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик запроса на TTS"""
         query = update.callback_query
+        user_id = query.from_user.id
+
+        if not rate_limiter.allow(user_id, TTS_SCOPE):
+            await query.answer(RATE_LIMITED)
+            return
         await query.answer()
         
-        user_id = query.from_user.id
-        story = user_last_story.get(user_id)
+        story: Optional[ParsedStory] = user_store.get(user_id, LAST_STORY)
         
         if not story:
             await query.edit_message_text("Сначала закажи сказку.")
@@ -76,25 +205,37 @@ class StoryBotHandlers:
         await query.edit_message_text("🎙 Озвучиваю сказку...")
         
         try:
-            # Извлекаем название сказки
-            story_title = extract_story_title(story)
-            
-            # Синтезируем речь с названием сказки
-            result = tts_service.synthesize_speech(story, story_title)
+            # Сказка уже разобрана — заголовок и текст для озвучки готовы
+            story_title = story.short_title
+
+            # Эта озвучка уже загружалась в Telegram — отправляем по file_id
+            file_id = await tts_service.acached_file_id(story)
+            if file_id:
+                try:
+                    await query.message.reply_audio(file_id, caption=f"📖 {story_title}")
+                    return
+                except TelegramError as e:
+                    logger.warning(f"file_id озвучки больше не принимается: {e}")
+                    await tts_service.aforget_file_id(story)
+
+            audio = await tts_service.asynthesize_story(story)
             
-            if result:
-                audio_data, temp_filename = result
-                
+            if audio:
                 try:
-                    # Отправляем аудио с названием сказки
-                    with open(temp_filename, "rb") as audio_file:
-                        await query.message.reply_audio(
-                            audio_file, 
+                    # Отправляем аудио с названием сказки из памяти или с диска
+                    with audio.open() as audio_file:
+                        sent = await query.message.reply_audio(
+                            audio_file,
+                            filename=audio.filename,
                             caption=f"📖 {story_title}"
                         )
                 finally:
-                    # Удаляем временный файл
-                    tts_service.cleanup_temp_file(temp_filename)
+                    # Удаляем только временный файл — файл из кэша остаётся
+                    if audio.temporary:
+                        await asyncio.to_thread(tts_service.cleanup_temp_file, audio.path)
+
+                if sent and sent.audio:
+                    await tts_service.aremember_file_id(story, sent.audio.file_id)
             else:
                 await query.message.reply_text(config.errors.TTS_ERROR)
                 
@@ -106,31 +247,19 @@ class StoryBotHandlers:
     async def handle_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик нажатий на кнопки"""
         user_id = update.effective_user.id
-        now = time.time()
-        
-        # Проверяем кулдаун
-        if now - user_cooldowns[user_id] < config.bot.COOLDOWN_SECONDS:
-            await update.message.reply_text("⏳ Подожди немного.")
-            return
-        
-        user_cooldowns[user_id] = now
         topic = update.message.text.strip()
         
-        # Словарь промптов для кнопок
-        prompts = {
-            "🐾 Про животных": "Придумай сказку про необычных животных.",
-            "🏝 Про приключения": "Придумай сказку о детях в путешествии.",
-            "🔮 Про волшебство": "Придумай волшебную сказку с чудесами."
-        }
-        
         # Обработка кнопки "Про любимого героя"
         if topic == "🌟 Про любимого героя":
-            user_states[user_id] = "awaiting_hero_description"
+            user_store.set(user_id, STATE, "awaiting_hero_description")
             await update.message.reply_text("Опиши любимого героя.")
             return
         
         # Обработка остальных кнопок
-        if prompt := prompts.get(topic):
+        if prompt := BUTTON_PROMPTS.get(topic):
+            if not rate_limiter.allow(user_id, STORY_SCOPE):
+                await update.message.reply_text(RATE_LIMITED)
+                return
             await StoryBotHandlers.send_story(update, context, prompt)
     
     @staticmethod
@@ -139,21 +268,16 @@ class StoryBotHandlers:
         user_id = update.effective_user.id
         user_input = update.message.text.strip()
         
-        # Обработка описания героя (без кулдауна)
-        if user_states.get(user_id) == "awaiting_hero_description":
-            user_states[user_id] = ""
-            prompt = f"Придумай сказку с героем: {user_input}"
-            await StoryBotHandlers.send_story(update, context, prompt)
+        if not rate_limiter.allow(user_id, STORY_SCOPE):
+            await update.message.reply_text(RATE_LIMITED)
             return
         
-        # Для остальных запросов проверяем кулдаун
-        now = time.time()
-        if now - user_cooldowns[user_id] < config.bot.COOLDOWN_SECONDS:
-            await update.message.reply_text("⏳ Подожди немного.")
-            return
-        
-        user_cooldowns[user_id] = now
-        prompt = user_input
+        # Обработка описания героя
+        if user_store.get(user_id, STATE) == "awaiting_hero_description":
+            user_store.pop(user_id, STATE)
+            prompt = f"Придумай сказку с героем: {user_input}"
+        else:
+            prompt = user_input
         
         await StoryBotHandlers.send_story(update, context, prompt)
     
@@ -0,0 +1,114 @@
+"""
+Ограничение частоты запросов пользователей: token bucket
+"""
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+
+def cooldown_rate(seconds: float) -> float:
+    """Скорость пополнения для паузы в seconds между запросами; 0 — без ограничения."""
+    return 1 / seconds if seconds > 0 else 0.0
+
+
+class _Bucket:
+    """Корзина токенов: текущий запас и момент последнего пересчёта."""
+    __slots__ = ("tokens", "updated", "full_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.full_at = now
+
+    def take(self, rate: float, burst: float, cost: float, now: float) -> bool:
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        # Когда корзина снова наполнится, её можно забыть без изменения поведения
+        self.full_at = now + (burst - self.tokens) / rate
+        return True
+
+    def refund(self, rate: float, cost: float):
+        self.tokens += cost
+        self.full_at -= cost / rate
+
+
+class RateLimiter:
+    """
+    Token bucket для пользователей и для бота в целом:
+    — limits: для каждой области (генерация сказки, озвучка, ...) скорость
+      пополнения в токенах в секунду и размер корзины (допустимый всплеск);
+      скорость 0 — область без ограничения для пользователя
+    — общая корзина global_rate/global_burst ограничивает суммарный поток
+    — время по монотонным часам, корзины живут только пока не наполнились
+      (O(1) памяти на активного пользователя), простаивающие удаляются
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[float, float]],
+        global_rate: float = 0.0,
+        global_burst: float = 0.0,
+        max_buckets: int = 100000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.limits = limits
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.max_buckets = max_buckets
+        self._clock = clock
+        self._buckets: "OrderedDict[Tuple[str, Hashable], _Bucket]" = OrderedDict()
+        self._global: Optional[_Bucket] = None
+        if global_rate > 0:
+            self._global = _Bucket(global_burst, clock())
+        self.rejected = 0
+
+    def allow(self, user_id: Hashable, scope: str, cost: float = 1.0) -> bool:
+        """Списать cost токенов из корзины пользователя (и общей); False — лимит исчерпан."""
+        rate, burst = self.limits[scope]
+        now = self._clock()
+        if rate <= 0:
+            return self._take_global(cost, now)
+        key = (scope, user_id)
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(burst, now)
+        if not bucket.take(rate, burst, cost, now):
+            self.rejected += 1
+            return False
+
+        if not self._take_global(cost, now):
+            bucket.refund(rate, cost)
+            return False
+
+        self._buckets[key] = bucket
+        self._buckets.move_to_end(key)
+        self._purge_idle(now)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return True
+
+    def _take_global(self, cost: float, now: float) -> bool:
+        if self._global is None or self._global.take(self.global_rate, self.global_burst, cost, now):
+            return True
+        self.rejected += 1
+        return False
+
+    def _purge_idle(self, now: float, limit: int = 2):
+        """Амортизированно удаляем самые давние корзины, если они уже полны."""
+        for _ in range(limit):
+            if not self._buckets:
+                return
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket.full_at > now:
+                return
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def stats(self) -> Dict[str, int]:
+        return {"buckets": len(self._buckets), "rejected": self.rejected}
@@ -0,0 +1,381 @@
+"""
+Бэкенды хранилища состояния пользователей: в памяти процесса и SQLite (WAL)
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config.settings import config
+from src.utils.formatters import ParsedStory
+
+logger = logging.getLogger(__name__)
+
+# Поля состояния пользователя
+STATE = "state"
+LAST_STORY = "last_story"
+
+FIELDS = (STATE, LAST_STORY)
+
+
+class StateBackend(ABC):
+    """Единый интерфейс хранения полей состояния пользователей."""
+
+    @abstractmethod
+    def get(self, user_id: int, field: str, now: float) -> Any:
+        """Значение поля или None, если его нет или expires_at <= now."""
+
+    @abstractmethod
+    def set(self, user_id: int, field: str, value: Any, expires_at: Optional[float]):
+        ...
+
+    @abstractmethod
+    def delete(self, user_id: int, field: str):
+        ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        ...
+
+    def __len__(self) -> int:
+        return self.stats()["size"]
+
+    def close(self):
+        """Освобождение ресурсов (сброс несохранённых записей и т.п.)."""
+
+
+class _UserRecord:
+    """Компактная запись пользователя: значение и срок жизни для каждого поля."""
+    __slots__ = (
+        "state", "state_expires",
+        "last_story", "last_story_expires",
+    )
+
+    def __init__(self):
+        for field in FIELDS:
+            setattr(self, field, None)
+            setattr(self, f"{field}_expires", None)
+
+    def is_empty(self, now: float) -> bool:
+        for field in FIELDS:
+            expires = getattr(self, f"{field}_expires")
+            if getattr(self, field) is not None and (expires is None or expires > now):
+                return False
+        return True
+
+
+class MemoryStateBackend(StateBackend):
+    """
+    Хранение в памяти процесса:
+    — LRU-вытеснение при превышении max_users
+    — чтение никогда не создаёт записей
+    """
+
+    def __init__(self, max_users: int, clock: Callable[[], float] = time.time):
+        self.max_users = max_users
+        self._clock = clock
+        self._records: "OrderedDict[int, _UserRecord]" = OrderedDict()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, user_id: int, field: str, now: float) -> Any:
+        record = self._records.get(user_id)
+        if record is None:
+            return None
+
+        value = getattr(record, field)
+        expires = getattr(record, f"{field}_expires")
+        if value is not None and expires is not None and expires <= now:
+            setattr(record, field, None)
+            value = None
+
+        if record.is_empty(now):
+            del self._records[user_id]
+            self.expirations += 1
+            return None
+
+        self._records.move_to_end(user_id)
+        return value
+
+    def set(self, user_id: int, field: str, value: Any, expires_at: Optional[float]):
+        record = self._records.get(user_id)
+        if record is None:
+            record = _UserRecord()
+            self._records[user_id] = record
+        else:
+            self._records.move_to_end(user_id)
+
+        setattr(record, field, value)
+        setattr(record, f"{field}_expires", expires_at)
+
+        self._purge_expired(self._clock())
+        while len(self._records) > self.max_users:
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, user_id: int, field: str):
+        record = self._records.get(user_id)
+        if record is None:
+            return
+        setattr(record, field, None)
+        setattr(record, f"{field}_expires", None)
+        if record.is_empty(self._clock()):
+            del self._records[user_id]
+
+    def _purge_expired(self, now: float, limit: int = 2):
+        """
+        Амортизированная очистка: самые давние записи лежат в начале LRU,
+        снимаем их, пока они полностью просрочены (не больше limit за вызов).
+        """
+        for _ in range(limit):
+            if not self._records:
+                return
+            user_id, record = next(iter(self._records.items()))
+            if not record.is_empty(now):
+                return
+            del self._records[user_id]
+            self.expirations += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._records),
+            "max_size": self.max_users,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+def _encode(value: Any) -> str:
+    if isinstance(value, ParsedStory):
+        return json.dumps({"__story__": asdict(value)}, ensure_ascii=False)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _decode(payload: str) -> Any:
+    value = json.loads(payload)
+    if isinstance(value, dict) and "__story__" in value:
+        data = value["__story__"]
+        data["paragraphs"] = tuple(data["paragraphs"])
+        return ParsedStory(**data)
+    return value
+
+
+_DELETED = object()
+
+
+class SQLiteStateBackend(StateBackend):
+    """
+    Хранение в локальной SQLite (режим WAL), общей для нескольких процессов бота.
+    Запись не блокирует цикл событий: изменения копятся в очереди и пишутся
+    фоновым потоком пачками в одной транзакции. До записи на диск свежие
+    значения видны через оверлей ожидающих изменений. Пачка, которую не
+    удалось записать (например, «database is locked» при записи другим
+    процессом), остаётся в оверлее и повторяется с нарастающей паузой.
+    """
+
+    # Пауза между повторами растёт от flush_interval до этого предела
+    _RETRY_MAX_DELAY = 5.0
+    # Сколько раз повторять запись при остановке, прежде чем сдаться
+    _CLOSE_RETRIES = 3
+
+    _CREATE_SQL = (
+        "CREATE TABLE IF NOT EXISTS user_state ("
+        " user_id INTEGER NOT NULL,"
+        " field TEXT NOT NULL,"
+        " value TEXT NOT NULL,"
+        " expires_at REAL,"
+        " PRIMARY KEY (user_id, field)"
+        ") WITHOUT ROWID"
+    )
+    # Постоянные SQL-строки: sqlite3 кэширует подготовленные выражения на соединении
+    _SELECT_SQL = "SELECT value, expires_at FROM user_state WHERE user_id = ? AND field = ?"
+    _UPSERT_SQL = (
+        "INSERT INTO user_state (user_id, field, value, expires_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (user_id, field) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at"
+    )
+    _DELETE_SQL = "DELETE FROM user_state WHERE user_id = ? AND field = ?"
+    _PURGE_SQL = "DELETE FROM user_state WHERE expires_at IS NOT NULL AND expires_at <= ?"
+    _COUNT_SQL = "SELECT COUNT(*) FROM user_state"
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 0.05,
+        batch_size: int = 256,
+        purge_interval: float = 60.0,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.purge_interval = purge_interval
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        self._pending: Dict[Tuple[int, str], Tuple[Any, Optional[float]]] = {}
+        self._pending_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[Tuple[int, str]]]" = queue.Queue()
+        self.batches = 0
+        self.purged = 0
+        self.failures = 0
+
+        conn = self._connection()
+        conn.execute(self._CREATE_SQL)
+        conn.commit()
+        # Размер таблицы считает фоновый поток, /metrics берёт готовое число
+        self._size = conn.execute(self._COUNT_SQL).fetchone()[0]
+
+        self._writer = threading.Thread(target=self._writer_loop, name="state-writer", daemon=True)
+        self._writer.start()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: int, field: str, now: float) -> Any:
+        key = (user_id, field)
+        with self._pending_lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            payload, expires_at = pending
+        else:
+            row = self._connection().execute(self._SELECT_SQL, key).fetchone()
+            if row is None:
+                return None
+            payload, expires_at = row
+
+        if payload is _DELETED or (expires_at is not None and expires_at <= now):
+            return None
+        return _decode(payload)
+
+    def set(self, user_id: int, field: str, value: Any, expires_at: Optional[float]):
+        self._enqueue((user_id, field), (_encode(value), expires_at))
+
+    def delete(self, user_id: int, field: str):
+        self._enqueue((user_id, field), (_DELETED, None))
+
+    def _enqueue(self, key: Tuple[int, str], entry: Tuple[Any, Optional[float]]):
+        with self._pending_lock:
+            self._pending[key] = entry
+        self._queue.put(key)
+
+    def _next_batch(self) -> Tuple[set, bool]:
+        """Ключи для следующей пачки и признак остановки (None в очереди)."""
+        try:
+            key = self._queue.get(timeout=self.purge_interval)
+        except queue.Empty:
+            return set(), False
+        if key is None:
+            return set(), True
+
+        keys = {key}
+        # Добираем пачку, пока очередь не опустеет на flush_interval
+        while len(keys) < self.batch_size:
+            try:
+                key = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                break
+            if key is None:
+                return keys, True
+            keys.add(key)
+        return keys, False
+
+    def _writer_loop(self):
+        conn = self._connection()
+        last_purge = time.time()
+        closing = False
+        failures = 0
+        while True:
+            keys, stop = self._next_batch()
+            closing = closing or stop
+            if keys:
+                try:
+                    self._flush(conn, keys)
+                    failures = 0
+                except sqlite3.Error as e:
+                    failures += 1
+                    self.failures += 1
+                    if closing and failures > self._CLOSE_RETRIES:
+                        logger.error(f"Состояние не записано в SQLite при остановке ({len(keys)} полей): {e}")
+                        break
+                    logger.error(f"Ошибка записи состояния в SQLite, повтор: {e}")
+                    # Значения остались в оверлее — возвращаем ключи в очередь
+                    for key in keys:
+                        self._queue.put(key)
+                    time.sleep(min(self.flush_interval * 2 ** failures, self._RETRY_MAX_DELAY))
+                    continue
+            if closing and self._queue.empty():
+                break
+            if time.time() - last_purge >= self.purge_interval:
+                last_purge = time.time()
+                try:
+                    with conn:
+                        self.purged += conn.execute(self._PURGE_SQL, (last_purge,)).rowcount
+                    self._size = conn.execute(self._COUNT_SQL).fetchone()[0]
+                except sqlite3.Error as e:
+                    logger.error(f"Ошибка очистки состояния в SQLite: {e}")
+        conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, keys):
+        with self._pending_lock:
+            batch = {key: self._pending[key] for key in keys if key in self._pending}
+
+        upserts = [(u, f, payload, exp) for (u, f), (payload, exp) in batch.items() if payload is not _DELETED]
+        deletes = [key for key, (payload, _) in batch.items() if payload is _DELETED]
+        with conn:
+            if upserts:
+                conn.executemany(self._UPSERT_SQL, upserts)
+            if deletes:
+                conn.executemany(self._DELETE_SQL, deletes)
+        self.batches += 1
+
+        # Убираем из оверлея только то, что не успело измениться за время записи
+        with self._pending_lock:
+            for key, entry in batch.items():
+                if self._pending.get(key) is entry:
+                    del self._pending[key]
+        self._size = conn.execute(self._COUNT_SQL).fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        with self._pending_lock:
+            pending = len(self._pending)
+        return {
+            "size": self._size,
+            "pending": pending,
+            "batches": self.batches,
+            "purged": self.purged,
+            "failures": self.failures,
+        }
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout=5.0)
+
+
+def create_state_backend() -> StateBackend:
+    """Бэкенд по настройке STATE_BACKEND: "memory" (по умолчанию) или "sqlite"."""
+    backend = (config.state.BACKEND or "memory").lower()
+    if backend == "memory":
+        return MemoryStateBackend(max_users=config.state.MAX_USERS)
+    if backend == "sqlite":
+        return SQLiteStateBackend(
+            path=config.state.SQLITE_PATH,
+            flush_interval=config.state.FLUSH_INTERVAL,
+            batch_size=config.state.BATCH_SIZE,
+        )
+    raise ValueError(f"Неизвестный бэкенд состояния: {backend}")
@@ -0,0 +1,66 @@
+"""
+Хранилище состояния пользователей бота с TTL и ограничением размера
+"""
+import time
+from typing import Any, Callable, Dict, Optional
+
+from src.bot.state_backends import (
+    StateBackend,
+    MemoryStateBackend,
+    STATE,
+    LAST_STORY,
+    FIELDS,
+)
+
+__all__ = ["UserStateStore", "STATE", "LAST_STORY", "FIELDS"]
+
+
+class UserStateStore:
+    """
+    Хранилище состояния пользователей поверх подключаемого бэкенда:
+    — TTL отдельно для каждого поля
+    — ограничение размера и вытеснение — на стороне бэкенда
+    — чтение никогда не создаёт записей
+
+    Сроки жизни считаются по time.time(), чтобы записи SQLite-бэкенда
+    корректно переживали перезапуск и были общими для нескольких процессов.
+    """
+
+    def __init__(
+        self,
+        ttls: Dict[str, Optional[float]],
+        backend: Optional[StateBackend] = None,
+        max_users: int = 10000,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.ttls = ttls
+        if backend is None:
+            backend = MemoryStateBackend(max_users=max_users, clock=clock)
+        self.backend = backend
+        self._clock = clock
+
+    def get(self, user_id: int, field: str) -> Any:
+        """Значение поля или None, если его нет или срок жизни истёк."""
+        return self.backend.get(user_id, field, self._clock())
+
+    def set(self, user_id: int, field: str, value: Any):
+        """Записать поле пользователя; срок жизни берётся из ttls[field]."""
+        ttl = self.ttls.get(field)
+        self.backend.set(user_id, field, value, self._clock() + ttl if ttl else None)
+
+    def pop(self, user_id: int, field: str) -> Any:
+        """Удалить поле пользователя и вернуть его прежнее значение."""
+        value = self.get(user_id, field)
+        if value is not None:
+            self.backend.delete(user_id, field)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        """Размер хранилища и счётчики бэкенда."""
+        return self.backend.stats()
+
+    def close(self):
+        self.backend.close()
+
+    def __len__(self) -> int:
+        return len(self.backend)
@@ -0,0 +1,203 @@
+"""
+Ограничение одновременных генераций и справедливая очередь пользователей
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionTimeout(Exception):
+    """Запрос не дождался своей очереди за max_queue_wait."""
+
+
+class _Waiter:
+    __slots__ = ("user_id", "event", "admitted", "position", "reported", "next_report")
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.event = asyncio.Event()
+        self.admitted = False
+        self.position = 0
+        # Последнее сообщённое место и время, раньше которого новое не сообщаем
+        self.reported: Optional[int] = None
+        self.next_report = 0.0
+
+    def report_due(self, now: float) -> bool:
+        return self.position != self.reported and now >= self.next_report
+
+
+class AdmissionController:
+    """
+    Не больше max_in_flight генераций одновременно. Остальные ждут в очереди:
+    у каждого пользователя своя FIFO, а пользователи обслуживаются по кругу,
+    поэтому один активный пользователь не задерживает всех остальных.
+
+    Места в очереди пересчитываются одним проходом при каждом её изменении,
+    а сообщаются ждущему не чаще раза в position_interval секунд: иначе
+    каждое освобождение слота давало бы правку сообщения всем ждущим.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue_wait: float, position_interval: float = 0.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue_wait = max_queue_wait
+        self.position_interval = position_interval
+        self.in_flight = 0
+        self._queues: "OrderedDict[int, Deque[_Waiter]]" = OrderedDict()
+        self.timeouts = 0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def position(self, waiter: _Waiter) -> int:
+        """Место в очереди (с 1) с учётом обслуживания пользователей по кругу; 0 — не в очереди."""
+        return 0 if waiter.admitted else waiter.position
+
+    def _reposition(self):
+        """
+        Пересчёт мест всех ждущих за один проход и пробуждение тех,
+        кому пора сообщить новое место.
+        """
+        now = time.monotonic()
+        queues = list(self._queues.values())
+        position = 0
+        round_index = 0
+        # Порядок обслуживания: по одному запросу каждого пользователя за круг
+        while queues:
+            for queue in queues:
+                position += 1
+                waiter = queue[round_index]
+                waiter.position = position
+                if waiter.report_due(now):
+                    waiter.event.set()
+            round_index += 1
+            queues = [queue for queue in queues if len(queue) > round_index]
+
+    def _admit_next(self):
+        while self.in_flight < self.max_in_flight and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            waiter.admitted = True
+            self.in_flight += 1
+            waiter.event.set()
+
+        # Очередь сдвинулась
+        self._reposition()
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.user_id]
+            self._admit_next()
+
+    async def acquire(
+        self,
+        user_id: int,
+        on_position: Optional[Callable[[int], Awaitable[None]]] = None,
+    ):
+        """
+        Дождаться места для генерации. Пока ждём, on_position получает
+        текущее место в очереди (при его изменении и не чаще position_interval).
+        """
+        if self.in_flight < self.max_in_flight and not self._queues:
+            self.in_flight += 1
+            return
+
+        waiter = _Waiter(user_id)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._reposition()
+        deadline = time.monotonic() + self.max_queue_wait
+        try:
+            while not waiter.admitted:
+                waiter.event.clear()
+                now = time.monotonic()
+                if on_position and waiter.report_due(now):
+                    waiter.reported = waiter.position
+                    waiter.next_report = now + self.position_interval
+                    await on_position(waiter.position)
+                    continue
+                remaining = deadline - now
+                if remaining <= 0:
+                    self.timeouts += 1
+                    logger.warning(f"Пользователь {user_id} не дождался очереди на генерацию")
+                    raise AdmissionTimeout(f"Очередь не подошла за {self.max_queue_wait} с")
+                timeout = remaining
+                if on_position and waiter.position != waiter.reported:
+                    # Место сменилось, но сообщать ещё рано — проснёмся к сроку
+                    timeout = min(timeout, waiter.next_report - now)
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if waiter.admitted:
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def try_acquire(self) -> bool:
+        """
+        Слот без ожидания — для фоновых генераций с самым низким приоритетом:
+        они не встают в очередь и не обгоняют ждущих пользователей.
+        """
+        if self.in_flight < self.max_in_flight and not self._queues:
+            self.in_flight += 1
+            return True
+        return False
+
+    def release(self):
+        self.in_flight -= 1
+        self._admit_next()
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, on_position: Optional[Callable[[int], Awaitable[None]]] = None):
+        await self.acquire(user_id, on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "timeouts": self.timeouts,
+        }
+
+
+_controllers: Dict[str, AdmissionController] = {}
+
+
+def get_admission_controller(provider_key: str) -> AdmissionController:
+    """
+    Отдельный контроллер на каждую конфигурацию провайдера. С процессами-
+    обработчиками у каждого своя доля LLM_MAX_IN_FLIGHT (не меньше одного).
+    """
+    controller = _controllers.get(provider_key)
+    if controller is None:
+        controller = AdmissionController(
+            max_in_flight=max(1, config.llm.MAX_IN_FLIGHT // config.processes),
+            max_queue_wait=config.llm.MAX_QUEUE_WAIT,
+            position_interval=config.llm.QUEUE_POSITION_INTERVAL,
+        )
+        _controllers[provider_key] = controller
+    return controller
+
+
+def admission_stats() -> Dict[str, Dict[str, int]]:
+    """Счётчики всех контроллеров по ключам провайдеров."""
+    return {key: controller.stats() for key, controller in _controllers.items()}
@@ -0,0 +1,295 @@
+"""
+Кэш озвучки: LRU в памяти + ограниченный по размеру кэш на диске
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def audio_cache_key(text: str, language: str, voice: str, emotion: str, speed: float, fmt: str) -> str:
+    """
+    Ключ по содержимому: хэш нормализованного текста и параметров голоса.
+    Пробельные различия не меняют озвучку, поэтому текст нормализуется.
+    """
+    normalized = " ".join(text.split())
+    raw = "\x1f".join([normalized, language, voice, emotion, f"{speed:g}", fmt])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Двухуровневый кэш аудио:
+    — в памяти: LRU, ограниченный суммарным размером memory_max_bytes
+    — на диске (если задан directory): файлы <key>.<fmt>, при превышении
+      disk_max_bytes удаляются самые давно использованные
+
+    Дополнительно хранит file_id, который Telegram вернул для уже загруженного
+    аудио (в памяти и файлом <key>.fileid на диске): повторно такое аудио
+    отправляется по file_id, без синтеза и без загрузки байтов.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str],
+        memory_max_bytes: int,
+        disk_max_bytes: int,
+        fmt: str = "mp3",
+        max_file_ids: int = 10000,
+    ):
+        self.directory = directory or None
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.fmt = fmt
+        self.max_file_ids = max_file_ids
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # Каталог создаётся лениво при первой записи
+        if self.directory and os.path.isdir(self.directory):
+            self._disk_bytes = sum(
+                entry.stat().st_size for entry in os.scandir(self.directory)
+                if entry.is_file() and entry.name.endswith(f".{fmt}")
+            )
+
+    @property
+    def disk_enabled(self) -> bool:
+        return self.directory is not None
+
+    def path_for(self, key: str, suffix: Optional[str] = None) -> Optional[str]:
+        """Путь к файлу на диске для ключа (если дисковый уровень включён)."""
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, f"{key}.{suffix or self.fmt}")
+
+    def get_file_id(self, key: str) -> Optional[str]:
+        """file_id уже загруженного в Telegram аудио для ключа."""
+        with self._lock:
+            file_id = self._file_ids.get(key)
+            if file_id is not None:
+                self._file_ids.move_to_end(key)
+                return file_id
+
+        path = self.path_for(key, "fileid")
+        if not path:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                file_id = f.read().strip() or None
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.error(f"Ошибка чтения file_id {path}: {e}")
+            return None
+        if file_id:
+            with self._lock:
+                self._remember_file_id(key, file_id)
+        return file_id
+
+    def put_file_id(self, key: str, file_id: str):
+        with self._lock:
+            self._remember_file_id(key, file_id)
+        path = self.path_for(key, "fileid")
+        if not path:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(file_id)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Ошибка записи file_id {path}: {e}")
+
+    def forget_file_id(self, key: str):
+        """Забыть file_id (например, если Telegram его больше не принимает)."""
+        with self._lock:
+            self._file_ids.pop(key, None)
+        path = self.path_for(key, "fileid")
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.error(f"Ошибка удаления file_id {path}: {e}")
+
+    def _remember_file_id(self, key: str, file_id: str):
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > self.max_file_ids:
+            self._file_ids.popitem(last=False)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data
+
+        data = self._read_disk(key)
+        with self._lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, data)
+        return data
+
+    def find(self, key: str) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        Аудио из кэша без чтения файла в память: (bytes, None) из памяти,
+        (None, путь) с диска или (None, None), если ключа нет.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return data, None
+
+        path = self.path_for(key)
+        if path:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                path = None
+            except OSError as e:
+                logger.error(f"Ошибка чтения кэша озвучки {path}: {e}")
+                path = None
+        with self._lock:
+            if path:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return None, path
+
+    def put_file(self, key: str, tmp_path: str) -> Optional[str]:
+        """
+        Перенести готовый файл (обычно <directory>/*.tmp) в дисковый кэш без
+        копирования и без памяти. Возвращает путь в кэше или None — тогда
+        файл остаётся на месте и удалять его должен вызывающий.
+        """
+        path = self.path_for(key)
+        if not path:
+            return None
+        try:
+            size = os.path.getsize(tmp_path)
+            # Такой файл вытеснение удалило бы сразу же (чистка идёт до 90% лимита)
+            if size > int(self.disk_max_bytes * 0.9):
+                return None
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                return path
+            os.makedirs(self.directory, exist_ok=True)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Ошибка записи кэша озвучки {path}: {e}")
+            return None
+
+        with self._lock:
+            self._disk_bytes += size
+            over_limit = self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._evict_disk()
+        return path
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._remember(key, data)
+        self._write_disk(key, data)
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self.path_for(key)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Обновляем mtime — по нему вытесняются давно неиспользуемые файлы
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.error(f"Ошибка чтения кэша озвучки {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: bytes):
+        path = self.path_for(key)
+        if not path or os.path.exists(path):
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Атомарная запись: сначала во временный файл в том же каталоге
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Ошибка записи кэша озвучки {path}: {e}")
+            return
+
+        with self._lock:
+            self._disk_bytes += len(data)
+            over_limit = self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """Удаляем самые давно использованные файлы до 90% лимита."""
+        entries = [
+            entry for entry in os.scandir(self.directory)
+            if entry.is_file() and entry.name.endswith(f".{self.fmt}")
+        ]
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+                # file_id вытесняем вместе с аудио, чтобы каталог не рос без предела
+                sidecar = os.path.splitext(entry.path)[0] + ".fileid"
+                if os.path.exists(sidecar):
+                    os.remove(sidecar)
+            except OSError as e:
+                logger.error(f"Ошибка удаления файла кэша озвучки {entry.path}: {e}")
+        with self._lock:
+            self._disk_bytes = total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "file_ids": len(self._file_ids),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
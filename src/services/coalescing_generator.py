@@ -0,0 +1,155 @@
+# src/services/coalescing_generator.py
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from .story_generator import StoryGenerator, normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+
+class _SharedStream:
+    """Один поток от провайдера, который могут читать несколько получателей."""
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            logger.error(f"Ошибка общего потока генерации: {e}")
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Все куски с начала, затем новые по мере поступления; обрыв источника — его ошибка."""
+        position = 0
+        while True:
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class CoalescingStoryGenerator(StoryGenerator):
+    """
+    Склейка одинаковых одновременных запросов (single-flight): пока идёт
+    генерация по промпту, такие же запросы (с точностью до регистра и пробелов,
+    при тех же настройках провайдера) ждут её результат, а не идут к LLM.
+
+    С distinct_samples=True каждый ждущий получает свой вариант: запросы,
+    пришедшие в течение batch_window, уходят одним вызовом agenerate_stories.
+    """
+
+    def __init__(self, inner: StoryGenerator, distinct_samples: bool = False, batch_window: float = 0.05):
+        self.inner = inner
+        self.distinct_samples = distinct_samples
+        self.batch_window = batch_window
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._streams: Dict[Tuple[str, str], _SharedStream] = {}
+        self._batches: Dict[Tuple[str, str], List[asyncio.Future]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.coalesced = 0
+
+    def settings_key(self) -> str:
+        return self.inner.settings_key()
+
+    def _key(self, prompt: str) -> Tuple[str, str]:
+        return normalize_prompt(prompt), self.inner.settings_key()
+
+    def _release(self, registry: dict, key, value):
+        if registry.get(key) is value:
+            del registry[key]
+
+    def generate_story(self, prompt: str) -> Optional[str]:
+        return self.inner.generate_story(prompt)
+
+    async def agenerate_story(self, prompt: str) -> Optional[str]:
+        if self.distinct_samples:
+            return await self._sample(prompt)
+
+        key = self._key(prompt)
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.inner.agenerate_story(prompt))
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._release(self._inflight, key, f))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ждущего не обрывает запрос для остальных
+        return await asyncio.shield(future)
+
+    async def astream_story(self, prompt: str) -> AsyncIterator[str]:
+        if self.distinct_samples:
+            # Разные варианты не склеить в один поток — отдаём вариант целиком
+            story = await self._sample(prompt)
+            if story:
+                yield story
+            return
+
+        key = self._key(prompt)
+        stream = self._streams.get(key)
+        if stream is None:
+            stream = _SharedStream(self.inner.astream_story(prompt))
+            self._streams[key] = stream
+            stream.task.add_done_callback(lambda _: self._release(self._streams, key, stream))
+        else:
+            self.coalesced += 1
+        async for chunk in stream.follow():
+            yield chunk
+
+    async def _sample(self, prompt: str) -> Optional[str]:
+        key = self._key(prompt)
+        waiters = self._batches.get(key)
+        if waiters is None:
+            waiters = []
+            self._batches[key] = waiters
+            task = asyncio.ensure_future(self._run_batch(key, prompt, waiters))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            self.coalesced += 1
+
+        future = asyncio.get_running_loop().create_future()
+        waiters.append(future)
+        return await future
+
+    async def _run_batch(self, key: Tuple[str, str], prompt: str, waiters: List[asyncio.Future]):
+        await asyncio.sleep(self.batch_window)
+        self._release(self._batches, key, waiters)
+        try:
+            stories = await self.inner.agenerate_stories(prompt, len(waiters))
+        except Exception as e:
+            logger.error(f"Ошибка пакетной генерации: {e}")
+            stories = []
+        for future, story in zip(waiters, list(stories) + [None] * len(waiters)):
+            if not future.done():
+                future.set_result(story)
+
+    async def astart(self):
+        await self.inner.astart()
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+    def cleanup(self):
+        cleanup = getattr(self.inner, "cleanup", None)
+        if cleanup:
+            cleanup()
@@ -1,36 +1,49 @@
 # src/services/deepseek_service.py
 import logging
-from typing import Optional
+from typing import AsyncIterator, Optional
 from config.settings import config
-from .story_generator import StoryGenerator, SYSTEM_PROMPT
+from .http_pool import OpenAIClients, aclose_llm_http_client, chat_messages
+from .story_generator import StoryGenerator, StoryStreamError
 
 logger = logging.getLogger(__name__)
 
 class DeepSeekService(StoryGenerator):
     """Реализация через DeepSeek API (OpenAI-совместимый)."""
     def __init__(self):
-        try:
-            from openai import OpenAI  # type: ignore
-        except Exception as e:
-            raise RuntimeError("Не установлен пакет 'openai'. Добавьте его в requirements.txt") from e
-
         if not config.deepseek.API_KEY:
             logger.warning("DEEPSEEK_API_KEY не задан — DeepSeekService будет неактивен.")
 
         # DeepSeek использует OpenAI-совместимый endpoint
-        base_url = config.deepseek.BASE_URL or "https://api.deepseek.com"
-        self.client = OpenAI(api_key=config.deepseek.API_KEY, base_url=base_url)
+        self._base_url = config.deepseek.BASE_URL or "https://api.deepseek.com"
+        self._clients = OpenAIClients(config.deepseek.API_KEY, self._base_url)
 
         self.model = config.deepseek.MODEL or "deepseek-chat"
 
+    async def aclose(self):
+        await aclose_llm_http_client()
+
+    def settings_key(self) -> str:
+        return f"deepseek:{self.model}:{config.deepseek.TEMPERATURE}"
+
     def generate_story(self, prompt: str) -> Optional[str]:
         try:
-            resp = self.client.chat.completions.create(
+            resp = self._clients.sync_client.chat.completions.create(
+                model=self.model,
+                messages=chat_messages(prompt),
+                temperature=config.deepseek.TEMPERATURE,
+                max_tokens=config.deepseek.MAX_TOKENS,
+            )
+            text = resp.choices[0].message.content if resp and resp.choices else None
+            return text.strip() if text else None
+        except Exception as e:
+            logger.error(f"DeepSeek ошибка: {e}")
+            return None
+
+    async def agenerate_story(self, prompt: str) -> Optional[str]:
+        try:
+            resp = await self._clients.async_client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=chat_messages(prompt),
                 temperature=config.deepseek.TEMPERATURE,
                 max_tokens=config.deepseek.MAX_TOKENS,
             )
@@ -39,3 +52,22 @@ class DeepSeekService(StoryGenerator):
         except Exception as e:
             logger.error(f"DeepSeek ошибка: {e}")
             return None
+
+    async def astream_story(self, prompt: str) -> AsyncIterator[str]:
+        received = False
+        try:
+            stream = await self._clients.async_client.chat.completions.create(
+                model=self.model,
+                messages=chat_messages(prompt),
+                temperature=config.deepseek.TEMPERATURE,
+                max_tokens=config.deepseek.MAX_TOKENS,
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    received = True
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            if received:
+                raise StoryStreamError(f"DeepSeek: поток прерван: {e}") from e
+            logger.error(f"DeepSeek ошибка: {e}")
@@ -0,0 +1,331 @@
+# src/services/failover_generator.py
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, List, Optional, Tuple
+
+from .story_generator import StoryGenerator, StoryStreamError
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель провайдера: после failure_threshold ошибок подряд
+    размыкается на reset_timeout секунд, затем пропускает один пробный запрос.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос (в полуоткрытом состоянии — только один)."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and self._clock() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = self._clock()
+
+    def record_cancelled(self):
+        """
+        Запрос отменён до результата (проигравший хедж). Для пробного запроса
+        исход неизвестен: снова размыкаемся и ждём reset_timeout до следующей пробы.
+        """
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = self._clock()
+
+
+class LatencyTracker:
+    """Скользящее окно задержек провайдера для оценки p95."""
+
+    def __init__(self, window: int = 100, min_samples: int = 20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class _Provider:
+    __slots__ = ("name", "generator", "breaker", "latency", "first_chunk")
+
+    def __init__(self, name: str, generator: StoryGenerator, breaker: CircuitBreaker):
+        self.name = name
+        self.generator = generator
+        self.breaker = breaker
+        # Полная генерация и время до первого куска потока — разные распределения
+        self.latency = LatencyTracker()
+        self.first_chunk = LatencyTracker()
+
+
+class FailoverStoryGenerator(StoryGenerator):
+    """
+    Составной генератор: провайдеры опрашиваются по порядку, при ошибке или
+    таймауте — переход к следующему. С hedge=True, если текущий провайдер не
+    ответил за свой p95, параллельно запускается следующий и берётся первый
+    успешный ответ. Неисправные провайдеры отсекаются предохранителями.
+    """
+
+    def __init__(
+        self,
+        providers: List[Tuple[str, StoryGenerator]],
+        timeout: float,
+        hedge: bool = False,
+        hedge_default_delay: float = 8.0,
+        hedge_min_delay: float = 2.0,
+        breaker_failures: int = 3,
+        breaker_reset: float = 60.0,
+    ):
+        if not providers:
+            raise ValueError("Не задано ни одного LLM провайдера")
+        self.providers = [
+            _Provider(name, generator, CircuitBreaker(breaker_failures, breaker_reset))
+            for name, generator in providers
+        ]
+        self.timeout = timeout
+        self.hedge = hedge
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+
+    def settings_key(self) -> str:
+        return "|".join(provider.generator.settings_key() for provider in self.providers)
+
+    def _hedge_delay(self, tracker: LatencyTracker) -> float:
+        p95 = tracker.p95()
+        if p95 is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, p95)
+
+    def _next_allowed(self, providers) -> Optional[_Provider]:
+        for provider in providers:
+            if provider.breaker.allow():
+                return provider
+            logger.info(f"LLM провайдер {provider.name} пропущен: предохранитель разомкнут")
+        return None
+
+    def generate_story(self, prompt: str) -> Optional[str]:
+        remaining = iter(self.providers)
+        while (provider := self._next_allowed(remaining)) is not None:
+            started = time.monotonic()
+            try:
+                story = provider.generator.generate_story(prompt)
+            except Exception as e:
+                logger.error(f"Ошибка LLM провайдера {provider.name}: {e}")
+                story = None
+            if story:
+                provider.latency.record(time.monotonic() - started)
+                provider.breaker.record_success()
+                return story
+            provider.breaker.record_failure()
+        return None
+
+    async def _call(self, provider: _Provider, prompt: str) -> Optional[str]:
+        started = time.monotonic()
+        try:
+            story = await asyncio.wait_for(provider.generator.agenerate_story(prompt), self.timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"LLM провайдер {provider.name} не ответил за {self.timeout} с")
+            story = None
+        except asyncio.CancelledError:
+            # Проигравший хедж-запрос — это не ошибка провайдера
+            provider.breaker.record_cancelled()
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка LLM провайдера {provider.name}: {e}")
+            story = None
+
+        if story:
+            provider.latency.record(time.monotonic() - started)
+            provider.breaker.record_success()
+        else:
+            provider.breaker.record_failure()
+        return story
+
+    async def agenerate_story(self, prompt: str) -> Optional[str]:
+        remaining = iter(self.providers)
+        running = {}
+
+        def launch() -> bool:
+            provider = self._next_allowed(remaining)
+            if provider is None:
+                return False
+            running[asyncio.ensure_future(self._call(provider, prompt))] = provider
+            return True
+
+        if not launch():
+            return None
+
+        try:
+            while running:
+                hedge_after = None
+                if self.hedge and len(running) == 1:
+                    hedge_after = self._hedge_delay(next(iter(running.values())).latency)
+
+                done, _ = await asyncio.wait(
+                    running, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # Текущий провайдер медлит дольше p95 — страхуемся следующим
+                    if launch():
+                        logger.info("Отправлен хедж-запрос к следующему LLM провайдеру")
+                    else:
+                        # Страховать некем — просто ждём без дедлайна
+                        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    running.pop(task)
+                    story = task.result()
+                    if story:
+                        return story
+
+                if not running:
+                    launch()
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _open_stream(self, provider: _Provider, prompt: str):
+        """
+        Поток провайдера и его первый кусок. None — поток пуст, упал или
+        не начался за timeout секунд.
+        """
+        stream = provider.generator.astream_story(prompt)
+        started = time.monotonic()
+        try:
+            first = await asyncio.wait_for(stream.__anext__(), self.timeout)
+        except StopAsyncIteration:
+            first = None
+        except asyncio.TimeoutError:
+            logger.error(f"LLM провайдер {provider.name} не начал ответ за {self.timeout} с")
+            first = None
+        except asyncio.CancelledError:
+            # Проигравший хедж-запрос — это не ошибка провайдера
+            provider.breaker.record_cancelled()
+            await stream.aclose()
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка LLM провайдера {provider.name}: {e}")
+            first = None
+
+        if first is None:
+            provider.breaker.record_failure()
+            await stream.aclose()
+            return None
+        provider.first_chunk.record(time.monotonic() - started)
+        provider.breaker.record_success()
+        return stream, first
+
+    async def astream_story(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Потоковый режим: у провайдера timeout секунд на первый кусок, иначе
+        переход к следующему. С hedge=True, если первый кусок не пришёл за p95
+        времени до первого куска, параллельно запускается следующий провайдер
+        и читается тот поток, что начался раньше. После первого куска
+        переключаться поздно: обрыв — StoryStreamError.
+        """
+        remaining = iter(self.providers)
+        running = {}
+
+        def launch() -> bool:
+            provider = self._next_allowed(remaining)
+            if provider is None:
+                return False
+            running[asyncio.ensure_future(self._open_stream(provider, prompt))] = provider
+            return True
+
+        if not launch():
+            return
+
+        winner = None
+        try:
+            while running and winner is None:
+                hedge_after = None
+                if self.hedge and len(running) == 1:
+                    hedge_after = self._hedge_delay(next(iter(running.values())).first_chunk)
+
+                done, _ = await asyncio.wait(
+                    running, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    if launch():
+                        logger.info("Отправлен хедж-запрос потока к следующему LLM провайдеру")
+                    else:
+                        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    provider = running.pop(task)
+                    opened = task.result()
+                    if opened is None:
+                        continue
+                    if winner is None:
+                        winner = (provider, *opened)
+                    else:
+                        # Оба потока начались одновременно — лишний закрываем
+                        await opened[0].aclose()
+
+                if winner is None and not running:
+                    launch()
+        finally:
+            for task in running:
+                task.cancel()
+            for result in await asyncio.gather(*running, return_exceptions=True):
+                if isinstance(result, tuple):
+                    await result[0].aclose()
+
+        if winner is None:
+            return
+        provider, stream, first = winner
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            provider.breaker.record_failure()
+            if isinstance(e, StoryStreamError):
+                raise
+            raise StoryStreamError(f"{provider.name}: поток прерван: {e}") from e
+        finally:
+            await stream.aclose()
+
+    async def astart(self):
+        for provider in self.providers:
+            await provider.generator.astart()
+
+    async def aclose(self):
+        for provider in self.providers:
+            await provider.generator.aclose()
+
+    def cleanup(self):
+        for provider in self.providers:
+            cleanup = getattr(provider.generator, "cleanup", None)
+            if cleanup:
+                cleanup()
@@ -1,8 +1,8 @@
 # src/services/gemini_service.py
 import logging
-from typing import Optional
+from typing import AsyncIterator, Optional
 from config.settings import config
-from .story_generator import StoryGenerator, SYSTEM_PROMPT
+from .story_generator import StoryGenerator, StoryStreamError, SYSTEM_PROMPT
 
 logger = logging.getLogger(__name__)
 
@@ -19,20 +19,70 @@ class GeminiService(StoryGenerator):
 
         genai.configure(api_key=config.gemini.API_KEY)
         model_name = config.gemini.MODEL or "gemini-1.5-flash"
-        self.model = genai.GenerativeModel(model_name)
+        self.model_name = model_name
+        # Системный промпт задаётся модели один раз, а не вклеивается в каждую реплику.
+        # Модель создаётся один раз и переиспользуется всеми запросами
+        self.model = genai.GenerativeModel(
+            model_name,
+            system_instruction=SYSTEM_PROMPT,
+            generation_config={
+                "temperature": config.gemini.TEMPERATURE,
+                "max_output_tokens": config.gemini.MAX_TOKENS,
+            },
+        )
+
+    def settings_key(self) -> str:
+        return f"gemini:{self.model_name}:{config.gemini.TEMPERATURE}"
+
+    @staticmethod
+    def _build_input(prompt: str) -> str:
+        return f"Пользовательская тема: {prompt}"
+
+    @staticmethod
+    def _chunk_text(resp) -> str:
+        """
+        Текст первого кандидата напрямую из parts: resp.text делает то же
+        с лишними проверками и бросает исключение на пустом ответе.
+        """
+        candidates = resp.candidates
+        if not candidates:
+            return ""
+        parts = candidates[0].content.parts
+        if len(parts) == 1:
+            return parts[0].text
+        return "".join(part.text for part in parts)
+
+    @classmethod
+    def _extract_text(cls, resp) -> Optional[str]:
+        text = cls._chunk_text(resp).strip()
+        return text or None
 
     def generate_story(self, prompt: str) -> Optional[str]:
         try:
-            # Для Gemini передаём system-prompt в первой реплике вместе
-            text_input = f"{SYSTEM_PROMPT}\n\nПользовательская тема: {prompt}"
-            resp = self.model.generate_content(text_input)
-            # У разных версий SDK способ доступа к тексту немного отличается:
-            if hasattr(resp, "text"):
-                text = resp.text
-            else:
-                # fallback
-                text = "".join([p.text for p in getattr(resp, "candidates", []) if getattr(p, "text", None)]) or None
-            return text.strip() if text else None
+            resp = self.model.generate_content(self._build_input(prompt))
+            return self._extract_text(resp)
         except Exception as e:
             logger.error(f"Gemini ошибка: {e}")
             return None
+
+    async def agenerate_story(self, prompt: str) -> Optional[str]:
+        try:
+            resp = await self.model.generate_content_async(self._build_input(prompt))
+            return self._extract_text(resp)
+        except Exception as e:
+            logger.error(f"Gemini ошибка: {e}")
+            return None
+
+    async def astream_story(self, prompt: str) -> AsyncIterator[str]:
+        received = False
+        try:
+            resp = await self.model.generate_content_async(self._build_input(prompt), stream=True)
+            async for chunk in resp:
+                text = self._chunk_text(chunk)
+                if text:
+                    received = True
+                    yield text
+        except Exception as e:
+            if received:
+                raise StoryStreamError(f"Gemini: поток прерван: {e}") from e
+            logger.error(f"Gemini ошибка: {e}")
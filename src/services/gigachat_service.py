@@ -1,60 +1,222 @@
 # src/services/gigachat_service.py
+import asyncio
+import threading
 import time
 import logging
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional
 from gigachat import GigaChat
 from gigachat.models import Chat, Messages, MessagesRole
 from gigachat.exceptions import GigaChatException
 
 from config.settings import config
-from .story_generator import StoryGenerator, SYSTEM_PROMPT
+from .story_generator import StoryGenerator, StoryStreamError, SYSTEM_PROMPT
 
 logger = logging.getLogger(__name__)
 
-class GigaChatService(StoryGenerator):
-    """Реализация StoryGenerator для GigaChat."""
 
-    def __init__(self):
-        self._token_cache = {"token": None, "expires_at": 0, "client": None}
+def _create_client() -> GigaChat:
+    return GigaChat(
+        credentials=config.gigachat.AUTH_KEY,
+        scope=config.gigachat.SCOPE,
+        model=config.gigachat.MODEL,
+        verify_ssl_certs=False,
+        timeout=config.gigachat.TIMEOUT
+    )
 
-    def _get_client(self) -> GigaChat:
-        now = time.time()
-        if (self._token_cache["token"]
-            and now < self._token_cache["expires_at"]
-            and self._token_cache["client"]):
-            return self._token_cache["client"]
 
+class _PooledClient:
+    """Клиент пула и срок жизни его токена (time.time(); 0 — срок неизвестен)."""
+    __slots__ = ("client", "expires_at")
+
+    def __init__(self, client: GigaChat):
+        self.client = client
+        self.expires_at = 0.0
+
+
+class GigaChatClientPool:
+    """
+    Пул асинхронных клиентов GigaChat:
+    — клиенты создаются и авторизуются заранее (start), каждый запрос
+      получает клиента в монопольное пользование
+    — фоновая задача обновляет токены за refresh_margin секунд до истечения
+      (срок берётся из ответа авторизации), поэтому запросы не ждут OAuth
+    — при выдаче клиент проверяется: закрытый заменяется новым, токен на
+      грани истечения обновляется сразу
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], GigaChat],
+        size: int,
+        refresh_margin: float = 300.0,
+        check_interval: float = 60.0,
+    ):
+        self._factory = factory
+        self.size = size
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self._clients: List[_PooledClient] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+
+    def _queue(self) -> asyncio.Queue:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        return self._idle
+
+    async def _authorize(self, pooled: _PooledClient, force: bool = False):
+        if force:
+            # SDK обновляет токен только когда он уже почти истёк — сбрасываем заранее
+            pooled.client._reset_token()
+        token = await pooled.client.aget_token()
+        pooled.expires_at = token.expires_at / 1000 if token and token.expires_at else 0.0
+        self.refreshes += 1
+
+    def _expires_soon(self, pooled: _PooledClient) -> bool:
+        return bool(pooled.expires_at) and pooled.expires_at - time.time() < self.refresh_margin
+
+    @staticmethod
+    def _is_closed(pooled: _PooledClient) -> bool:
+        http_client = getattr(pooled.client, "_aclient_instance", None)
+        return bool(http_client is not None and http_client.is_closed)
+
+    async def _create(self) -> _PooledClient:
+        pooled = _PooledClient(self._factory())
+        self._clients.append(pooled)
+        try:
+            await self._authorize(pooled)
+        except BaseException:
+            await self._discard(pooled)
+            raise
+        return pooled
+
+    async def _discard(self, pooled: _PooledClient):
+        if pooled in self._clients:
+            self._clients.remove(pooled)
         try:
-            client = GigaChat(
-                credentials=config.gigachat.AUTH_KEY,
-                scope=config.gigachat.SCOPE,
-                model=config.gigachat.MODEL,
-                verify_ssl_certs=False,
-                timeout=config.gigachat.TIMEOUT
-            )
-            client.__enter__()
-            self._token_cache.update({
-                "token": client.token,
-                "expires_at": now + 30 * 60,
-                "client": client
-            })
-            return client
+            await pooled.client.aclose()
         except Exception as e:
-            logger.error(f"Ошибка создания GigaChat клиента: {e}")
+            logger.error(f"Ошибка при закрытии GigaChat клиента: {e}")
+
+    async def start(self):
+        """
+        Запуск фонового обновления токенов и прогрев пула. Задача обновления
+        стартует до прогрева: если авторизация сейчас недоступна, она
+        досоздаст клиентов позже, и запросы не будут ждать OAuth.
+        """
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+        await self._fill()
+
+    async def _fill(self):
+        idle = self._queue()
+        while len(self._clients) < self.size:
+            idle.put_nowait(await self._create())
+
+    async def _checkout(self) -> _PooledClient:
+        idle = self._queue()
+        if idle.empty() and len(self._clients) < self.size:
+            return await self._create()
+
+        pooled = await idle.get()
+        try:
+            if self._is_closed(pooled):
+                await self._discard(pooled)
+                return await self._create()
+            if self._expires_soon(pooled):
+                await self._authorize(pooled, force=True)
+        except BaseException:
+            if pooled in self._clients:
+                idle.put_nowait(pooled)
             raise
+        return pooled
+
+    @asynccontextmanager
+    async def client(self) -> AsyncIterator[GigaChat]:
+        pooled = await self._checkout()
+        try:
+            yield pooled.client
+        finally:
+            if pooled in self._clients:
+                self._queue().put_nowait(pooled)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            idle = self._queue()
+            # Обновляем только свободных клиентов; занятые проверятся при следующей выдаче
+            for _ in range(idle.qsize()):
+                pooled = idle.get_nowait()
+                try:
+                    if self._expires_soon(pooled):
+                        await self._authorize(pooled, force=True)
+                except Exception as e:
+                    logger.error(f"Ошибка обновления токена GigaChat: {e}")
+                finally:
+                    idle.put_nowait(pooled)
+            # Клиенты, которых не удалось создать при прогреве
+            try:
+                await self._fill()
+            except Exception as e:
+                logger.error(f"Ошибка создания GigaChat клиента: {e}")
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        for pooled in list(self._clients):
+            await self._discard(pooled)
+        self._idle = None
+
+
+class GigaChatService(StoryGenerator):
+    """Реализация StoryGenerator для GigaChat."""
+
+    def __init__(self, client_factory: Callable[[], GigaChat] = _create_client):
+        self._client_factory = client_factory
+        # Синхронный клиент: SDK сам обновляет токен под блокировкой, клиент потокобезопасен
+        self._sync_client: Optional[GigaChat] = None
+        self._sync_lock = threading.Lock()
+        self._pool = GigaChatClientPool(
+            client_factory,
+            size=config.gigachat.POOL_SIZE,
+            refresh_margin=config.gigachat.TOKEN_REFRESH_MARGIN,
+            check_interval=config.gigachat.TOKEN_CHECK_INTERVAL,
+        )
+
+    def _get_client(self) -> GigaChat:
+        with self._sync_lock:
+            if self._sync_client is None:
+                try:
+                    self._sync_client = self._client_factory()
+                except Exception as e:
+                    logger.error(f"Ошибка создания GigaChat клиента: {e}")
+                    raise
+            return self._sync_client
+
+    def settings_key(self) -> str:
+        return f"gigachat:{config.gigachat.MODEL}:{config.gigachat.TEMPERATURE}"
+
+    def _build_chat(self, prompt: str) -> Chat:
+        return Chat(
+            messages=[
+                Messages(role=MessagesRole.SYSTEM, content=SYSTEM_PROMPT),
+                Messages(role=MessagesRole.USER, content=prompt)
+            ],
+            temperature=config.gigachat.TEMPERATURE,
+            max_tokens=config.gigachat.MAX_TOKENS
+        )
 
     def generate_story(self, prompt: str) -> Optional[str]:
         try:
             client = self._get_client()
-            chat = Chat(
-                messages=[
-                    Messages(role=MessagesRole.SYSTEM, content=SYSTEM_PROMPT),
-                    Messages(role=MessagesRole.USER, content=prompt)
-                ],
-                temperature=config.gigachat.TEMPERATURE,
-                max_tokens=config.gigachat.MAX_TOKENS
-            )
-            response = client.chat(chat)
+            response = client.chat(self._build_chat(prompt))
             story = response.choices[0].message.content
             return story.strip() if story else None
         except GigaChatException as e:
@@ -64,14 +226,64 @@ class GigaChatService(StoryGenerator):
             logger.error(f"Неожиданная ошибка GigaChat: {e}")
             return None
 
+    async def agenerate_story(self, prompt: str) -> Optional[str]:
+        try:
+            async with self._pool.client() as client:
+                response = await client.achat(self._build_chat(prompt))
+            story = response.choices[0].message.content
+            return story.strip() if story else None
+        except GigaChatException as e:
+            logger.error(f"GigaChat API ошибка: {e}")
+            return None
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка GigaChat: {e}")
+            return None
+
+    async def astream_story(self, prompt: str) -> AsyncIterator[str]:
+        received = False
+        try:
+            async with self._pool.client() as client:
+                async for chunk in client.astream(self._build_chat(prompt)):
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        received = True
+                        yield chunk.choices[0].delta.content
+        except GigaChatException as e:
+            if received:
+                raise StoryStreamError(f"GigaChat: поток прерван: {e}") from e
+            logger.error(f"GigaChat API ошибка: {e}")
+        except Exception as e:
+            if received:
+                raise StoryStreamError(f"GigaChat: поток прерван: {e}") from e
+            logger.error(f"Неожиданная ошибка GigaChat: {e}")
+
+    async def astart(self):
+        try:
+            await self._pool.start()
+        except Exception as e:
+            # Не мешаем запуску бота: клиенты досоздадутся при первых запросах
+            logger.error(f"Не удалось прогреть пул GigaChat клиентов: {e}")
+
+    async def aclose(self):
+        await self._pool.close()
+
     def cleanup(self):
-        if self._token_cache["client"]:
+        if self._sync_client is not None:
             try:
-                self._token_cache["client"].__exit__(None, None, None)
+                self._sync_client.close()
             except Exception as e:
                 logger.error(f"Ошибка при закрытии GigaChat клиента: {e}")
             finally:
-                self._token_cache = {"token": None, "expires_at": 0, "client": None}
+                self._sync_client = None
+
+_gigachat_service: Optional[GigaChatService] = None
+
 
-# экспорт совместимости (если где-то ещё импортируется gigachat_service)
-gigachat_service = GigaChatService()
+def __getattr__(name: str):
+    # экспорт совместимости (если где-то ещё импортируется gigachat_service):
+    # экземпляр создаётся при первом обращении, а не при импорте модуля
+    global _gigachat_service
+    if name == "gigachat_service":
+        if _gigachat_service is None:
+            _gigachat_service = GigaChatService()
+        return _gigachat_service
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,99 @@
+# src/services/http_pool.py
+"""
+Общий пул HTTP-соединений для OpenAI-совместимых провайдеров
+"""
+import os
+from typing import List, Optional
+
+import httpx
+
+from config.settings import config
+from .story_generator import SYSTEM_PROMPT
+
+_client: Optional[httpx.AsyncClient] = None
+_client_pid: Optional[int] = None
+
+
+def get_llm_http_client() -> httpx.AsyncClient:
+    """
+    Один httpx.AsyncClient на процесс: keep-alive соединения переиспользуются
+    всеми запросами к OpenAI и DeepSeek. После fork создаётся заново —
+    сокеты родителя дочернему процессу не годятся.
+    """
+    global _client, _client_pid
+    if _client is None or _client.is_closed or _client_pid != os.getpid():
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.llm.HTTP_POOL_SIZE,
+                max_keepalive_connections=config.llm.HTTP_POOL_SIZE,
+                keepalive_expiry=config.llm.HTTP_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(config.llm.READ_TIMEOUT, connect=config.llm.CONNECT_TIMEOUT),
+        )
+        _client_pid = os.getpid()
+    return _client
+
+
+async def aclose_llm_http_client():
+    """Закрытие пула при остановке бота (повторный вызов безопасен)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def chat_messages(prompt: str) -> List[dict]:
+    """Сообщения чата для OpenAI-совместимого API: системный промпт и запрос."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+class OpenAIClients:
+    """
+    Клиенты OpenAI-совместимого API одного провайдера:
+    — асинхронный работает поверх общего пула соединений процесса
+      и пересоздаётся вместе с ним
+    — синхронный (со своим пулом) создаётся лениво: он нужен только
+      запасному generate_story
+    Повторы с экспоненциальной задержкой и джиттером (и с учётом
+    Retry-After) выполняет сам SDK, их число — LLM_MAX_RETRIES.
+    """
+
+    def __init__(self, api_key: str, base_url: Optional[str]):
+        try:
+            from openai import AsyncOpenAI, OpenAI  # type: ignore
+        except Exception as e:
+            raise RuntimeError("Не установлен пакет 'openai'. Добавьте его в requirements.txt") from e
+        self.api_key = api_key
+        self.base_url = base_url
+        self._async_class = AsyncOpenAI
+        self._sync_class = OpenAI
+        self._async_client = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        self._sync_client = None
+
+    @property
+    def async_client(self):
+        http_client = get_llm_http_client()
+        if self._async_client is None or self._async_http_client is not http_client:
+            self._async_client = self._async_class(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                http_client=http_client,
+                max_retries=config.llm.MAX_RETRIES,
+            )
+            self._async_http_client = http_client
+        return self._async_client
+
+    @property
+    def sync_client(self):
+        if self._sync_client is None:
+            self._sync_client = self._sync_class(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=httpx.Timeout(config.llm.READ_TIMEOUT, connect=config.llm.CONNECT_TIMEOUT),
+                max_retries=config.llm.MAX_RETRIES,
+            )
+        return self._sync_client
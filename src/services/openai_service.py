@@ -1,36 +1,49 @@
 # src/services/openai_service.py
 import logging
-from typing import Optional
+from typing import AsyncIterator, List, Optional
 from config.settings import config
-from .story_generator import StoryGenerator, SYSTEM_PROMPT
+from .http_pool import OpenAIClients, aclose_llm_http_client, chat_messages
+from .story_generator import StoryGenerator, StoryStreamError
 
 logger = logging.getLogger(__name__)
 
 class OpenAIService(StoryGenerator):
     """Реализация через OpenAI API (совместимый клиент)."""
     def __init__(self):
-        try:
-            from openai import OpenAI  # type: ignore
-        except Exception as e:
-            raise RuntimeError("Не установлен пакет 'openai'. Добавьте его в requirements.txt") from e
-
         if not config.openai.API_KEY:
             logger.warning("OPENAI_API_KEY не задан — OpenAIService будет неактивен.")
 
-        base_url = config.openai.BASE_URL or None  # можно переопределять для прокси/совместимых API
-        self.client = OpenAI(api_key=config.openai.API_KEY, base_url=base_url)
+        self._base_url = config.openai.BASE_URL or None  # можно переопределять для прокси/совместимых API
+        self._clients = OpenAIClients(config.openai.API_KEY, self._base_url)
 
         # модель по умолчанию
         self.model = config.openai.MODEL or "gpt-4o-mini"
 
+    async def aclose(self):
+        await aclose_llm_http_client()
+
+    def settings_key(self) -> str:
+        return f"openai:{self.model}:{config.openai.TEMPERATURE}"
+
     def generate_story(self, prompt: str) -> Optional[str]:
         try:
-            resp = self.client.chat.completions.create(
+            resp = self._clients.sync_client.chat.completions.create(
+                model=self.model,
+                messages=chat_messages(prompt),
+                temperature=config.openai.TEMPERATURE,
+                max_tokens=config.openai.MAX_TOKENS,
+            )
+            text = resp.choices[0].message.content if resp and resp.choices else None
+            return text.strip() if text else None
+        except Exception as e:
+            logger.error(f"OpenAI ошибка: {e}")
+            return None
+
+    async def agenerate_story(self, prompt: str) -> Optional[str]:
+        try:
+            resp = await self._clients.async_client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=chat_messages(prompt),
                 temperature=config.openai.TEMPERATURE,
                 max_tokens=config.openai.MAX_TOKENS,
             )
@@ -39,3 +52,39 @@ class OpenAIService(StoryGenerator):
         except Exception as e:
             logger.error(f"OpenAI ошибка: {e}")
             return None
+
+    async def agenerate_stories(self, prompt: str, n: int) -> List[Optional[str]]:
+        # OpenAI возвращает n вариантов за один запрос (параметр n)
+        try:
+            resp = await self._clients.async_client.chat.completions.create(
+                model=self.model,
+                messages=chat_messages(prompt),
+                temperature=config.openai.TEMPERATURE,
+                max_tokens=config.openai.MAX_TOKENS,
+                n=n,
+            )
+            texts = [choice.message.content for choice in resp.choices] if resp else []
+        except Exception as e:
+            logger.error(f"OpenAI ошибка: {e}")
+            texts = []
+        stories = [text.strip() if text else None for text in texts]
+        return (stories + [None] * n)[:n]
+
+    async def astream_story(self, prompt: str) -> AsyncIterator[str]:
+        received = False
+        try:
+            stream = await self._clients.async_client.chat.completions.create(
+                model=self.model,
+                messages=chat_messages(prompt),
+                temperature=config.openai.TEMPERATURE,
+                max_tokens=config.openai.MAX_TOKENS,
+                stream=True,
+            )
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    received = True
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            if received:
+                raise StoryStreamError(f"OpenAI: поток прерван: {e}") from e
+            logger.error(f"OpenAI ошибка: {e}")
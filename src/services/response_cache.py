@@ -0,0 +1,161 @@
+"""
+Кэш готовых сказок по нормализованному промпту пользователя
+"""
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from src.utils.formatters import ParsedStory
+
+
+def cache_prompt_key(prompt: str) -> str:
+    """
+    Промпт без различий в регистре, пунктуации и пробелах:
+    «про котика», «Про котика!» и «про  котика » дают один ключ.
+    """
+    text = prompt.casefold().replace("ё", "е")
+    # Знаки препинания и символы (эмодзи, кавычки) заменяем пробелом
+    text = "".join(
+        " " if unicodedata.category(char)[0] in "PSC" else char
+        for char in text
+    )
+    return " ".join(text.split())
+
+
+class ServedStory:
+    """
+    Готовая сказка с учётом выдачи: одну сказку получают не больше max_uses
+    разных пользователей, одному пользователю она не выдаётся дважды.
+    Общая основа пула сказок и обоих кэшей.
+    """
+    __slots__ = ("story", "served")
+
+    def __init__(self, story: ParsedStory, author: Optional[int] = None):
+        self.story = story
+        # author — автор запроса: ему сказка уже отправлена
+        self.served: Set[int] = set() if author is None else {author}
+
+    def available_to(self, user_id: int) -> bool:
+        return user_id not in self.served
+
+    def serve(self, user_id: int, max_uses: int) -> bool:
+        """Отметить выдачу; True — сказка исчерпана и её пора убрать."""
+        self.served.add(user_id)
+        return self.used_up(max_uses)
+
+    def used_up(self, max_uses: int) -> bool:
+        return len(self.served) >= max_uses
+
+
+class _CachedStory(ServedStory):
+    __slots__ = ("expires_at",)
+
+    def __init__(self, story: ParsedStory, expires_at: float, author: Optional[int] = None):
+        super().__init__(story, author)
+        self.expires_at = expires_at
+
+
+class StoryResponseCache:
+    """
+    LRU-кэш сказок по своим темам пользователей:
+    — ключ: нормализованный промпт и настройки генератора (провайдер, модель,
+      температура), поэтому ответы разных моделей не смешиваются
+    — запись живёт ttl секунд, всего записей не больше max_size
+    — выдача сказок учитывается через ServedStory (max_uses)
+
+    Если подключён семантический кэш (attach_semantic), запросы идут в него:
+    пересказ темы тоже получает готовую сказку, а точный повтор — частный
+    случай близости, так что учёт выданных сказок остаётся одним.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        max_uses: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_uses = max_uses
+        self._clock = clock
+        self._entries: "OrderedDict[Tuple[str, str], _CachedStory]" = OrderedDict()
+        self.semantic = None
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.max_uses > 0
+
+    def get(self, prompt: str, settings_key: str, user_id: int) -> Optional[ParsedStory]:
+        """Сказка на такой же промпт, которую пользователь ещё не получал, или None."""
+        if not self.enabled:
+            return None
+        if self.semantic is not None:
+            story = self.semantic.get(prompt, settings_key, user_id)
+            if story is None:
+                self.misses += 1
+            else:
+                self.semantic_hits += 1
+            return story
+
+        key = (cache_prompt_key(prompt), settings_key)
+        cached = self._entries.get(key)
+        if cached is not None and cached.expires_at <= self._clock():
+            del self._entries[key]
+            cached = None
+        if cached is None or not cached.available_to(user_id):
+            self.misses += 1
+            return None
+
+        if cached.serve(user_id, self.max_uses):
+            del self._entries[key]
+        else:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return cached.story
+
+    def put(self, prompt: str, settings_key: str, story: ParsedStory, user_id: Optional[int] = None):
+        """
+        Запомнить свежую сказку (заменяет прежнюю по тому же ключу).
+        user_id — автор запроса: ему эта сказка уже отправлена.
+        """
+        if not self.enabled:
+            return
+        if self.semantic is not None:
+            self.semantic.put(prompt, settings_key, story, user_id)
+            return
+
+        key = (cache_prompt_key(prompt), settings_key)
+        cached = _CachedStory(story, self._clock() + self.ttl, user_id)
+        if cached.used_up(self.max_uses):
+            self._entries.pop(key, None)
+            return
+        self._entries[key] = cached
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def attach_semantic(self, semantic):
+        """Подключить семантический кэш (SemanticStoryCache) вторым уровнем."""
+        self.close()
+        self.semantic = semantic
+
+    def close(self):
+        if self.semantic is not None:
+            self.semantic.close()
+            self.semantic = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "stories": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+        }
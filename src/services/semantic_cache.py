@@ -0,0 +1,413 @@
+"""
+Семантический кэш сказок: пересказы одной темы («сказка про дракона»,
+«придумай про доброго дракона») получают уже написанную сказку.
+
+Промпт превращается в вектор TF-IDF по символьным n-граммам (хэшированным
+в фиксированное число измерений), ближайший сосед ищется скалярным
+произведением по всем строкам. Векторы лежат в файле, отображённом в память
+(numpy.memmap), сказки — в журнале JSON Lines рядом: при старте индекс
+открывается без пересчёта. Журнал пишет фоновый поток, так что запись
+сказки не задерживает цикл событий.
+
+NumPy — необязательная зависимость: без неё кэш просто не создаётся.
+"""
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import zlib
+from dataclasses import asdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # семантический кэш необязателен
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # не POSIX: без блокировки файла
+    fcntl = None
+
+from config.settings import config
+from src.services.response_cache import ServedStory, cache_prompt_key
+from src.utils.formatters import ParsedStory
+
+logger = logging.getLogger(__name__)
+
+NGRAM_SIZES = (3, 4)
+
+# Слова самой просьбы: без них близость определяется темой сказки.
+# Сюда же входит шаблон кнопки героя («Придумай сказку с героем: …»),
+# иначе в коротких промптах он перевешивает самого героя
+_FILLER_WORDS = frozenset((
+    "сказка", "сказку", "сказки", "сказочку", "историю", "придумай", "расскажи",
+    "напиши", "сочини", "пожалуйста", "мне", "нам", "про", "о", "об", "обо",
+    "и", "в", "на", "с", "со", "для", "героем", "герой", "героя",
+))
+
+
+def semantic_text(prompt: str) -> str:
+    """Нормализованный промпт без слов-просьб (если от него что-то остаётся)."""
+    words = cache_prompt_key(prompt).split()
+    topic = [word for word in words if word not in _FILLER_WORDS]
+    return " ".join(topic or words)
+
+
+def _same_stem(word: str, other: str) -> bool:
+    """Грубое сравнение основ: «дракона» и «драконе», «кот» и «кота»."""
+    if word == other:
+        return True
+    common = len(os.path.commonprefix([word, other]))
+    return common >= max(3, min(len(word), len(other)) - 2)
+
+
+def topics_compatible(topic: str, other: str) -> bool:
+    """
+    Темы совместимы, если слова одной покрываются словами другой: уточнение
+    («доброго дракона» к «дракона») допустимо, а расхождение с обеих сторон
+    («доброго дракона» и «злого дракона», «кот» и «пёс») — нет.
+    """
+    words, other_words = topic.split(), other.split()
+    extra = any(not any(_same_stem(w, o) for o in other_words) for w in words)
+    other_extra = any(not any(_same_stem(o, w) for w in words) for o in other_words)
+    return not (extra and other_extra)
+
+
+def _ngram_indices(text: str, dim: int) -> Dict[int, int]:
+    """Хэшированные символьные n-граммы текста с числом повторов."""
+    padded = f" {text} "
+    counts: Dict[int, int] = {}
+    for size in NGRAM_SIZES:
+        for start in range(len(padded) - size + 1):
+            # crc32 стабилен между процессами, в отличие от hash()
+            index = zlib.crc32(padded[start:start + size].encode("utf-8")) % dim
+            counts[index] = counts.get(index, 0) + 1
+    return counts
+
+
+class _Row(ServedStory):
+    __slots__ = ("topic", "settings_key", "expires_at")
+
+    def __init__(
+        self,
+        topic: str,
+        settings_key: str,
+        story: ParsedStory,
+        expires_at: float,
+        author: Optional[int] = None,
+    ):
+        super().__init__(story, author)
+        self.topic = topic
+        self.settings_key = settings_key
+        self.expires_at = expires_at
+
+
+class SemanticStoryCache:
+    """
+    Кэш сказок с поиском ближайшего по смыслу промпта:
+    — совпадением считается косинусная близость не ниже threshold при тех же
+      настройках генератора (settings_key) и совместимых словах темы
+      (topics_compatible): близкие по буквам «кот» и «кота» — да, «доброго»
+      и «злого» дракона — нет
+    — не больше capacity сказок: новая запись занимает самую старую строку
+    — запись живёт ttl секунд, выдача учитывается через ServedStory (max_uses)
+
+    Веса IDF берутся по накопленным документам на момент записи, поэтому
+    векторы не пересчитываются при добавлении новых тем.
+    path=None — индекс только в памяти.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str],
+        capacity: int,
+        dim: int,
+        threshold: float,
+        ttl: float,
+        max_uses: int = 3,
+        clock: Callable[[], float] = time.time,
+    ):
+        if np is None:
+            raise RuntimeError("Для семантического кэша нужен пакет numpy")
+        self.path = path or None
+        self.capacity = capacity
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_uses = max_uses
+        self._clock = clock
+
+        self._rows: List[Optional[_Row]] = [None] * capacity
+        self._df = np.zeros(dim, dtype=np.float64)
+        self._docs = 0
+        self._next = 0
+        self._journal_lines = 0
+        self._lock_file = None
+        self.hits = 0
+        self.misses = 0
+        # Задания для потока журнала: ("append" | "rewrite", [(строка, запись)])
+        self._journal: "queue.Queue[Optional[Tuple[str, List[Tuple[int, Optional[_Row]]]]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._vectors = self._open()
+        if self.path:
+            self._writer = threading.Thread(target=self._writer_loop, name="semantic-journal", daemon=True)
+            self._writer.start()
+
+    # --- хранение ---
+
+    def _open(self):
+        if self.path and not self._lock():
+            logger.warning(f"Семантический кэш {self.path} занят другим процессом, работаю в памяти")
+            self.path = None
+        if not self.path:
+            return np.zeros((self.capacity, self.dim), dtype=np.float32)
+
+        vectors_path = f"{self.path}.vectors"
+        expected = self.capacity * self.dim * 4
+        reuse = os.path.exists(vectors_path) and os.path.getsize(vectors_path) == expected
+        vectors = np.memmap(
+            vectors_path, dtype=np.float32, mode="r+" if reuse else "w+",
+            shape=(self.capacity, self.dim),
+        )
+        if reuse:
+            self._load_journal(vectors)
+        else:
+            # Размеры индекса изменились — начинаем с пустого журнала
+            self._rewrite_journal()
+        return vectors
+
+    def _lock(self) -> bool:
+        """Монопольный доступ к файлам индекса (процессы-обработчики делят каталог)."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if fcntl is None:
+            return True
+        self._lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._lock_file.close()
+            self._lock_file = None
+            return False
+        return True
+
+    def _load_journal(self, vectors):
+        journal_path = f"{self.path}.jsonl"
+        try:
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._journal_lines += 1
+                    try:
+                        record = json.loads(line)
+                        row = record["row"]
+                        if "story" not in record:
+                            self._rows[row] = None
+                            continue
+                        data = record["story"]
+                        data["paragraphs"] = tuple(data["paragraphs"])
+                        self._rows[row] = _Row(
+                            record["topic"], record["settings"], ParsedStory(**data), record["expires_at"]
+                        )
+                        self._next = (row + 1) % self.capacity
+                    except (ValueError, KeyError, TypeError, IndexError) as e:
+                        logger.warning(f"Пропущена повреждённая запись семантического кэша: {e}")
+        except FileNotFoundError:
+            pass
+
+        now = self._clock()
+        for index, row in enumerate(self._rows):
+            if row is None or row.expires_at <= now:
+                self._rows[index] = None
+                vectors[index] = 0
+            else:
+                self._df[np.flatnonzero(vectors[index])] += 1
+                self._docs += 1
+        if self._journal_lines > 2 * self.capacity:
+            self._rewrite_journal()
+
+    @staticmethod
+    def _record(row_index: int, row: Optional[_Row]) -> Dict:
+        if row is None:
+            return {"row": row_index}
+        return {
+            "row": row_index,
+            "topic": row.topic,
+            "settings": row.settings_key,
+            "expires_at": row.expires_at,
+            "story": asdict(row.story),
+        }
+
+    def _append_journal(self, row_index: int):
+        if not self.path:
+            return
+        # Запись строки неизменяема (кроме served, который не сохраняется) —
+        # поток журнала сериализует её сам
+        self._journal.put(("append", [(row_index, self._rows[row_index])]))
+        self._journal_lines += 1
+        if self._journal_lines > 2 * self.capacity:
+            self._rewrite_journal()
+
+    def _rewrite_journal(self):
+        """Сжатие журнала до живых записей (в потоке журнала, атомарно)."""
+        live = [index for index, row in enumerate(self._rows) if row is not None]
+        # Последней пишем строку перед курсором — по ней курсор восстановится
+        live.sort(key=lambda index: (index - self._next) % self.capacity)
+        self._journal.put(("rewrite", [(index, self._rows[index]) for index in live]))
+        self._journal_lines = len(live)
+
+    def _writer_loop(self):
+        stop = False
+        while not stop:
+            jobs = [self._journal.get()]
+            # Всё, что накопилось, пишем за одно открытие файла
+            while True:
+                try:
+                    jobs.append(self._journal.get_nowait())
+                except queue.Empty:
+                    break
+            if None in jobs:
+                stop = True
+                jobs = jobs[:jobs.index(None)]
+            appends: List[Tuple[int, Optional[_Row]]] = []
+            for kind, rows in jobs:
+                if kind == "rewrite":
+                    self._write_journal(appends, "a")
+                    appends = []
+                    self._write_journal(rows, "w")
+                else:
+                    appends.extend(rows)
+            self._write_journal(appends, "a")
+
+    def _write_journal(self, rows: List[Tuple[int, Optional[_Row]]], mode: str):
+        if not rows and mode == "a":
+            return
+        journal_path = f"{self.path}.jsonl"
+        lines = "".join(
+            json.dumps(self._record(index, row), ensure_ascii=False) + "\n" for index, row in rows
+        )
+        try:
+            if mode == "a":
+                with open(journal_path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                return
+            tmp_path = f"{journal_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(lines)
+            os.replace(tmp_path, journal_path)
+        except OSError as e:
+            logger.error(f"Ошибка записи журнала семантического кэша: {e}")
+
+    # --- векторизация ---
+
+    def _vectorize(self, text: str):
+        counts = _ngram_indices(text, self.dim)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if not counts:
+            return vector, counts
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        tf = 1.0 + np.log(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+        idf = np.log((1.0 + self._docs) / (1.0 + self._df[indices])) + 1.0
+        weights = tf * idf
+        vector[indices] = weights / math.sqrt(float(weights @ weights))
+        return vector, counts
+
+    def _drop(self, row_index: int):
+        if self._rows[row_index] is None:
+            return
+        self._rows[row_index] = None
+        self._df[np.flatnonzero(self._vectors[row_index])] -= 1
+        self._docs -= 1
+        self._vectors[row_index] = 0
+
+    # --- интерфейс кэша ---
+
+    def get(self, prompt: str, settings_key: str, user_id: int) -> Optional[ParsedStory]:
+        """Сказка на близкий по смыслу промпт, которую пользователь ещё не получал, или None."""
+        if self._docs == 0:
+            self.misses += 1
+            return None
+
+        topic = semantic_text(prompt)
+        query, _ = self._vectorize(topic)
+        similarities = self._vectors @ query
+        candidates = np.flatnonzero(similarities >= self.threshold)
+        now = self._clock()
+        for index in candidates[np.argsort(-similarities[candidates])]:
+            row = self._rows[index]
+            if row is None or row.settings_key != settings_key or not row.available_to(user_id):
+                continue
+            if not topics_compatible(topic, row.topic):
+                continue
+            if row.expires_at <= now:
+                self._drop(index)
+                self._append_journal(index)
+                continue
+            if row.serve(user_id, self.max_uses):
+                self._drop(index)
+                self._append_journal(index)
+            self.hits += 1
+            return row.story
+
+        self.misses += 1
+        return None
+
+    def put(self, prompt: str, settings_key: str, story: ParsedStory, user_id: Optional[int] = None):
+        """Запомнить свежую сказку; user_id — автор запроса, ему она уже отправлена."""
+        if self.max_uses <= 1 and user_id is not None:
+            return
+
+        topic = semantic_text(prompt)
+        vector, counts = self._vectorize(topic)
+        if not counts:
+            return
+        index = self._next
+        self._next = (index + 1) % self.capacity
+        self._drop(index)
+        self._vectors[index] = vector
+        self._df[np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))] += 1
+        self._docs += 1
+
+        self._rows[index] = _Row(topic, settings_key, story, self._clock() + self.ttl, user_id)
+        self._append_journal(index)
+
+    def close(self):
+        if self._writer is not None:
+            self._journal.put(None)
+            self._writer.join(timeout=5.0)
+            self._writer = None
+        if isinstance(self._vectors, np.memmap):
+            self._vectors.flush()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "stories": self._docs,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def create_semantic_cache() -> Optional[SemanticStoryCache]:
+    """Семантический кэш по настройкам или None, если он выключен или нет numpy."""
+    if not config.story_cache.SEMANTIC:
+        return None
+    if np is None:
+        logger.warning("STORY_CACHE_SEMANTIC включён, но numpy не установлен — семантический кэш отключён")
+        return None
+    try:
+        return SemanticStoryCache(
+            path=config.story_cache.SEMANTIC_PATH,
+            capacity=config.story_cache.SEMANTIC_CAPACITY,
+            dim=config.story_cache.SEMANTIC_DIM,
+            threshold=config.story_cache.SEMANTIC_THRESHOLD,
+            ttl=config.story_cache.TTL,
+            max_uses=config.story_cache.MAX_USES,
+        )
+    except OSError as e:
+        logger.error(f"Не удалось открыть семантический кэш: {e}")
+        return None
@@ -1,6 +1,10 @@
 # src/services/story_generator.py
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List, Optional
+
+from config.settings import config
 
 SYSTEM_PROMPT = (
     "Ты — добрый сказочник. Пиши короткие добрые сказки для детей 4–6 лет "
@@ -11,8 +15,70 @@ SYSTEM_PROMPT = (
     "3) Поучительный, мягкий финал."
 )
 
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Промпт без различий в регистре и пробелах — для склейки одинаковых запросов."""
+    return " ".join(prompt.casefold().split())
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Общий ограниченный пул потоков для блокирующих вызовов LLM."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=config.llm.MAX_WORKERS,
+            thread_name_prefix="story-generator",
+        )
+    return _executor
+
+
+class StoryStreamError(Exception):
+    """Поток оборвался после первых кусков: полученный текст — не вся сказка."""
+
+
 class StoryGenerator(ABC):
     """Единый интерфейс генераторов сказок для разных LLM."""
     @abstractmethod
     def generate_story(self, prompt: str) -> Optional[str]:
         ...
+
+    def settings_key(self) -> str:
+        """Провайдер и параметры генерации: при их равенстве ответы взаимозаменяемы."""
+        return type(self).__name__
+
+    async def astart(self):
+        """Подготовка ресурсов в цикле событий бота (пулы клиентов, токены)."""
+
+    async def aclose(self):
+        """Освобождение ресурсов, привязанных к циклу событий."""
+
+    async def agenerate_story(self, prompt: str) -> Optional[str]:
+        """
+        Асинхронная генерация, не блокирующая цикл событий бота.
+        По умолчанию выполняет generate_story в общем ограниченном пуле потоков;
+        провайдеры с асинхронным SDK переопределяют метод нативно.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), self.generate_story, prompt)
+
+    async def astream_story(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Потоковая генерация: отдаёт текст сказки кусками по мере готовности.
+        По умолчанию — один кусок с результатом agenerate_story.
+
+        Ошибка до первого куска — пустой поток; ошибка после — StoryStreamError,
+        чтобы обрывок не приняли за готовую сказку.
+        """
+        story = await self.agenerate_story(prompt)
+        if story:
+            yield story
+
+    async def agenerate_stories(self, prompt: str, n: int) -> List[Optional[str]]:
+        """
+        n независимых вариантов сказки на один промпт.
+        По умолчанию — n параллельных запросов; провайдеры, умеющие
+        возвращать несколько вариантов за один вызов, переопределяют метод.
+        """
+        return list(await asyncio.gather(*(self.agenerate_story(prompt) for _ in range(n))))
@@ -1,29 +1,104 @@
 # src/services/story_generator_factory.py
-from typing import Optional
+import importlib
+import logging
+from typing import Dict, List, Optional, Tuple
 from config.settings import config
 from .story_generator import StoryGenerator
-from .gigachat_service import GigaChatService
-from .openai_service import OpenAIService
-from .deepseek_service import DeepSeekService
-from .gemini_service import GeminiService
+
+logger = logging.getLogger(__name__)
+
+# Ленивый реестр провайдеров: модуль и класс импортируются только для выбранного
+# LLM_PROVIDER, чтобы старт процесса не платил за загрузку всех SDK.
+_PROVIDERS: Dict[str, Tuple[str, str]] = {
+    "gigachat": (".gigachat_service", "GigaChatService"),
+    "openai": (".openai_service", "OpenAIService"),
+    "deepseek": (".deepseek_service", "DeepSeekService"),
+    "gemini": (".gemini_service", "GeminiService"),
+}
 
 _singleton: Optional[StoryGenerator] = None
 
+
+def create_provider(provider: str) -> StoryGenerator:
+    """Создание генератора для провайдера с импортом его модуля по требованию."""
+    try:
+        module_name, class_name = _PROVIDERS[provider]
+    except KeyError:
+        raise ValueError(f"Неизвестный LLM провайдер: {provider}") from None
+
+    module = importlib.import_module(module_name, __package__)
+    return getattr(module, class_name)()
+
+
 def get_story_generator() -> StoryGenerator:
     global _singleton
     if _singleton:
         return _singleton
 
-    provider = (config.llm.PROVIDER or "gigachat").lower()
-    if provider == "gigachat":
-        _singleton = GigaChatService()
-    elif provider == "openai":
-        _singleton = OpenAIService()
-    elif provider == "deepseek":
-        _singleton = DeepSeekService()
-    elif provider == "gemini":
-        _singleton = GeminiService()
-    else:
-        raise ValueError(f"Неизвестный LLM провайдер: {provider}")
+    generator = _create_chain(configured_providers())
+    if config.llm.COALESCE:
+        from .coalescing_generator import CoalescingStoryGenerator
 
+        generator = CoalescingStoryGenerator(
+            generator,
+            distinct_samples=config.llm.DISTINCT_SAMPLES,
+            batch_window=config.llm.COALESCE_WINDOW,
+        )
+    _singleton = generator
     return _singleton
+
+
+def _create_chain(providers: List[str]) -> StoryGenerator:
+    """Один провайдер или цепочка с переключением при отказах."""
+    if len(providers) == 1:
+        return create_provider(providers[0])
+
+    from .failover_generator import FailoverStoryGenerator
+
+    chain = []
+    for name in providers:
+        try:
+            chain.append((name, create_provider(name)))
+        except (ValueError, RuntimeError, ImportError) as e:
+            logger.error(f"LLM провайдер {name} исключён из цепочки: {e}")
+    return FailoverStoryGenerator(
+        chain,
+        timeout=config.llm.TIMEOUT,
+        hedge=config.llm.HEDGE,
+        hedge_default_delay=config.llm.HEDGE_DEFAULT_DELAY,
+        hedge_min_delay=config.llm.HEDGE_MIN_DELAY,
+        breaker_failures=config.llm.BREAKER_FAILURES,
+        breaker_reset=config.llm.BREAKER_RESET,
+    )
+
+
+def configured_providers() -> List[str]:
+    """Упорядоченная цепочка провайдеров: LLM_PROVIDERS или один LLM_PROVIDER."""
+    names = [name.strip().lower() for name in config.llm.PROVIDERS.split(",") if name.strip()]
+    if not names:
+        names = [(config.llm.PROVIDER or "gigachat").lower()]
+    # Повторы не нужны: порядок сохраняется по первому вхождению
+    return list(dict.fromkeys(names))
+
+
+def close_story_generator():
+    """Освобождение ресурсов генератора (если он уже создан)."""
+    global _singleton
+    if _singleton is None:
+        return
+    cleanup = getattr(_singleton, "cleanup", None)
+    if cleanup:
+        cleanup()
+    _singleton = None
+
+
+async def start_story_generator():
+    """Прогрев генератора в цикле событий бота (из post_init приложения)."""
+    await get_story_generator().astart()
+
+
+async def aclose_story_generator():
+    """Закрытие генератора при остановке приложения: сначала асинхронные ресурсы."""
+    if _singleton is not None:
+        await _singleton.aclose()
+    close_story_generator()
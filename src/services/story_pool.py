@@ -0,0 +1,160 @@
+"""
+Пул заранее сгенерированных сказок для кнопок с постоянными темами
+"""
+import asyncio
+import logging
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Deque, Dict, Iterable, Optional
+
+from src.services.admission import AdmissionController, get_admission_controller
+from src.services.response_cache import ServedStory
+from src.utils.formatters import ParsedStory, parse_story
+
+logger = logging.getLogger(__name__)
+
+
+class StoryPool:
+    """
+    Пул готовых (уже разобранных) сказок на каждый постоянный промпт:
+    — нажатие кнопки отдаёт сказку из пула без обращения к LLM
+    — выдача сказок учитывается через ServedStory (max_uses)
+    — пополнение идёт фоновой задачей и только когда нет живых генераций;
+      каждая фоновая генерация занимает слот AdmissionController, если он
+      свободен без очереди, поэтому LLM_MAX_IN_FLIGHT не превышается
+    """
+
+    def __init__(
+        self,
+        prompts: Iterable[str],
+        size: int,
+        max_uses: int = 5,
+        refill_interval: float = 2.0,
+        generate: Optional[Callable[[str], Awaitable[Optional[str]]]] = None,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.size = size
+        self.max_uses = max_uses
+        self.refill_interval = refill_interval
+        self._generate = generate
+        self._admission = admission
+        self._stories: Dict[str, Deque[ServedStory]] = {prompt: deque() for prompt in prompts}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0 and bool(self._stories)
+
+    def take(self, prompt: str, user_id: int) -> Optional[ParsedStory]:
+        """Сказка для пользователя, которую он ещё не получал, или None."""
+        stories = self._stories.get(prompt)
+        if stories is None:
+            return None
+
+        for pooled in stories:
+            if not pooled.available_to(user_id):
+                continue
+            if pooled.serve(user_id, self.max_uses):
+                stories.remove(pooled)
+                self._request_refill()
+            self.hits += 1
+            return pooled.story
+
+        self.misses += 1
+        return None
+
+    def add(self, prompt: str, story: ParsedStory):
+        self._stories[prompt].append(ServedStory(story))
+
+    @contextmanager
+    def live_request(self):
+        """Отметка живой генерации: пока она идёт, пул не пополняется."""
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    def _request_refill(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _next_prompt(self) -> Optional[str]:
+        """Тема с наименьшим запасом сказок, если пул по ней не полон."""
+        prompt, stories = min(self._stories.items(), key=lambda item: len(item[1]))
+        return prompt if len(stories) < self.size else None
+
+    async def refill_once(self) -> bool:
+        """Сгенерировать одну сказку для самой пустой темы; False, если пул полон."""
+        prompt = self._next_prompt()
+        if prompt is None:
+            return False
+
+        generate = self._generate
+        admission = self._admission
+        if generate is None:
+            from src.services.story_generator_factory import get_story_generator
+            generator = get_story_generator()
+            # Пулу нужны собственные варианты, а не результат чужого запроса
+            generate = getattr(generator, "inner", generator).agenerate_story
+            admission = get_admission_controller(generator.settings_key())
+
+        if admission is not None and not admission.try_acquire():
+            # Слоты заняты пользователями — попробуем после паузы
+            return True
+        try:
+            story = await generate(prompt)
+        finally:
+            if admission is not None:
+                admission.release()
+        if story:
+            parsed = parse_story(story)
+            if parsed.body:
+                self.add(prompt, parsed)
+        return True
+
+    async def _refill_loop(self):
+        while True:
+            if self._in_flight:
+                await asyncio.sleep(self.refill_interval)
+                continue
+            try:
+                refilled = await self.refill_once()
+            except Exception as e:
+                logger.error(f"Ошибка пополнения пула сказок: {e}")
+                refilled = True
+            if refilled:
+                # Фоновая генерация не должна забивать лимиты провайдера
+                await asyncio.sleep(self.refill_interval)
+                continue
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def start(self):
+        """Запуск фонового пополнения (из post_init приложения)."""
+        if not self.enabled or self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._refill_loop())
+        logger.info(f"Пул сказок запущен: {self.size} на каждую из {len(self._stories)} тем")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "stories": sum(len(stories) for stories in self._stories.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
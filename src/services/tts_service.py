@@ -1,16 +1,128 @@
 """
 Сервис для работы с Yandex Text-to-Speech API
 """
+import asyncio
+import importlib.util
+import io
 import os
+import re
 import logging
 import tempfile
-from typing import Optional, Tuple
-import requests
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional
+import httpx
 
 from config.settings import config
+from src.services.audio_cache import AudioCache, audio_cache_key
+from src.utils.formatters import ParsedStory, split_into_chunks
 
 logger = logging.getLogger(__name__)
 
+_UNSAFE_FILENAME_CHARS_RE = re.compile(r'[^\w\s-]')
+_SPACES_RE = re.compile(r'\s+')
+
+
+@dataclass
+class SynthesizedAudio:
+    """
+    Результат синтеза: аудио в памяти (data) либо файл на диске (path).
+    temporary — файл временный и удаляется после отправки; файл из
+    дискового кэша (temporary=False) удалять нельзя.
+    """
+    filename: str
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+    temporary: bool = False
+
+    def open(self) -> BinaryIO:
+        """Поток для отправки в Telegram без копирования байтов."""
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, "rb")
+
+
+def _id3v2_size(data: bytes) -> int:
+    """Размер тега ID3v2 в начале MP3 (0, если тега нет)"""
+    if len(data) < 10 or not data.startswith(b"ID3"):
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def continuation_part(part: bytes, fmt: str) -> bytes:
+    """
+    Часть аудио, которая дописывается после первой.
+    MP3 — это поток независимых фреймов: у всех частей, кроме первой,
+    снимаем тег ID3v2. OggOpus склеивается в цепочку Ogg-потоков (допустимо
+    по RFC 3533), LPCM — простая конкатенация.
+    """
+    if fmt == "mp3":
+        return part[_id3v2_size(part):]
+    return part
+
+
+class _AudioSink:
+    """
+    Приёмник аудио по кусочкам: первые limit байт копятся в памяти,
+    после этого всё дописывается во временный файл (в directory или
+    системный каталог), так что большое аудио целиком в памяти не бывает.
+    limit=None — только память (для частей длинного текста).
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = None,
+        directory: Optional[str] = None,
+        prefix: str = "",
+        suffix: str = "",
+    ):
+        self.limit = limit
+        self.directory = directory
+        self.prefix = prefix
+        self.suffix = suffix
+        self.path: Optional[str] = None
+        self.size = 0
+        self._buffer = bytearray()
+        self._file: Optional[BinaryIO] = None
+
+    @property
+    def data(self) -> bytes:
+        return bytes(self._buffer)
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        if self._file is None and (self.limit is None or self.size <= self.limit):
+            self._buffer += data
+            return
+        # Запись на диск не должна блокировать цикл событий
+        await asyncio.to_thread(self._write_file, data)
+
+    def _write_file(self, data: bytes):
+        if self._file is None:
+            if self.directory:
+                os.makedirs(self.directory, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(prefix=self.prefix, suffix=self.suffix, dir=self.directory)
+            self._file = os.fdopen(fd, "wb")
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        self._file.write(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        """Закрыть и удалить недописанный файл (при ошибке синтеза)"""
+        self.close()
+        self._buffer = bytearray()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
 class TTSService:
     """Сервис для работы с Yandex TTS API"""
     
@@ -18,28 +130,160 @@ class TTSService:
         self.api_key = config.tts.API_KEY
         self.base_url = "https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize"
         self.enabled = bool(self.api_key)
+        self._client: Optional[httpx.AsyncClient] = None
+        self.cache = AudioCache(
+            directory=config.tts.CACHE_DIR,
+            memory_max_bytes=config.tts.MEMORY_CACHE_BYTES,
+            disk_max_bytes=config.tts.CACHE_MAX_BYTES,
+            fmt=config.tts.FORMAT,
+            max_file_ids=config.tts.FILE_ID_CACHE_SIZE,
+        )
     
     def is_available(self) -> bool:
         """Проверка доступности TTS сервиса"""
         return self.enabled
     
-    def synthesize_speech(self, text: str, title: str = "Сказка") -> Optional[Tuple[bytes, str]]:
+    def cache_key(self, text: str) -> str:
+        """Ключ кэша: текст + текущие параметры голоса из TTSConfig"""
+        return audio_cache_key(
+            text,
+            config.tts.LANGUAGE,
+            config.tts.VOICE,
+            config.tts.EMOTION,
+            config.tts.SPEED,
+            config.tts.FORMAT,
+        )
+
+    @staticmethod
+    def safe_title(title: str) -> str:
+        """Название сказки, пригодное для имени файла"""
+        # Очищаем название от недопустимых символов для имени файла
+        safe_title = _UNSAFE_FILENAME_CHARS_RE.sub('', title)
+        safe_title = _SPACES_RE.sub('_', safe_title).strip()
+        return safe_title[:30] if len(safe_title) > 30 else safe_title  # Ограничиваем длину
+
+    def audio_filename(self, title: str) -> str:
+        """Имя файла для отправки аудио пользователю"""
+        return f"{self.safe_title(title) or 'skazka'}.{config.tts.FORMAT}"
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Общий асинхронный клиент с пулом keep-alive соединений.
+        HTTP/2 включается, если установлен пакет h2.
+        """
+        if self._client is None or self._client.is_closed:
+            http2 = config.tts.HTTP2 and importlib.util.find_spec("h2") is not None
+            self._client = httpx.AsyncClient(
+                headers={"Authorization": f"Api-Key {self.api_key}"},
+                limits=httpx.Limits(
+                    max_connections=config.tts.POOL_SIZE,
+                    max_keepalive_connections=config.tts.POOL_SIZE,
+                ),
+                timeout=httpx.Timeout(config.tts.REQUEST_TIMEOUT, connect=config.tts.CONNECT_TIMEOUT),
+                http2=http2,
+            )
+        return self._client
+
+    async def aclose(self):
+        """Закрытие пула соединений (при остановке бота)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def asynthesize_speech(self, text: str, title: str = "Сказка") -> Optional[SynthesizedAudio]:
         """
-        Синтез речи из текста
-        
+        Синтез речи из текста: запросы идут через общий пул соединений
+        и не блокируют цикл событий бота.
+
         Args:
             text: Текст для озвучивания
             title: Название сказки для имени файла
-            
+
         Returns:
-            Кортеж (аудио_данные, имя_файла) или None в случае ошибки
+            SynthesizedAudio или None в случае ошибки. Аудио до SPILL_BYTES
+            отдаётся из памяти; большее пишется на диск по мере получения —
+            сразу в дисковый кэш, если он включён, иначе во временный файл.
         """
         if not self.enabled:
             logger.warning("TTS сервис недоступен - не установлен API ключ")
             return None
-        
+
+        filename = self.audio_filename(title)
+        key = self.cache_key(text)
+        # Кэш может обращаться к диску — выносим в поток
+        cached, cached_path = await asyncio.to_thread(self.cache.find, key)
+        if cached is not None:
+            logger.info(f"Аудио взято из кэша: {len(cached)} байт")
+            return SynthesizedAudio(filename=filename, data=cached)
+        if cached_path is not None:
+            # Файл из кэша отправляется как есть, без чтения в память
+            logger.info(f"Аудио взято из кэша: {cached_path}")
+            return SynthesizedAudio(filename=filename, path=cached_path)
+
+        if self.cache.disk_enabled:
+            # Временный файл рядом с кэшем: в кэш он потом просто переносится
+            sink = _AudioSink(config.tts.SPILL_BYTES, self.cache.directory, suffix=".tmp")
+        else:
+            sink = _AudioSink(
+                config.tts.SPILL_BYTES,
+                prefix=f"{self.safe_title(title)}_",
+                suffix=f".{config.tts.FORMAT}",
+            )
+        chunks = split_into_chunks(text, config.tts.CHUNK_CHARS)
+        try:
+            if len(chunks) > 1:
+                ok = await self._asynthesize_chunks(chunks, sink)
+            else:
+                ok = await self._asynthesize_chunk(text, sink)
+            sink.close()
+        except BaseException:
+            await asyncio.to_thread(sink.discard)
+            raise
+        if not ok:
+            await asyncio.to_thread(sink.discard)
+            return None
+        logger.info(f"Аудио успешно синтезировано: {sink.size} байт, частей: {len(chunks)}")
+
+        if sink.path is None:
+            audio = sink.data
+            await asyncio.to_thread(self.cache.put, key, audio)
+            return SynthesizedAudio(filename=filename, data=audio)
+
+        # Большое аудио в память (и в LRU) не попадает: файл переносится в кэш
+        cached_path = await asyncio.to_thread(self.cache.put_file, key, sink.path)
+        if cached_path is not None:
+            return SynthesizedAudio(filename=filename, path=cached_path)
+        return SynthesizedAudio(filename=filename, path=sink.path, temporary=True)
+
+    async def _asynthesize_chunks(self, chunks: List[str], sink: _AudioSink) -> bool:
+        """
+        Части длинного текста синтезируются параллельно (не больше MAX_WORKERS
+        запросов), а в sink дописываются по порядку, как только готова очередная.
+        """
+        semaphore = asyncio.Semaphore(config.tts.MAX_WORKERS)
+
+        async def bounded(chunk: str) -> Optional[bytes]:
+            async with semaphore:
+                part = _AudioSink()
+                if not await self._asynthesize_chunk(chunk, part):
+                    return None
+                return part.data
+
+        tasks = [asyncio.ensure_future(bounded(chunk)) for chunk in chunks]
+        try:
+            for index, task in enumerate(tasks):
+                part = await task
+                if part is None:
+                    return False
+                await sink.write(part if index == 0 else continuation_part(part, config.tts.FORMAT))
+            return True
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _asynthesize_chunk(self, text: str, sink: _AudioSink) -> bool:
+        """Один асинхронный запрос к Yandex TTS: ответ пишется в sink по мере получения"""
         try:
-            headers = {"Authorization": f"Api-Key {self.api_key}"}
             data = {
                 "text": text,
                 "lang": config.tts.LANGUAGE,
@@ -48,45 +292,45 @@ class TTSService:
                 "speed": config.tts.SPEED,
                 "format": config.tts.FORMAT
             }
-            
-            response = requests.post(
-                self.base_url, 
-                headers=headers, 
-                data=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                # Создаем временный файл с названием сказки
-                import re
-                # Очищаем название от недопустимых символов для имени файла
-                safe_title = re.sub(r'[^\w\s-]', '', title)
-                safe_title = re.sub(r'\s+', '_', safe_title).strip()
-                safe_title = safe_title[:30] if len(safe_title) > 30 else safe_title  # Ограничиваем длину
-                
-                # Создаем временный файл с префиксом названия сказки
-                with tempfile.NamedTemporaryFile(
-                    prefix=f"{safe_title}_",
-                    suffix=".mp3", 
-                    delete=False,
-                    mode="wb"
-                ) as temp_file:
-                    temp_file.write(response.content)
-                    temp_filename = temp_file.name
-                
-                logger.info(f"Аудио успешно синтезировано: {len(response.content)} байт, файл: {temp_filename}")
-                return response.content, temp_filename
-            else:
-                logger.error(f"Ошибка TTS API: {response.status_code} - {response.text}")
-                return None
-                
-        except requests.RequestException as e:
+            async with self._get_client().stream("POST", self.base_url, data=data) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.error(f"Ошибка TTS API: {response.status_code} - {response.text}")
+                    return False
+                async for block in response.aiter_bytes():
+                    await sink.write(block)
+            return True
+
+        except httpx.HTTPError as e:
             logger.error(f"Ошибка сети при синтезе речи: {e}")
-            return None
+            return False
+        except OSError as e:
+            logger.error(f"Ошибка записи озвучки на диск: {e}")
+            return False
         except Exception as e:
             logger.error(f"Неожиданная ошибка при синтезе речи: {e}")
-            return None
-    
+            return False
+
+    async def asynthesize_story(self, story: ParsedStory) -> Optional[SynthesizedAudio]:
+        """
+        Синтез речи для уже разобранной сказки: текст без разметки
+        и короткий заголовок берутся из ParsedStory без повторного парсинга.
+        """
+        return await self.asynthesize_speech(story.tts_text, story.short_title)
+
+    # file_id хранится и в файлах-спутниках на диске — обращения выносим в поток
+
+    async def acached_file_id(self, story: ParsedStory) -> Optional[str]:
+        """file_id озвучки этой сказки, уже загруженной в Telegram, если есть"""
+        return await asyncio.to_thread(self.cache.get_file_id, self.cache_key(story.tts_text))
+
+    async def aremember_file_id(self, story: ParsedStory, file_id: str):
+        """Запомнить file_id, который Telegram вернул после загрузки озвучки"""
+        await asyncio.to_thread(self.cache.put_file_id, self.cache_key(story.tts_text), file_id)
+
+    async def aforget_file_id(self, story: ParsedStory):
+        await asyncio.to_thread(self.cache.forget_file_id, self.cache_key(story.tts_text))
+
     def cleanup_temp_file(self, filename: str):
         """Удаление временного файла"""
         try:
@@ -4,10 +4,15 @@
 — Чистим пунктуацию
 — Разбиваем на абзацы
 — Готовим Markdown-разметку (ParseMode.MARKDOWN)
+
+Форматирование выполняется в цикле событий бота, поэтому все регулярные
+выражения скомпилированы на уровне модуля, а очистка сведена к минимуму
+проходов по тексту (результат совпадает с прежним пошаговым алгоритмом).
 """
 from __future__ import annotations
 import re
-from typing import List, Tuple
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
 
 # Надёжные маркеры начала основной части сказки (регистронезависимо).
 # ВНИМАНИЕ: предлоги "в"/"во" сами по себе не используются — только в устойчивых выражениях.
@@ -24,12 +29,46 @@ _STARTER_PATTERNS = [
 
 _STARTER_REGEXES = [re.compile(pat, re.IGNORECASE) for pat in _STARTER_PATTERNS]
 
+# === Скомпилированные шаблоны ===
+# Латинские фрагменты (слова из >=2 латинских букв). Цифры/пунктуацию не трогаем.
+_LATIN_WORD_RE = re.compile(r"\b[a-z]{2,}\b", re.IGNORECASE)
+# Быстрая проверка наличия латиницы (включая символы, которые [a-z] с IGNORECASE тоже ловит)
+_LATIN_CHAR_RE = re.compile("[A-Za-z\u0130\u0131\u017f\u212a]")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([.,!?…»)])")
+_SPACE_BEFORE_CLOSING_RE = re.compile(r"\s+([»)])")
+_SPACE_AFTER_OPENING_RE = re.compile(r"([«(])\s+")
+_ELLIPSIS_RE = re.compile(r"(\.\s*){3,}")
+_REPEATED_PUNCT_RE = re.compile(r"([.!?…])\1{1,}")
+_MULTI_SPACE_RE = re.compile(r"\s{2,}")
+_TRAILING_PUNCT_RE = re.compile(r"[.,!?…\s]+$")
+_SENTENCE_END_RE = re.compile(r"[.!?…]")
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…])\s+(?=[«"“(—\-]*[А-ЯЁ])')
+_UNSAFE_TITLE_CHARS_RE = re.compile(r"[^\w\s\-]", re.UNICODE)
+# Маркеры сущностей ParseMode.MARKDOWN (legacy) и экранированные символы
+_MARKDOWN_MARKER_RE = re.compile(r"\\.|```|[*_`]")
+
+# Уже-жирный заголовок: на своей строке или в одной строке с текстом
+_BOLD_TITLE_REGEXES = [
+    # **Заголовок**\n\nТекст
+    re.compile(r"^\s*(\*{2})(.+?)\1\s*\n+\s*(.*)$", re.DOTALL),
+    # *Заголовок*\nТекст
+    re.compile(r"^\s*(\*)(.+?)\1\s*\n+\s*(.*)$", re.DOTALL),
+    # **Заголовок** Текст (в одной строке)
+    re.compile(r"^\s*(\*{2})(.+?)\1\s*(.+)$", re.DOTALL),
+    # *Заголовок* Текст (в одной строке)
+    re.compile(r"^\s*(\*)(.+?)\1\s*(.+)$", re.DOTALL),
+]
 
-def _sanitize_newlines(text: str) -> str:
-    text = text.replace("\r\n", "\n").replace("\r", "\n")
-    # Нормализуем множественные пустые строки до одной
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    return text
+# Замены за один проход str.translate
+_TITLE_MARKUP_TABLE = str.maketrans("", "", "*_")
+_PLAIN_TEXT_TABLE = str.maketrans("", "", "*_`[]")
+_LEGACY_MARKDOWN_TABLE = str.maketrans({
+    "*": "✱",
+    "_": " ",
+    "`": "ʼ",
+    "[": "〖",
+    "]": "〗",
+})
 
 
 def clean_story_text(text: str) -> str:
@@ -44,30 +83,30 @@ def clean_story_text(text: str) -> str:
     if not text:
         return ""
 
-    text = _sanitize_newlines(text)
+    # Серии пустых строк всё равно схлопываются итоговой нормализацией
+    # пробелов, поэтому здесь достаточно привести переводы строк к "\n".
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if "\t" in text:
+        text = text.replace("\t", " ")
 
     # Удаляем латинские фрагменты (слова из >=2 латинских букв).
-    # Не трогаем цифры/пунктуацию.
-    text = re.sub(r"(?i)\b[a-z]{2,}\b", "", text)
-
-    # Убираем лишние пробелы
-    text = re.sub(r"[ \t]+", " ", text)
+    if _LATIN_CHAR_RE.search(text):
+        text = _LATIN_WORD_RE.sub("", text)
 
-    # Пробелы перед пунктуацией -> убрать
-    text = re.sub(r"\s+([.,!?…])", r"\1", text)
+    # Пробелы перед пунктуацией и закрывающими кавычками/скобками -> убрать
+    text = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", text)
     # Пробел после открывающих кавычек/скобок
-    text = re.sub(r"([«(])\s+", r"\1", text)
-    # Пробел перед закрывающими кавычками/скобками
-    text = re.sub(r"\s+([»)])", r"\1", text)
+    text = _SPACE_AFTER_OPENING_RE.sub(r"\1", text)
 
-    # Многоточия
-    text = re.sub(r"(\.\s*){3,}", "…", text)
+    # Многоточия: пробелы между точками уже убраны, так что хватает поиска подстроки
+    if "..." in text:
+        text = _ELLIPSIS_RE.sub("…", text)
 
     # Повторы знаков пунктуации
-    text = re.sub(r"([.!?…])\1{1,}", r"\1", text)
+    text = _REPEATED_PUNCT_RE.sub(r"\1", text)
 
     # Сдвоенные пробелы → один
-    text = re.sub(r"\s{2,}", " ", text)
+    text = _MULTI_SPACE_RE.sub(" ", text)
 
     return text.strip()
 
@@ -78,29 +117,14 @@ def _detect_bold_title_at_start(text: str) -> Tuple[str | None, str]:
     аккуратно достаём его. Поддерживаем варианты: заголовок на своей строке,
     либо заголовок и текст в одной строке.
     """
-    # **Заголовок**\n\nТекст
-    m = re.match(r"^\s*(\*{2})(.+?)\1\s*\n+\s*(.*)$", text, flags=re.DOTALL)
-    if m:
-        title = m.group(2).strip()
-        body = m.group(3).strip()
-        return title, body
+    # Быстрый выход: без звёздочки в начале ни один шаблон не совпадёт
+    if not text.lstrip().startswith("*"):
+        return None, text
 
-    # *Заголовок*\nТекст
-    m = re.match(r"^\s*(\*)(.+?)\1\s*\n+\s*(.*)$", text, flags=re.DOTALL)
-    if m:
-        title = m.group(2).strip()
-        body = m.group(3).strip()
-        return title, body
-
-    # **Заголовок** Текст (в одной строке)
-    m = re.match(r"^\s*(\*{2})(.+?)\1\s*(.+)$", text, flags=re.DOTALL)
-    if m:
-        return m.group(2).strip(), m.group(3).strip()
-
-    # *Заголовок* Текст (в одной строке)
-    m = re.match(r"^\s*(\*)(.+?)\1\s*(.+)$", text, flags=re.DOTALL)
-    if m:
-        return m.group(2).strip(), m.group(3).strip()
+    for rx in _BOLD_TITLE_REGEXES:
+        m = rx.match(text)
+        if m:
+            return m.group(2).strip(), m.group(3).strip()
 
     return None, text
 
@@ -111,7 +135,7 @@ def _split_by_first_sentence(text: str) -> Tuple[str, str]:
     Возвращаем (кандидат_заголовок, остальной_текст).
     Если знаков нет — берём первые ~6 слов.
     """
-    m = re.search(r"([.!?…])", text)
+    m = _SENTENCE_END_RE.search(text)
     if m:
         pos = m.end()
         return text[:pos].strip(), text[pos:].strip()
@@ -127,10 +151,9 @@ def _clip_long_title_with_starters(full_text: str, title: str) -> Tuple[str, str
     Если заголовок подозрительно длинный — ищем «маркеры начала сказки» и режем по ним.
     """
     # Ищем первый надёжный маркер не в самом начале
-    lower_text = full_text
     best_pos = None
     for rx in _STARTER_REGEXES:
-        m = rx.search(lower_text)
+        m = rx.search(full_text)
         if m and m.start() > 3:
             if best_pos is None or m.start() < best_pos:
                 best_pos = m.start()
@@ -139,36 +162,30 @@ def _clip_long_title_with_starters(full_text: str, title: str) -> Tuple[str, str
         new_title = full_text[:best_pos].strip()
         new_body = full_text[best_pos:].strip()
         # Снимаем хвосты пунктуации у заголовка
-        new_title = re.sub(r"[.,!?…\s]+$", "", new_title)
+        new_title = _TRAILING_PUNCT_RE.sub("", new_title)
         return new_title, new_body
 
     # Иначе возвращаем как есть
-    return title, full_text[len(title):].strip() if full_text.startswith(title) else (title, full_text)
+    if full_text.startswith(title):
+        return title, full_text[len(title):].strip()
+    return title, full_text
 
 
-def extract_story_title_and_body(story_text: str) -> Tuple[str, str]:
-    """
-    Главный алгоритм извлечения заголовка и тела сказки.
-    1) Чистим текст
-    2) Пробуем выдернуть уже-жирный заголовок (*...*/**...**)
-    3) Иначе режем по первому предложению
-    4) Если заголовок слишком длинный (>12 слов), пробуем найти маркер начала
-    """
-    text = clean_story_text(story_text)
-
+def _title_and_body_from_clean(text: str) -> Tuple[str, str]:
+    """Извлечение заголовка и тела из уже очищенного текста."""
     # 1) Уже-жирный заголовок?
     title, rest = _detect_bold_title_at_start(text)
     if title:
         # Снимаем хвосты пунктуации и лишние звёздочки/подчёркивания внутри заголовка
-        title = re.sub(r"[.,!?…\s]+$", "", title)
-        title = title.replace("*", "").replace("_", "").strip()
+        title = _TRAILING_PUNCT_RE.sub("", title)
+        title = title.translate(_TITLE_MARKUP_TABLE).strip()
         return title, rest
 
     # 2) Делим по первому предложению
     candidate_title, body = _split_by_first_sentence(text)
 
     # Снимаем хвосты пунктуации у заголовка
-    candidate_title = re.sub(r"[.,!?…\s]+$", "", candidate_title)
+    candidate_title = _TRAILING_PUNCT_RE.sub("", candidate_title)
 
     # 3) Если заголовок слишком длинный — ищем стартовые маркеры
     if len(candidate_title.split()) > 12:
@@ -181,23 +198,41 @@ def extract_story_title_and_body(story_text: str) -> Tuple[str, str]:
         body = " ".join(words[6:]).strip()
 
     # Ещё раз подчистим пробелы
-    candidate_title = re.sub(r"\s{2,}", " ", candidate_title).strip()
+    candidate_title = _MULTI_SPACE_RE.sub(" ", candidate_title).strip()
     body = body.strip()
 
     return candidate_title, body
 
 
+def extract_story_title_and_body(story_text: str) -> Tuple[str, str]:
+    """
+    Главный алгоритм извлечения заголовка и тела сказки.
+    1) Чистим текст
+    2) Пробуем выдернуть уже-жирный заголовок (*...*/**...**)
+    3) Иначе режем по первому предложению
+    4) Если заголовок слишком длинный (>12 слов), пробуем найти маркер начала
+    """
+    return _title_and_body_from_clean(clean_story_text(story_text))
+
+
 def _escape_legacy_markdown(text: str) -> str:
     """
     Telegram ParseMode.MARKDOWN (legacy) конфликтует со знаками: *, _, `, [.
     Титул мы форматируем сами, поэтому в теле: заменяем проблемные символы.
     """
-    # Заменяем звёздочки/подчёркивания, чтобы не ломать разметку
-    text = text.replace("*", "✱")
-    text = text.replace("_", " ")
-    text = text.replace("`", "ʼ")
-    text = text.replace("[", "〖").replace("]", "〗")
-    return text
+    return text.translate(_LEGACY_MARKDOWN_TABLE)
+
+
+def _group_sentences(text: str, sentences_per_paragraph: int = 2) -> List[str]:
+    """Сплит на предложения и группировка в абзацы без дополнительной чистки."""
+    # Сплит предложений: после . ! ? … + пробел(ы) + следующее предложение начинается с заглавной/кавычек/тире
+    sentences = [s.strip() for s in _SENTENCE_SPLIT_RE.split(text)]
+    sentences = [s for s in sentences if s]
+
+    return [
+        " ".join(sentences[i:i + sentences_per_paragraph])
+        for i in range(0, len(sentences), sentences_per_paragraph)
+    ]
 
 
 def split_into_paragraphs(text: str, sentences_per_paragraph: int = 2) -> List[str]:
@@ -209,54 +244,195 @@ def split_into_paragraphs(text: str, sentences_per_paragraph: int = 2) -> List[s
         return []
 
     # Нормализуем пробелы вокруг кавычек
-    text = re.sub(r"\s+([»)])", r"\1", text)
-    text = re.sub(r"([«(])\s+", r"\1", text)
+    text = _SPACE_BEFORE_CLOSING_RE.sub(r"\1", text)
+    text = _SPACE_AFTER_OPENING_RE.sub(r"\1", text)
 
-    # Сплит предложений: после . ! ? … + пробел(ы) + следующее предложение начинается с заглавной/кавычек/тире
-    sentences = re.split(r'(?<=[.!?…])\s+(?=[«"“(—\-]*[А-ЯЁ])', text)
-    sentences = [s.strip() for s in sentences if s.strip()]
+    paragraphs = _group_sentences(text, sentences_per_paragraph)
 
-    paragraphs: List[str] = []
-    buf: List[str] = []
+    # Финальная чистка повторных пробелов
+    return [_MULTI_SPACE_RE.sub(" ", p).strip() for p in paragraphs]
+
+
+def _split_long_sentence(sentence: str, max_length: int) -> List[str]:
+    """Слишком длинное предложение режем по словам (слово длиннее лимита — по символам)."""
+    pieces: List[str] = []
+    buf = ""
+    for word in sentence.split():
+        while len(word) > max_length:
+            if buf:
+                pieces.append(buf)
+                buf = ""
+            pieces.append(word[:max_length])
+            word = word[max_length:]
+        if not buf:
+            buf = word
+        elif len(buf) + 1 + len(word) <= max_length:
+            buf = f"{buf} {word}"
+        else:
+            pieces.append(buf)
+            buf = word
+    if buf:
+        pieces.append(buf)
+    return pieces
 
-    for s in sentences:
-        buf.append(s)
-        if len(buf) >= sentences_per_paragraph:
-            paragraphs.append(" ".join(buf))
-            buf = []
 
+def split_into_chunks(text: str, max_length: int) -> List[str]:
+    """
+    Разбиение длинного текста на части не длиннее max_length по границам
+    предложений (та же логика, что и в split_into_paragraphs). Нужно, например,
+    для синтеза речи по частям.
+    """
+    if len(text) <= max_length:
+        return [text] if text.strip() else []
+
+    chunks: List[str] = []
+    buf = ""
+    for sentence in split_into_paragraphs(text, sentences_per_paragraph=1):
+        pieces = [sentence] if len(sentence) <= max_length else _split_long_sentence(sentence, max_length)
+        for piece in pieces:
+            if not buf:
+                buf = piece
+            elif len(buf) + 1 + len(piece) <= max_length:
+                buf = f"{buf} {piece}"
+            else:
+                chunks.append(buf)
+                buf = piece
     if buf:
-        paragraphs.append(" ".join(buf))
+        chunks.append(buf)
+    return chunks
 
-    # Финальная чистка повторных пробелов
-    paragraphs = [re.sub(r"\s{2,}", " ", p).strip() for p in paragraphs]
-    return paragraphs
 
+def _unclosed_markdown(text: str) -> Optional[str]:
+    """
+    Маркер сущности, открытой и не закрытой к концу текста, или None.
+    В legacy Markdown сущности не вкладываются: внутри открытой сущности
+    остальные маркеры — обычные символы.
+    """
+    open_marker = None
+    for match in _MARKDOWN_MARKER_RE.finditer(text):
+        marker = match.group()
+        if marker.startswith("\\"):
+            continue
+        if open_marker is None:
+            open_marker = marker
+        elif marker == open_marker:
+            open_marker = None
+    return open_marker
+
+
+def split_markdown_message(markdown: str, max_length: int = 4096) -> List[str]:
+    """
+    Разбиение отформатированной сказки на сообщения Telegram не длиннее
+    max_length: по границам абзацев, слишком длинный абзац — по предложениям.
+    Разметка в каждом сообщении сбалансирована: сущность, разорванная
+    границей, закрывается в конце части и открывается в начале следующей.
+    """
+    if len(markdown) <= max_length:
+        return [markdown]
+
+    # Запас на закрывающий и повторно открывающий маркер (``` с каждой стороны)
+    limit = max_length - 6
+    pieces: List[str] = []
+    for paragraph in markdown.split("\n\n"):
+        if len(paragraph) <= limit:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(split_into_chunks(paragraph, limit))
+
+    parts: List[str] = []
+    buf = ""
+    for piece in pieces:
+        if not buf:
+            buf = piece
+        elif len(buf) + 2 + len(piece) <= limit:
+            buf = f"{buf}\n\n{piece}"
+        else:
+            parts.append(buf)
+            buf = piece
+    if buf:
+        parts.append(buf)
 
-def format_story_for_telegram(story_text: str) -> str:
+    messages: List[str] = []
+    carry = ""
+    for part in parts:
+        part = carry + part
+        open_marker = _unclosed_markdown(part)
+        carry = open_marker or ""
+        messages.append(part + carry)
+    return messages
+
+
+@dataclass(frozen=True)
+class ParsedStory:
     """
-    Итоговое форматирование под Telegram (ParseMode.MARKDOWN):
-    *Заголовок*
+    Сказка, разобранная один раз при получении от LLM.
+    Используется и для отправки в Telegram, и для озвучки — без повторного парсинга.
+    """
+    title: str
+    body: str
+    paragraphs: Tuple[str, ...]
+    safe_title: str
+    short_title: str
+    markdown: str
+    tts_text: str
 
-    Абзац 1
 
-    Абзац 2
+def _short_title(title: str) -> str:
+    # Без опасных символов и с ограничением длины
+    title = _UNSAFE_TITLE_CHARS_RE.sub("", title)
+    title = _MULTI_SPACE_RE.sub(" ", title).strip()
+    return title[:50] if len(title) > 50 else title
+
+
+def parse_story(story_text: str) -> ParsedStory:
+    """
+    Полный разбор сказки: заголовок, тело, абзацы и готовые представления
+    для Telegram (ParseMode.MARKDOWN) и для TTS (простой текст).
     """
     title, body = extract_story_title_and_body(story_text)
 
     # Титул — без проблемных Markdown-символов
-    safe_title = title.replace("*", "").replace("_", "").strip()
+    safe_title = title.translate(_TITLE_MARKUP_TABLE).strip()
     if not safe_title:
         safe_title = "Сказка"
 
     # Тело — экранируем опасные для Markdown символы
     safe_body = _escape_legacy_markdown(body)
 
-    paragraphs = split_into_paragraphs(safe_body)
+    # Тело уже очищено: лишние пробелы может добавить только замена "_"
+    if "_" in body:
+        paragraphs = split_into_paragraphs(safe_body)
+    else:
+        paragraphs = _group_sentences(safe_body)
     if paragraphs:
-        return f"*{safe_title}*\n\n" + "\n\n".join(paragraphs)
+        markdown = f"*{safe_title}*\n\n" + "\n\n".join(paragraphs)
     else:
-        return f"*{safe_title}*"
+        markdown = f"*{safe_title}*"
+
+    plain_body = body.translate(_PLAIN_TEXT_TABLE)
+    tts_text = f"{safe_title}.\n\n{plain_body}" if plain_body else safe_title
+
+    return ParsedStory(
+        title=title,
+        body=body,
+        paragraphs=tuple(paragraphs),
+        safe_title=safe_title,
+        short_title=_short_title(title),
+        markdown=markdown,
+        tts_text=tts_text,
+    )
+
+
+def format_story_for_telegram(story_text: str) -> str:
+    """
+    Итоговое форматирование под Telegram (ParseMode.MARKDOWN):
+    *Заголовок*
+
+    Абзац 1
+
+    Абзац 2
+    """
+    return parse_story(story_text).markdown
 
 
 def extract_story_title(story_text: str) -> str:
@@ -264,10 +440,7 @@ def extract_story_title(story_text: str) -> str:
     Вспомогательная функция — только заголовок (для имени файла TTS и т.п.).
     """
     title, _ = extract_story_title_and_body(story_text)
-    # Без опасных символов и с ограничением длины
-    title = re.sub(r"[^\w\s\-]", "", title, flags=re.UNICODE)
-    title = re.sub(r"\s{2,}", " ", title).strip()
-    return title[:50] if len(title) > 50 else title
+    return _short_title(title)
 
 
 def truncate_text(text: str, max_length: int = 2000) -> str:
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from src.services.admission import AdmissionController, AdmissionTimeout
+
+
+def test_limits_in_flight_and_serves_users_round_robin():
+    controller = AdmissionController(max_in_flight=1, max_queue_wait=5)
+    order = []
+
+    async def request(user_id, tag):
+        async with controller.slot(user_id):
+            order.append(tag)
+            assert controller.in_flight == 1
+            await asyncio.sleep(0.01)
+
+    async def run():
+        # Пользователь 1 прислал три запроса раньше пользователя 2
+        tasks = [asyncio.ensure_future(request(1, f"a{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.ensure_future(request(2, "b0")))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == ["a0", "a1", "b0", "a2"]
+    assert controller.in_flight == 0
+
+
+def test_reports_queue_position():
+    controller = AdmissionController(max_in_flight=1, max_queue_wait=5)
+    positions = []
+
+    async def report(position):
+        positions.append(position)
+
+    async def run():
+        await controller.acquire(1)
+        waiters = [
+            asyncio.ensure_future(controller.acquire(2)),
+            asyncio.ensure_future(controller.acquire(3, report)),
+        ]
+        await asyncio.sleep(0.01)
+        controller.release()
+        await asyncio.sleep(0.01)
+        controller.release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(run())
+    assert positions == [2, 1]
+
+
+def test_queue_wait_timeout():
+    controller = AdmissionController(max_in_flight=1, max_queue_wait=0.01)
+
+    async def run():
+        await controller.acquire(1)
+        with pytest.raises(AdmissionTimeout):
+            await controller.acquire(2)
+
+    asyncio.run(run())
+    assert controller.stats() == {"in_flight": 1, "waiting": 0, "timeouts": 1}
+
+
+def test_position_reports_are_throttled():
+    controller = AdmissionController(max_in_flight=1, max_queue_wait=5, position_interval=10)
+    reports = []
+
+    async def report(position):
+        reports.append(position)
+
+    async def request(user_id):
+        async with controller.slot(user_id, report):
+            await asyncio.sleep(0)
+
+    async def run():
+        await controller.acquire(0)
+        tasks = [asyncio.ensure_future(request(user_id)) for user_id in range(1, 101)]
+        await asyncio.sleep(0.01)
+        controller.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # Каждый ждущий сообщил место один раз, а не при каждом освобождении слота
+    assert len(reports) == 100
+    assert sorted(reports) == list(range(1, 101))
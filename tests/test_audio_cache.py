@@ -0,0 +1,65 @@
+import os
+from src.services.audio_cache import AudioCache, audio_cache_key
+
+
+def test_cache_key_depends_on_voice_not_whitespace():
+    base = audio_cache_key("Жили-были  кот\nи пёс.", "ru-RU", "oksana", "good", 1.0, "mp3")
+    assert base == audio_cache_key("Жили-были кот и пёс.", "ru-RU", "oksana", "good", 1.0, "mp3")
+    assert base != audio_cache_key("Жили-были кот и пёс.", "ru-RU", "jane", "good", 1.0, "mp3")
+    assert base != audio_cache_key("Жили-были кот и пёс.", "ru-RU", "oksana", "good", 1.2, "mp3")
+
+
+def test_memory_layer_lru_by_bytes():
+    cache = AudioCache(directory=None, memory_max_bytes=10, disk_max_bytes=0)
+    cache.put("a", b"12345")
+    cache.put("b", b"12345")
+    cache.get("a")
+    cache.put("c", b"12345")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.get("c") == b"12345"
+
+
+def test_disk_layer_survives_restart_and_evicts(tmp_path):
+    directory = str(tmp_path / "tts")
+    cache = AudioCache(directory=directory, memory_max_bytes=100, disk_max_bytes=25)
+    cache.put("a", b"x" * 10)
+    cache.put("b", b"y" * 10)
+
+    restarted = AudioCache(directory=directory, memory_max_bytes=100, disk_max_bytes=25)
+    assert restarted.get("a") == b"x" * 10
+
+    os.utime(os.path.join(directory, "b.mp3"), (0, 0))
+    restarted.put("c", b"z" * 10)
+    assert not os.path.exists(os.path.join(directory, "b.mp3"))
+    assert restarted.stats()["disk_bytes"] <= 25
+
+
+def test_file_id_persisted_and_forgotten(tmp_path):
+    directory = str(tmp_path / "tts")
+    cache = AudioCache(directory=directory, memory_max_bytes=100, disk_max_bytes=100)
+    assert cache.get_file_id("a") is None
+    cache.put_file_id("a", "AgAD-file-id")
+
+    restarted = AudioCache(directory=directory, memory_max_bytes=100, disk_max_bytes=100)
+    assert restarted.get_file_id("a") == "AgAD-file-id"
+
+    restarted.forget_file_id("a")
+    assert restarted.get_file_id("a") is None
+
+
+def test_find_returns_disk_path_and_put_file_moves(tmp_path):
+    directory = str(tmp_path / "tts")
+    cache = AudioCache(directory=directory, memory_max_bytes=100, disk_max_bytes=100)
+    assert cache.find("a") == (None, None)
+
+    tmp_file = tmp_path / "a.tmp"
+    tmp_file.write_bytes(b"x" * 10)
+    path = cache.put_file("a", str(tmp_file))
+
+    assert path == cache.path_for("a")
+    assert not tmp_file.exists()
+    assert cache.find("a") == (None, path)
+    assert cache.stats()["disk_bytes"] == 10
+    assert cache.stats()["memory_items"] == 0
@@ -0,0 +1,74 @@
+import asyncio
+
+from src.services.coalescing_generator import CoalescingStoryGenerator
+from src.services.story_generator import StoryGenerator
+
+
+class CountingProvider(StoryGenerator):
+    def __init__(self):
+        self.calls = 0
+        self.batch_sizes = []
+
+    def generate_story(self, prompt):
+        return "sync"
+
+    async def agenerate_story(self, prompt):
+        self.calls += 1
+        number = self.calls
+        await asyncio.sleep(0.02)
+        return f"Сказка {number}"
+
+    async def astream_story(self, prompt):
+        self.calls += 1
+        for piece in ("Жили-были ", "кот ", "и пёс."):
+            await asyncio.sleep(0.01)
+            yield piece
+
+    async def agenerate_stories(self, prompt, n):
+        self.batch_sizes.append(n)
+        return [f"Вариант {i}" for i in range(n)]
+
+
+def test_identical_prompts_share_one_call():
+    provider = CountingProvider()
+    generator = CoalescingStoryGenerator(provider)
+
+    async def run():
+        return await asyncio.gather(
+            generator.agenerate_story("Сказка про кота"),
+            generator.agenerate_story("  сказка  ПРО кота "),
+            generator.agenerate_story("Сказка про пса"),
+        )
+
+    first, second, other = asyncio.run(run())
+    assert first == second
+    assert other != first
+    assert provider.calls == 2
+    assert generator.coalesced == 1
+
+
+def test_shared_stream_replays_for_late_joiner():
+    provider = CountingProvider()
+    generator = CoalescingStoryGenerator(provider)
+
+    async def collect(delay):
+        await asyncio.sleep(delay)
+        return "".join([chunk async for chunk in generator.astream_story("Про кота")])
+
+    async def run():
+        return await asyncio.gather(collect(0), collect(0.015))
+
+    assert asyncio.run(run()) == ["Жили-были кот и пёс.", "Жили-были кот и пёс."]
+    assert provider.calls == 1
+
+
+def test_distinct_samples_batch_into_one_call():
+    provider = CountingProvider()
+    generator = CoalescingStoryGenerator(provider, distinct_samples=True, batch_window=0.01)
+
+    async def run():
+        return await asyncio.gather(*(generator.agenerate_story("Про кота") for _ in range(3)))
+
+    stories = asyncio.run(run())
+    assert sorted(stories) == ["Вариант 0", "Вариант 1", "Вариант 2"]
+    assert provider.batch_sizes == [3]
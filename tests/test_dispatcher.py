@@ -0,0 +1,95 @@
+import asyncio
+import queue
+
+from telegram import Update
+
+from src.bot.dispatcher import UpdateDispatcher, serve_worker, shard_key
+
+
+def message_update(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Аня"},
+            "text": "Про кота",
+        },
+    }
+
+
+def test_shard_key_uses_author_id():
+    assert shard_key(message_update(1, 42)) == 42
+    callback = {"update_id": 2, "callback_query": {"id": "q", "from": {"id": 7}}}
+    assert shard_key(callback) == 7
+    assert shard_key({"update_id": 3}) == 3
+
+
+def test_same_user_goes_to_same_worker_in_order():
+    dispatcher = UpdateDispatcher(workers=2, target=None, queue_size=2)
+    dispatcher._queues = [queue.Queue(maxsize=2), queue.Queue(maxsize=2)]
+
+    assert dispatcher.dispatch(message_update(1, 5))
+    assert dispatcher.dispatch(message_update(2, 4))
+    assert dispatcher.dispatch(message_update(3, 5))
+    # Очередь шарда переполнена — обновление не принимается
+    assert not dispatcher.dispatch(message_update(4, 5))
+
+    assert [dispatcher._queues[1].get()["update_id"] for _ in range(2)] == [1, 3]
+    assert dispatcher._queues[0].get()["update_id"] == 2
+    assert dispatcher.rejected == 1
+
+
+def test_forward_waits_for_room_instead_of_dropping():
+    dispatcher = UpdateDispatcher(workers=1, target=None, queue_size=1)
+    dispatcher._queues = [queue.Queue(maxsize=1)]
+    dispatcher._queues[0].put(message_update(1, 5))
+
+    async def run():
+        update = Update.de_json(message_update(2, 5), None)
+        forwarding = asyncio.ensure_future(dispatcher.forward(update, None))
+        await asyncio.sleep(0.05)
+        # Очередь полна — обновление ждёт места, а не теряется
+        assert not forwarding.done()
+        assert dispatcher._queues[0].get()["update_id"] == 1
+        await asyncio.wait_for(forwarding, 1)
+
+    asyncio.run(run())
+    assert dispatcher._queues[0].get()["update_id"] == 2
+    assert dispatcher.rejected == 0
+
+
+class FakeApplication:
+    def __init__(self):
+        self.bot = None
+        self.running = False
+        self.update_queue = asyncio.Queue()
+        self.calls = []
+
+    async def initialize(self):
+        self.calls.append("initialize")
+
+    async def start(self):
+        self.running = True
+
+    async def stop(self):
+        self.running = False
+        self.calls.append("stop")
+
+    async def shutdown(self):
+        self.calls.append("shutdown")
+
+
+def test_worker_feeds_updates_until_stop_signal():
+    app = FakeApplication()
+    updates = queue.Queue()
+    updates.put(message_update(1, 5))
+    updates.put(message_update(2, 5))
+    updates.put(None)
+
+    asyncio.run(serve_worker(app, updates))
+
+    received = [app.update_queue.get_nowait() for _ in range(2)]
+    assert [update.effective_user.id for update in received] == [5, 5]
+    assert app.calls == ["initialize", "stop", "shutdown"]
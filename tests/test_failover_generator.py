@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+from src.services.failover_generator import CircuitBreaker, FailoverStoryGenerator
+from src.services.story_generator import StoryGenerator, StoryStreamError
+
+
+class FakeProvider(StoryGenerator):
+    def __init__(self, story=None, delay=0.0, error=None):
+        self.story = story
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def generate_story(self, prompt):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.story
+
+    async def agenerate_story(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.story
+
+
+class SlowStream(FakeProvider):
+    """Поток, первый кусок которого приходит через delay секунд."""
+
+    async def astream_story(self, prompt):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        yield self.story
+
+
+class BrokenStream(FakeProvider):
+    """Отдаёт один кусок и обрывается."""
+
+    async def astream_story(self, prompt):
+        self.calls += 1
+        yield "Жили-были "
+        raise StoryStreamError("обрыв")
+
+
+def test_failover_to_next_provider():
+    broken = FakeProvider(error=RuntimeError("503"))
+    backup = FakeProvider(story="Сказка")
+    generator = FailoverStoryGenerator([("a", broken), ("b", backup)], timeout=1.0)
+
+    assert generator.generate_story("тема") == "Сказка"
+    assert asyncio.run(generator.agenerate_story("тема")) == "Сказка"
+
+
+def test_timeout_fails_over():
+    slow = FakeProvider(story="Поздно", delay=1.0)
+    backup = FakeProvider(story="Вовремя")
+    generator = FailoverStoryGenerator([("a", slow), ("b", backup)], timeout=0.05)
+
+    assert asyncio.run(generator.agenerate_story("тема")) == "Вовремя"
+
+
+def test_hedged_request_wins_over_slow_provider():
+    slow = FakeProvider(story="Медленно", delay=0.5)
+    fast = FakeProvider(story="Быстро")
+    generator = FailoverStoryGenerator(
+        [("a", slow), ("b", fast)], timeout=2.0, hedge=True, hedge_default_delay=0.05
+    )
+
+    assert asyncio.run(generator.agenerate_story("тема")) == "Быстро"
+    assert slow.calls == 1 and fast.calls == 1
+    # Отменённый хедж не считается ошибкой провайдера
+    assert generator.providers[0].breaker.failures == 0
+
+
+def test_open_breaker_skips_provider():
+    broken = FakeProvider(story=None)
+    backup = FakeProvider(story="Сказка")
+    generator = FailoverStoryGenerator(
+        [("a", broken), ("b", backup)], timeout=1.0, breaker_failures=2
+    )
+    for _ in range(3):
+        assert generator.generate_story("тема") == "Сказка"
+
+    assert broken.calls == 2
+    assert generator.providers[0].breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_half_open_after_reset():
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    now[0] = 11
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+
+
+def test_cancelled_probe_reopens_breaker():
+    now = [0.0]
+    slow = FakeProvider(story="Медленно", delay=0.5)
+    fast = FakeProvider(story="Быстро")
+    generator = FailoverStoryGenerator(
+        [("a", slow), ("b", fast)], timeout=2.0, hedge=True, hedge_default_delay=0.05
+    )
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+    breaker.record_failure()
+    generator.providers[0].breaker = breaker
+
+    now[0] = 11
+    # Пробный запрос проиграл хедж и отменён — предохранитель снова разомкнут
+    assert asyncio.run(generator.agenerate_story("тема")) == "Быстро"
+    assert breaker.state == CircuitBreaker.OPEN and slow.calls == 1
+
+    now[0] = 22
+    asyncio.run(generator.agenerate_story("тема"))
+    assert slow.calls == 2
+
+
+def test_stream_broken_after_first_chunk_is_an_error():
+    broken = BrokenStream()
+    backup = FakeProvider(story="Сказка")
+    generator = FailoverStoryGenerator([("a", broken), ("b", backup)], timeout=1.0)
+
+    async def run():
+        return [chunk async for chunk in generator.astream_story("тема")]
+
+    with pytest.raises(StoryStreamError):
+        asyncio.run(run())
+    # Обрывок уже отдан — переключаться поздно, но провайдер получил отказ
+    assert backup.calls == 0
+    assert generator.providers[0].breaker.failures == 1
+
+
+def collect(generator):
+    async def run():
+        return [chunk async for chunk in generator.astream_story("тема")]
+    return asyncio.run(run())
+
+
+def test_stream_without_first_chunk_in_time_fails_over():
+    hung = SlowStream(story="Поздно", delay=1.0)
+    backup = SlowStream(story="Вовремя")
+    generator = FailoverStoryGenerator([("a", hung), ("b", backup)], timeout=0.05)
+
+    assert collect(generator) == ["Вовремя"]
+    assert generator.providers[0].breaker.failures == 1
+    assert len(generator.providers[1].first_chunk.samples) == 1
+
+
+def test_hedged_stream_wins_over_slow_provider():
+    slow = SlowStream(story="Медленно", delay=0.5)
+    fast = SlowStream(story="Быстро")
+    generator = FailoverStoryGenerator(
+        [("a", slow), ("b", fast)], timeout=2.0, hedge=True, hedge_default_delay=0.05
+    )
+
+    assert collect(generator) == ["Быстро"]
+    assert slow.calls == 1 and generator.providers[0].breaker.failures == 0
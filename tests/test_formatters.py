@@ -1,7 +1,15 @@
+import json
+from pathlib import Path
+
 import pytest
 from src.utils.formatters import (
     format_story_for_telegram,
     extract_story_title,
+    extract_story_title_and_body,
+    parse_story,
+    split_into_chunks,
+    split_markdown_message,
+    truncate_text,
 )
 
 # === Тесты ===
@@ -65,3 +73,74 @@ def test_extract_title_short_fallback():
     story = "Просто начало без конца"
     title = extract_story_title(story)
     assert title.startswith("Просто начало")
+
+
+# === Регрессия по записанному корпусу сказок ===
+
+_CORPUS = json.loads((Path(__file__).parent / "data" / "story_corpus.json").read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("case", _CORPUS)
+def test_story_corpus_output_unchanged(case):
+    """
+    Вывод форматтеров совпадает с записанным для корпуса сказок.
+    """
+    story = case["story"]
+    formatted = format_story_for_telegram(story)
+    assert formatted == case["formatted"]
+    assert extract_story_title(story) == case["title"]
+    assert list(extract_story_title_and_body(story)) == case["title_and_body"]
+    assert truncate_text(formatted, 60) == case["truncated"]
+
+
+def test_parse_story_shared_representations():
+    """
+    ParsedStory: Markdown совпадает с format_story_for_telegram, текст для TTS — без разметки.
+    """
+    story = "**Звёздный кит.**\nКит плыл по *небу*. Звёзды светили ярко!"
+    parsed = parse_story(story)
+    assert parsed.title == "Звёздный кит"
+    assert parsed.markdown == format_story_for_telegram(story)
+    assert parsed.short_title == extract_story_title(story)
+    assert parsed.paragraphs == ("Кит плыл по ✱небу✱. Звёзды светили ярко!",)
+    assert parsed.tts_text == "Звёздный кит.\n\nКит плыл по небу. Звёзды светили ярко!"
+
+
+def test_split_into_chunks_on_sentence_boundaries():
+    """
+    Длинный текст режется на части не длиннее лимита по границам предложений.
+    """
+    text = "Жили-были кот и пёс. Они дружили много лет. Однажды пошёл снег. Все радовались!"
+    chunks = split_into_chunks(text, 45)
+    assert chunks == ["Жили-были кот и пёс. Они дружили много лет.", "Однажды пошёл снег. Все радовались!"]
+    assert split_into_chunks("Короткий текст.", 45) == ["Короткий текст."]
+    assert all(len(c) <= 10 for c in split_into_chunks("Оченьдлинноеслово и ещё слова", 10))
+
+
+def test_split_markdown_message_keeps_every_paragraph():
+    """
+    Длинная сказка делится на сообщения по абзацам без потери текста.
+    """
+    paragraphs = [f"Абзац {i}. " + "Кот шёл по лесу. " * 20 for i in range(30)]
+    story = "**Долгая дорога**\n\n" + "\n\n".join(paragraphs)
+    markdown = parse_story(story).markdown
+    messages = split_markdown_message(markdown, 1000)
+
+    assert len(messages) > 1
+    assert all(len(m) <= 1000 for m in messages)
+    assert messages[0].startswith("*Долгая дорога*")
+    assert "\n\n".join(messages) == markdown
+    assert split_markdown_message("*Коротко*\n\nТекст.", 1000) == ["*Коротко*\n\nТекст."]
+
+
+def test_split_markdown_message_balances_entities():
+    """
+    Сущность, разорванная границей сообщения, закрывается и открывается заново.
+    """
+    markdown = "*" + "Очень длинный жирный текст. " * 10 + "*\n\nКонец."
+    messages = split_markdown_message(markdown, 100)
+
+    assert len(messages) > 1
+    for message in messages:
+        assert len(message) <= 100
+        assert message.count("*") % 2 == 0
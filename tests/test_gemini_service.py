@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.services.gemini_service import GeminiService
+from src.services.story_generator import SYSTEM_PROMPT
+
+
+def response(*texts):
+    parts = [SimpleNamespace(text=text) for text in texts]
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=parts))])
+
+
+class FakeModel:
+    def __init__(self):
+        self.inputs = []
+
+    async def generate_content_async(self, contents, stream=False):
+        self.inputs.append(contents)
+        if not stream:
+            return response(" Сказка ", "о луне ")
+
+        async def chunks():
+            for chunk in (response("Жили-были "), SimpleNamespace(candidates=[]), response("кот.")):
+                yield chunk
+
+        return chunks()
+
+
+def test_system_prompt_is_passed_as_instruction():
+    service = GeminiService()
+    assert service.model._system_instruction.parts[0].text == SYSTEM_PROMPT
+    assert SYSTEM_PROMPT not in service._build_input("Про кота")
+
+
+def test_extract_text_fast_path():
+    assert GeminiService._extract_text(response(" Сказка ")) == "Сказка"
+    assert GeminiService._extract_text(response("Жили-", "были")) == "Жили-были"
+    assert GeminiService._extract_text(SimpleNamespace(candidates=[])) is None
+
+
+def test_async_generation_and_streaming():
+    service = GeminiService()
+    service.model = FakeModel()
+
+    async def run():
+        story = await service.agenerate_story("Про луну")
+        chunks = [chunk async for chunk in service.astream_story("Про кота")]
+        return story, chunks
+
+    story, chunks = asyncio.run(run())
+    assert story == "Сказка о луне"
+    assert chunks == ["Жили-были ", "кот."]
+    assert service.model.inputs == ["Пользовательская тема: Про луну", "Пользовательская тема: Про кота"]
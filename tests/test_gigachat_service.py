@@ -1,10 +1,30 @@
+import asyncio
+import time
 import pytest
-from src.services.gigachat_service import GigaChatService
+from src.services.gigachat_service import GigaChatClientPool, GigaChatService
+
+class DummyToken:
+    def __init__(self, lifetime):
+        self.expires_at = (time.time() + lifetime) * 1000
+
 
 class DummyClient:
-    def __init__(self, response):
+    def __init__(self, response, token_lifetime=1800):
         self.response = response
         self.token = "dummy-token"
+        self.token_lifetime = token_lifetime
+        self.token_requests = 0
+        self.closed = False
+
+    async def aget_token(self):
+        self.token_requests += 1
+        return DummyToken(self.token_lifetime)
+
+    def _reset_token(self):
+        pass
+
+    async def aclose(self):
+        self.closed = True
 
     def __enter__(self):
         return self
@@ -15,6 +35,14 @@ class DummyClient:
     def chat(self, chat):
         return self.response
 
+    async def achat(self, chat):
+        return self.response
+
+    async def astream(self, chat):
+        for piece in ("Жили-были ", "кот ", "и пёс."):
+            delta = type("d", (), {"content": piece})
+            yield type("chunk", (), {"choices": [type("c", (), {"delta": delta})]})
+
 
 def test_generate_story_success(monkeypatch):
     fake_response = type("obj", (), {
@@ -40,3 +68,91 @@ def test_generate_story_failure(monkeypatch):
 
     story = service.generate_story("Любая сказка")
     assert story is None
+
+
+def test_agenerate_story_success(monkeypatch):
+    fake_response = type("obj", (), {
+        "choices": [type("msg", (), {"message": type("m", (), {"content": " Сказка о луне "})})]
+    })
+
+    service = GigaChatService(client_factory=lambda: DummyClient(fake_response))
+
+    story = asyncio.run(service.agenerate_story("Придумай сказку про луну"))
+    assert story == "Сказка о луне"
+
+
+def test_astream_story_yields_chunks(monkeypatch):
+    service = GigaChatService(client_factory=lambda: DummyClient(None))
+
+    async def collect():
+        return [chunk async for chunk in service.astream_story("Про кота")]
+
+    chunks = asyncio.run(collect())
+    assert "".join(chunks) == "Жили-были кот и пёс."
+
+
+def test_pool_warms_up_and_refreshes_expiring_tokens():
+    clients = []
+
+    def factory():
+        clients.append(DummyClient(None, token_lifetime=60))
+        return clients[-1]
+
+    pool = GigaChatClientPool(factory, size=2, refresh_margin=120, check_interval=0.01)
+
+    async def run():
+        await pool.start()
+        assert len(clients) == 2
+        await asyncio.sleep(0.05)
+        await pool.close()
+
+    asyncio.run(run())
+    # Токены живут меньше запаса — фоновая задача обновляла их заранее
+    assert all(client.token_requests > 1 for client in clients)
+    assert all(client.closed for client in clients)
+
+
+def test_pool_refreshes_after_failed_warm_up():
+    clients = []
+
+    class FlakyClient(DummyClient):
+        async def aget_token(self):
+            if len(clients) == 1:
+                raise RuntimeError("OAuth недоступен")
+            return await super().aget_token()
+
+    def factory():
+        clients.append(FlakyClient(None))
+        return clients[-1]
+
+    pool = GigaChatClientPool(factory, size=2, check_interval=0.01)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await pool.start()
+        assert pool._refresh_task is not None
+        await asyncio.sleep(0.05)
+        # Фоновая задача досоздала клиентов — запросу не нужно ждать авторизацию
+        assert len(pool._clients) == 2
+        assert pool._queue().qsize() == 2
+        await pool.close()
+
+    asyncio.run(run())
+
+
+def test_pool_gives_each_request_its_own_client():
+    pool = GigaChatClientPool(lambda: DummyClient(None), size=2)
+    in_use = []
+
+    async def request():
+        async with pool.client() as client:
+            assert client not in in_use
+            in_use.append(client)
+            await asyncio.sleep(0.01)
+            in_use.remove(client)
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(5)))
+        await pool.close()
+
+    asyncio.run(run())
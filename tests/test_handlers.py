@@ -0,0 +1,137 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from telegram.constants import ParseMode
+
+import src.bot.handlers as handlers
+from config.settings import config
+from src.bot.handlers import StoryBotHandlers
+from src.services.response_cache import StoryResponseCache
+from src.services.story_generator import StoryGenerator, StoryStreamError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StreamingGenerator(StoryGenerator):
+    """Поток кусков; перед каждым куском часы переводятся на заданное время."""
+
+    def __init__(self, clock, chunks, fail_after=None):
+        self.clock = clock
+        self.chunks = chunks
+        self.fail_after = fail_after
+
+    def generate_story(self, prompt):
+        return None
+
+    async def astream_story(self, prompt):
+        for index, (at, chunk) in enumerate(self.chunks):
+            if index == self.fail_after:
+                raise StoryStreamError("обрыв")
+            self.clock.now = at
+            await asyncio.sleep(0)
+            yield chunk
+
+
+@pytest.fixture
+def setup(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(handlers, "time", SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(config.bot, "STREAMING", True)
+    monkeypatch.setattr(config.bot, "STREAM_EDIT_INTERVAL", 1.5)
+    monkeypatch.setattr(handlers, "story_cache", StoryResponseCache(max_size=10, ttl=60))
+    monkeypatch.setattr(handlers, "tts_service", MagicMock(is_available=lambda: False))
+
+    def use(generator):
+        monkeypatch.setattr(handlers, "get_story_generator", lambda: generator)
+
+    return clock, use
+
+
+def make_update():
+    placeholder = MagicMock()
+    placeholder.edit_text = AsyncMock()
+    update = MagicMock()
+    update.effective_user.id = 1
+    update.message.reply_text = AsyncMock(return_value=placeholder)
+    return update, placeholder
+
+
+CHUNKS = [(0.5, "**Кот**\n\n"), (1.0, "Жили-были кот и пёс. "), (2.0, "Они дружили. "), (2.5, "Конец.")]
+
+
+def test_draft_edits_are_throttled(setup):
+    clock, use = setup
+    use(StreamingGenerator(clock, CHUNKS))
+    update, placeholder = make_update()
+
+    story = asyncio.run(StoryBotHandlers._generate_with_progress(placeholder, "про кота"))
+
+    assert story == "**Кот**\n\nЖили-были кот и пёс. Они дружили. Конец."
+    # Правка только на куске в 2.0 с: остальные ближе 1.5 с к предыдущей
+    drafts = [call.args[0] for call in placeholder.edit_text.await_args_list]
+    assert drafts == ["Кот\n\nЖили-были кот и пёс. Они дружили.  ✍️"]
+
+
+def test_finished_story_replaces_draft_with_markdown(setup):
+    clock, use = setup
+    use(StreamingGenerator(clock, CHUNKS))
+    update, placeholder = make_update()
+
+    asyncio.run(StoryBotHandlers.send_story(update, None, "про кота"))
+
+    final = placeholder.edit_text.await_args_list[-1]
+    assert final.args[0] == "*Кот*\n\nЖили-были кот и пёс. Они дружили.\n\nКонец."
+    assert final.kwargs["parse_mode"] == ParseMode.MARKDOWN
+    assert len(handlers.story_cache) == 1
+
+
+def test_broken_stream_is_not_sent_or_cached(setup):
+    clock, use = setup
+    use(StreamingGenerator(clock, CHUNKS, fail_after=2))
+    update, placeholder = make_update()
+
+    asyncio.run(StoryBotHandlers.send_story(update, None, "про кота"))
+
+    placeholder.edit_text.assert_awaited_with(config.errors.GENERIC_ERROR)
+    assert len(handlers.story_cache) == 0
+
+
+def test_tts_reuses_telegram_file_id(monkeypatch, tmp_path):
+    from src.bot.state_store import LAST_STORY
+    from src.services.audio_cache import AudioCache
+    from src.services.tts_service import SynthesizedAudio, TTSService
+    from src.utils.formatters import parse_story
+
+    service = TTSService()
+    service.cache = AudioCache(directory=str(tmp_path), memory_max_bytes=1024, disk_max_bytes=1024)
+    service.asynthesize_story = AsyncMock(return_value=SynthesizedAudio(filename="Кот.mp3", data=b"audio"))
+    monkeypatch.setattr(handlers, "tts_service", service)
+    monkeypatch.setattr(handlers, "rate_limiter", MagicMock(allow=lambda *args: True))
+    handlers.user_store.set(7, LAST_STORY, parse_story("**Кот**\n\nЖили-были кот и пёс."))
+
+    def make_query():
+        query = MagicMock()
+        query.from_user.id = 7
+        query.answer = AsyncMock()
+        query.edit_message_text = AsyncMock()
+        query.message.reply_audio = AsyncMock(return_value=SimpleNamespace(audio=SimpleNamespace(file_id="F1")))
+        return query
+
+    try:
+        first, second = make_query(), make_query()
+        asyncio.run(StoryBotHandlers.handle_tts_request(SimpleNamespace(callback_query=first), None))
+        asyncio.run(StoryBotHandlers.handle_tts_request(SimpleNamespace(callback_query=second), None))
+    finally:
+        handlers.user_store.pop(7, LAST_STORY)
+
+    # Повторная озвучка уходит по file_id, без синтеза и загрузки байтов
+    service.asynthesize_story.assert_awaited_once()
+    assert second.message.reply_audio.await_args.args[0] == "F1"
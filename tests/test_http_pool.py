@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from config.settings import config
+from src.services import http_pool
+
+
+def test_shared_client_is_reused_until_closed():
+    async def run():
+        first = http_pool.get_llm_http_client()
+        assert http_pool.get_llm_http_client() is first
+        assert first.timeout.connect == config.llm.CONNECT_TIMEOUT
+        assert first.timeout.read == config.llm.READ_TIMEOUT
+
+        await http_pool.aclose_llm_http_client()
+        assert first.is_closed
+        second = http_pool.get_llm_http_client()
+        assert second is not first
+        await http_pool.aclose_llm_http_client()
+        # Повторное закрытие безопасно
+        await http_pool.aclose_llm_http_client()
+
+    asyncio.run(run())
+
+
+def test_openai_clients_share_pool_and_build_sync_lazily():
+    pytest.importorskip("openai")
+    clients = http_pool.OpenAIClients("test-key", "https://example.invalid/v1")
+
+    async def run():
+        assert clients._sync_client is None
+        first = clients.async_client
+        assert clients.async_client is first
+        assert first._client is http_pool.get_llm_http_client()
+
+        # Новый пул процесса — новый асинхронный клиент поверх него
+        await http_pool.aclose_llm_http_client()
+        assert clients.async_client is not first
+        await http_pool.aclose_llm_http_client()
+
+    asyncio.run(run())
+    assert clients._sync_client is None
+    assert clients.sync_client is clients.sync_client
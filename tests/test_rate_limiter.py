@@ -0,0 +1,70 @@
+from src.bot.rate_limiter import RateLimiter, cooldown_rate
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_limiter(clock, **kwargs):
+    return RateLimiter(limits={"story": (1 / 5, 1), "tts": (1.0, 2)}, clock=clock, **kwargs)
+
+
+def test_per_user_bucket_refills_over_time():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+
+    assert limiter.allow(1, "story")
+    assert not limiter.allow(1, "story")
+    assert limiter.allow(2, "story")
+
+    clock.now += 5
+    assert limiter.allow(1, "story")
+
+
+def test_burst_and_scopes_are_independent():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+
+    assert limiter.allow(1, "story")
+    assert limiter.allow(1, "tts")
+    assert limiter.allow(1, "tts")
+    assert not limiter.allow(1, "tts")
+
+
+def test_global_bucket_limits_all_users():
+    clock = FakeClock()
+    limiter = make_limiter(clock, global_rate=1.0, global_burst=2)
+
+    assert limiter.allow(1, "story")
+    assert limiter.allow(2, "story")
+    assert not limiter.allow(3, "story")
+    # Отказ по общему лимиту не тратит токен пользователя
+    clock.now += 1
+    assert limiter.allow(3, "story")
+
+
+def test_idle_buckets_expire():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+    for user_id in range(3):
+        limiter.allow(user_id, "story")
+    assert len(limiter) == 3
+
+    clock.now += 10
+    limiter.allow(99, "tts")
+    limiter.allow(98, "tts")
+    assert len(limiter) == 2
+
+
+def test_zero_cooldown_means_no_user_limit():
+    clock = FakeClock()
+    limiter = RateLimiter(limits={"story": (cooldown_rate(0), 1)}, global_rate=1.0, global_burst=3, clock=clock)
+
+    # Без личного лимита действует только общий
+    assert all(limiter.allow(1, "story") for _ in range(3))
+    assert not limiter.allow(1, "story")
+    assert len(limiter) == 0
@@ -0,0 +1,58 @@
+from src.services.response_cache import ServedStory, StoryResponseCache, cache_prompt_key
+from src.utils.formatters import parse_story
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def story(n):
+    return parse_story(f"**Сказка {n}**\n\nЖил-был котик. Он был добрым.")
+
+
+def test_prompt_key_ignores_case_punctuation_and_spaces():
+    assert cache_prompt_key("про котика") == cache_prompt_key("Про котика!")
+    assert cache_prompt_key("про котика") == cache_prompt_key("  про   котика ")
+    assert cache_prompt_key("про ёжика") == cache_prompt_key("Про ежика?!")
+    assert cache_prompt_key("про котика") != cache_prompt_key("про собачку")
+
+
+def test_hit_requires_same_settings_and_respects_max_uses():
+    cache = StoryResponseCache(max_size=10, ttl=60, max_uses=3)
+    cache.put("про котика", "gigachat", story(1), user_id=1)
+
+    # Автор уже получил эту сказку, другая модель — другой ключ
+    assert cache.get("Про котика!", "gigachat", user_id=1) is None
+    assert cache.get("про котика", "openai", user_id=2) is None
+
+    assert cache.get("Про котика!", "gigachat", user_id=2).title == "Сказка 1"
+    assert cache.get("про котика ", "gigachat", user_id=3).title == "Сказка 1"
+    # Три пользователя получили сказку — запись исчерпана
+    assert cache.get("про котика", "gigachat", user_id=4) is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_ttl_and_size_bound():
+    clock = FakeClock()
+    cache = StoryResponseCache(max_size=2, ttl=60, max_uses=5, clock=clock)
+    cache.put("про котика", "gigachat", story(1))
+    cache.put("про собачку", "gigachat", story(2))
+    cache.put("про лисичку", "gigachat", story(3))
+    assert len(cache) == 2
+    assert cache.get("про котика", "gigachat", user_id=1) is None
+
+    clock.now = 61
+    assert cache.get("про лисичку", "gigachat", user_id=1) is None
+    assert cache.stats()["stories"] == 1
+
+
+def test_served_story_counts_distinct_users():
+    served = ServedStory(parse_story("**Кот**\n\nЖил-был кот."), author=1)
+    assert not served.available_to(1)
+    assert served.available_to(2)
+    assert not served.serve(2, max_uses=3)
+    assert served.serve(3, max_uses=3)
@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from src.services.response_cache import StoryResponseCache
+from src.services.semantic_cache import SemanticStoryCache
+from src.utils.formatters import parse_story
+
+
+def story(title):
+    return parse_story(f"**{title}**\n\nЖил-был дракон. Он был добрым.")
+
+
+def make_cache(path=None, max_uses=3):
+    return SemanticStoryCache(path, capacity=16, dim=2048, threshold=0.5, ttl=60, max_uses=max_uses)
+
+
+def test_paraphrase_hits_and_other_topic_misses():
+    cache = make_cache()
+    cache.put("сказка про дракона", "gigachat", story("Дракон"), user_id=1)
+    cache.put("про космос и ракету", "gigachat", story("Ракета"), user_id=1)
+
+    assert cache.get("Расскажи сказку о драконе!", "gigachat", user_id=2).title == "Дракон"
+    assert cache.get("сказка про кота", "gigachat", user_id=2) is None
+    # Другие настройки генератора и автор сказки — промах
+    assert cache.get("про дракона", "openai", user_id=3) is None
+    assert cache.get("про дракона", "gigachat", user_id=1) is None
+
+
+def test_index_is_persisted(tmp_path):
+    path = str(tmp_path / "semantic")
+    cache = make_cache(path)
+    cache.put("сказка про дракона", "gigachat", story("Дракон"), user_id=1)
+    cache.put("про космос", "gigachat", story("Ракета"), user_id=1)
+    cache.close()
+
+    reopened = make_cache(path)
+    assert reopened.stats()["stories"] == 2
+    assert reopened.get("расскажи сказку о драконе", "gigachat", user_id=2).title == "Дракон"
+    reopened.close()
+
+
+def test_response_cache_delegates_to_semantic_level():
+    cache = StoryResponseCache(max_size=10, ttl=60, max_uses=2)
+    cache.attach_semantic(make_cache(max_uses=2))
+    cache.put("про дракона", "gigachat", story("Дракон"), user_id=1)
+
+    assert cache.get("Сказку про дракона, пожалуйста", "gigachat", user_id=2).title == "Дракон"
+    # Сказка выдана двум пользователям — больше не отдаётся
+    assert cache.get("про дракона", "gigachat", user_id=3) is None
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_different_heroes_and_contradicting_details_do_not_match():
+    cache = make_cache()
+    cache.put("Придумай сказку с героем: кот", "gigachat", story("Кот"), user_id=1)
+    cache.put("про доброго дракона", "gigachat", story("Дракон"), user_id=1)
+
+    assert cache.get("Придумай сказку с героем: пёс", "gigachat", user_id=2) is None
+    assert cache.get("про злого дракона", "gigachat", user_id=2) is None
+    # Тот же герой и уточнение без противоречий — совпадение
+    assert cache.get("Придумай сказку с героем: Кот!", "gigachat", user_id=2).title == "Кот"
+    assert cache.get("сказка про дракона", "gigachat", user_id=2).title == "Дракон"
+
+
+def test_journal_is_compacted_by_writer(tmp_path):
+    path = str(tmp_path / "semantic")
+    cache = make_cache(path)
+    for number in range(40):
+        cache.put(f"сказка про дракона номер {number}", "gigachat", story(f"Дракон {number}"), user_id=1)
+    cache.close()
+
+    with open(f"{path}.jsonl", encoding="utf-8") as f:
+        assert len(f.readlines()) <= 2 * 16
+    reopened = make_cache(path)
+    assert reopened.stats()["stories"] == 16
+    reopened.close()
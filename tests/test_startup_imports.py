@@ -0,0 +1,53 @@
+"""
+Бенчмарк старта в стиле `python -X importtime`: импорт обработчиков бота
+не должен тянуть SDK LLM-провайдеров — они загружаются лениво фабрикой.
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROVIDER_SDKS = ("gigachat", "openai", "google.generativeai")
+
+
+def _import_times(statement: str, **env):
+    """Запуск в чистом процессе с -X importtime: {модуль: накопленное время, мкс}."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, "LLM_PROVIDER": "gigachat", **env},
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, module = line.split("|")
+        times[module.strip()] = int(cumulative_us)
+    return times
+
+
+def test_handlers_import_does_not_load_provider_sdks():
+    times = _import_times("import src.bot.handlers")
+    loaded = [sdk for sdk in PROVIDER_SDKS if sdk in times]
+    assert loaded == []
+
+
+def test_main_import_skips_disabled_semantic_cache():
+    times = _import_times("import main", STORY_CACHE_SEMANTIC="0")
+    assert "src.services.semantic_cache" not in times
+    assert "numpy" not in times
+
+
+def test_factory_imports_only_selected_provider():
+    times = _import_times(
+        "from src.services.story_generator_factory import create_provider; "
+        "create_provider('gigachat')",
+        GIGACHAT_AUTH_KEY="test-key",
+    )
+    assert "gigachat" in times
+    assert "openai" not in times
+    assert "google.generativeai" not in times
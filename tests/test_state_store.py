@@ -0,0 +1,130 @@
+import sqlite3
+
+from src.bot.state_backends import SQLiteStateBackend
+from src.bot.state_store import UserStateStore, STATE, LAST_STORY
+from src.utils.formatters import parse_story
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_store(max_users=3, clock=None):
+    return UserStateStore(
+        max_users=max_users,
+        ttls={STATE: 60, LAST_STORY: None},
+        clock=clock or FakeClock(),
+    )
+
+
+def test_get_does_not_create_entries():
+    store = make_store()
+    assert store.get(1, STATE) is None
+    assert len(store) == 0
+
+
+def test_field_ttl_expires_independently():
+    clock = FakeClock()
+    store = make_store(clock=clock)
+    store.set(1, STATE, "awaiting_hero_description")
+    store.set(1, LAST_STORY, "сказка")
+
+    clock.now += 61
+    assert store.get(1, STATE) is None
+    assert store.get(1, LAST_STORY) == "сказка"
+
+
+def test_expired_record_is_dropped():
+    clock = FakeClock()
+    store = make_store(clock=clock)
+    store.set(1, STATE, "awaiting_hero_description")
+
+    clock.now += 61
+    assert store.get(1, STATE) is None
+    assert store.stats()["size"] == 0
+    assert store.stats()["expirations"] == 1
+
+
+def test_lru_eviction():
+    store = make_store(max_users=2)
+    store.set(1, LAST_STORY, "a")
+    store.set(2, LAST_STORY, "b")
+    store.get(1, LAST_STORY)
+    store.set(3, LAST_STORY, "c")
+
+    assert store.get(2, LAST_STORY) is None
+    assert store.get(1, LAST_STORY) == "a"
+    assert store.stats()["evictions"] == 1
+
+
+def test_pop_removes_field():
+    store = make_store()
+    store.set(1, STATE, "awaiting_hero_description")
+    assert store.pop(1, STATE) == "awaiting_hero_description"
+    assert store.get(1, STATE) is None
+    assert len(store) == 0
+
+
+def test_sqlite_backend_survives_restart(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    story = parse_story("**Кот и мышь**\nЖили-были кот и мышь.")
+
+    store = UserStateStore(ttls={LAST_STORY: 3600}, backend=SQLiteStateBackend(path))
+    store.set(1, LAST_STORY, story)
+    # До сброса на диск значение видно через оверлей
+    assert store.get(1, LAST_STORY) == story
+    store.close()
+
+    restarted = UserStateStore(ttls={LAST_STORY: 3600}, backend=SQLiteStateBackend(path))
+    assert restarted.get(1, LAST_STORY) == story
+    assert restarted.pop(1, LAST_STORY) == story
+    assert restarted.get(1, LAST_STORY) is None
+    restarted.close()
+
+
+def test_sqlite_backend_respects_ttl(tmp_path):
+    clock = FakeClock()
+    store = UserStateStore(
+        ttls={STATE: 5},
+        backend=SQLiteStateBackend(str(tmp_path / "state.sqlite3")),
+        clock=clock,
+    )
+    store.set(1, STATE, "awaiting_hero_description")
+    assert store.get(1, STATE) == "awaiting_hero_description"
+
+    clock.now += 6
+    assert store.get(1, STATE) is None
+    store.close()
+
+
+def test_sqlite_backend_retries_failed_batch(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    story = parse_story("**Кот и мышь**\nЖили-были кот и мышь.")
+    backend = SQLiteStateBackend(path, flush_interval=0.01)
+    flush = backend._flush
+    calls = []
+
+    def flaky_flush(conn, keys):
+        calls.append(set(keys))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        flush(conn, keys)
+
+    backend._flush = flaky_flush
+    store = UserStateStore(ttls={LAST_STORY: 3600}, backend=backend)
+    store.set(1, LAST_STORY, story)
+    store.close()
+
+    # Первая запись упала — пачка повторена, а не потеряна
+    assert len(calls) >= 2
+    assert backend.stats()["failures"] == 1
+    assert backend.stats()["pending"] == 0
+
+    restarted = UserStateStore(ttls={LAST_STORY: 3600}, backend=SQLiteStateBackend(path))
+    assert restarted.stats()["size"] == 1
+    assert restarted.get(1, LAST_STORY) == story
+    restarted.close()
@@ -0,0 +1,90 @@
+import asyncio
+import itertools
+
+from src.services.admission import AdmissionController
+from src.services.story_pool import StoryPool
+
+PROMPTS = ["Про животных", "Про волшебство"]
+
+
+def make_pool(size=2, max_uses=2):
+    counter = itertools.count(1)
+
+    async def generate(prompt):
+        return f"**Сказка {next(counter)}**\n\nЖил-был кот. Тема: {prompt}. Он был добрым."
+
+    return StoryPool(PROMPTS, size=size, max_uses=max_uses, refill_interval=0, generate=generate)
+
+
+def fill(pool):
+    async def run():
+        while await pool.refill_once():
+            pass
+    asyncio.run(run())
+
+
+def test_refill_fills_every_prompt():
+    pool = make_pool(size=2)
+    fill(pool)
+    assert pool.stats()["stories"] == 4
+    assert pool.take("Другая тема", user_id=1) is None
+
+
+def test_same_user_never_gets_story_twice():
+    pool = make_pool(size=2, max_uses=5)
+    fill(pool)
+
+    first = pool.take(PROMPTS[0], user_id=1)
+    second = pool.take(PROMPTS[0], user_id=1)
+    assert first and second and first.title != second.title
+    assert pool.take(PROMPTS[0], user_id=1) is None
+    # Другой пользователь может получить те же сказки
+    assert pool.take(PROMPTS[0], user_id=2) == first
+
+
+def test_story_removed_after_max_uses():
+    pool = make_pool(size=1, max_uses=2)
+    fill(pool)
+    story = pool.take(PROMPTS[0], user_id=1)
+    assert pool.take(PROMPTS[0], user_id=2) == story
+    assert pool.take(PROMPTS[0], user_id=3) is None
+    assert pool.stats()["stories"] == 1
+
+
+def test_background_refill_pauses_during_live_requests():
+    pool = make_pool(size=1)
+
+    async def run():
+        with pool.live_request():
+            await pool.start()
+            await asyncio.sleep(0.01)
+            assert pool.stats()["stories"] == 0
+        await asyncio.sleep(0.05)
+        await pool.stop()
+
+    asyncio.run(run())
+    assert pool.stats()["stories"] == 2
+
+
+def test_refill_takes_admission_slot():
+    admission = AdmissionController(max_in_flight=1, max_queue_wait=1)
+    in_flight = []
+
+    async def generate(prompt):
+        in_flight.append(admission.in_flight)
+        return "**Сказка**\n\nЖил-был кот. Он был добрым."
+
+    pool = StoryPool(PROMPTS, size=1, generate=generate, admission=admission)
+
+    async def run():
+        # Слот занят пользователем — фоновая генерация не идёт сверх лимита
+        await admission.acquire(user_id=1)
+        assert await pool.refill_once()
+        assert in_flight == []
+        admission.release()
+
+        assert await pool.refill_once()
+        assert in_flight == [1]
+        assert admission.in_flight == 0
+
+    asyncio.run(run())
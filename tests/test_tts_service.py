@@ -1,12 +1,47 @@
+import asyncio
 import os
-import pytest
-from src.services.tts_service import TTSService
+from urllib.parse import parse_qs
 
-def test_tts_service_disabled(monkeypatch):
+import httpx
+from config.settings import config
+from src.services.audio_cache import AudioCache
+from src.services.tts_service import TTSService, _AudioSink
+from src.utils.formatters import parse_story
+
+
+def make_service(cache=None):
+    service = TTSService()
+    service.enabled = True
+    service.cache = cache or AudioCache(directory=None, memory_max_bytes=1024, disk_max_bytes=0)
+    return service
+
+
+def synthesize(service, text, title="Сказка", handler=None):
+    """asynthesize_speech с клиентом на MockTransport (handler) вместо сети."""
+    async def run():
+        if handler is not None:
+            service._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await service.asynthesize_speech(text, title)
+        finally:
+            await service.aclose()
+
+    return asyncio.run(run())
+
+
+def echo_handler(requests_seen=None, prefix=b""):
+    def handler(request):
+        text = parse_qs(request.content.decode("utf-8"))["text"][0]
+        if requests_seen is not None:
+            requests_seen.append(text)
+        return httpx.Response(200, content=prefix + text.encode("utf-8"))
+    return handler
+
+
+def test_tts_service_disabled():
     service = TTSService()
     service.enabled = False
-    result = service.synthesize_speech("Тестовая сказка")
-    assert result is None
+    assert synthesize(service, "Тестовая сказка") is None
 
 
 def test_tts_cleanup_temp_file(tmp_path):
@@ -17,3 +52,119 @@ def test_tts_cleanup_temp_file(tmp_path):
     assert tmp_file.exists()
     service.cleanup_temp_file(str(tmp_file))
     assert not tmp_file.exists()
+
+
+def test_tts_synthesize_story_uses_parsed_text(monkeypatch):
+    service = TTSService()
+    calls = []
+
+    async def fake_speech(text, title):
+        calls.append((text, title))
+
+    monkeypatch.setattr(service, "asynthesize_speech", fake_speech)
+
+    asyncio.run(service.asynthesize_story(parse_story("**Кот и мышь**\nЖили-были кот и мышь.")))
+    assert calls == [("Кот и мышь.\n\nЖили-были кот и мышь.", "Кот и мышь")]
+
+
+def test_tts_cache_hit_skips_http(tmp_path):
+    service = make_service(AudioCache(directory=str(tmp_path), memory_max_bytes=1024, disk_max_bytes=1024))
+    service.cache.put(service.cache_key("Сказка про кота"), b"audio")
+
+    def fail(request):
+        raise AssertionError("HTTP-запрос при попадании в кэш")
+
+    audio = synthesize(service, "Сказка  про кота", handler=fail)
+    assert audio.data == b"audio"
+    assert audio.path is None
+
+
+def test_tts_long_text_synthesized_in_ordered_chunks(monkeypatch):
+    service = make_service()
+    monkeypatch.setattr(config.tts, "CHUNK_CHARS", 25)
+    requests_seen = []
+    tag = b"ID3\x03\x00\x00\x00\x00\x00\x01T"
+
+    audio = synthesize(
+        service, "Первая часть сказки. Вторая часть сказки.",
+        handler=echo_handler(requests_seen, prefix=tag),
+    ).data
+
+    # У второй части тег ID3 снят, порядок частей сохранён
+    first = "Первая часть сказки.".encode("utf-8")
+    second = "Вторая часть сказки.".encode("utf-8")
+    assert audio == tag + first + second
+    assert sorted(requests_seen) == ["Вторая часть сказки.", "Первая часть сказки."]
+
+
+def test_tts_large_audio_spills_to_temp_file(monkeypatch):
+    service = make_service()
+    monkeypatch.setattr(config.tts, "SPILL_BYTES", 4)
+
+    audio = synthesize(service, "Сказка", "Кот и мышь", handler=lambda request: httpx.Response(200, content=b"audio-bytes"))
+    assert audio.data is None
+    assert audio.temporary
+    assert audio.filename == "Кот_и_мышь.mp3"
+    with audio.open() as f:
+        assert f.read() == b"audio-bytes"
+    service.cleanup_temp_file(audio.path)
+    assert not os.path.exists(audio.path)
+
+
+def test_tts_api_error_returns_none():
+    service = make_service()
+    audio = synthesize(service, "Сказка", handler=lambda request: httpx.Response(500, text="ошибка"))
+    assert audio is None
+
+
+def test_audio_sink_streams_past_limit_to_file(tmp_path):
+    async def run():
+        sink = _AudioSink(4, str(tmp_path), suffix=".tmp")
+        for block in (b"ab", b"cd", b"ef", b"gh"):
+            await sink.write(block)
+            # В памяти не больше limit байт
+            assert len(sink._buffer) <= 4
+        sink.close()
+        return sink
+
+    sink = asyncio.run(run())
+    with open(sink.path, "rb") as f:
+        assert f.read() == b"abcdefgh"
+    assert sink.size == 8
+
+
+def test_tts_large_audio_goes_to_disk_cache_not_memory(tmp_path, monkeypatch):
+    directory = tmp_path / "tts"
+    service = make_service(AudioCache(directory=str(directory), memory_max_bytes=1024, disk_max_bytes=1024))
+    monkeypatch.setattr(config.tts, "SPILL_BYTES", 4)
+
+    audio = synthesize(service, "Сказка", handler=lambda request: httpx.Response(200, content=b"audio-bytes"))
+    assert audio.path == service.cache.path_for(service.cache_key("Сказка"))
+    assert not audio.temporary
+    assert service.cache.stats()["memory_items"] == 0
+    # Второй копии (временного файла) рядом с кэшем не остаётся
+    assert sorted(os.listdir(directory)) == [os.path.basename(audio.path)]
+
+    def fail(request):
+        raise AssertionError("HTTP-запрос при попадании в кэш")
+
+    again = synthesize(service, "Сказка", handler=fail)
+    assert again.path == audio.path
+    assert again.data is None
+    assert not again.temporary
+
+
+def test_tts_failed_part_leaves_no_temp_file(tmp_path, monkeypatch):
+    directory = tmp_path / "tts"
+    service = make_service(AudioCache(directory=str(directory), memory_max_bytes=1024, disk_max_bytes=1024))
+    monkeypatch.setattr(config.tts, "SPILL_BYTES", 4)
+    monkeypatch.setattr(config.tts, "CHUNK_CHARS", 25)
+
+    def handler(request):
+        text = parse_qs(request.content.decode("utf-8"))["text"][0]
+        if text.startswith("Вторая"):
+            return httpx.Response(500, text="ошибка")
+        return httpx.Response(200, content=text.encode("utf-8"))
+
+    assert synthesize(service, "Первая часть сказки. Вторая часть сказки.", handler=handler) is None
+    assert not directory.exists() or os.listdir(directory) == []
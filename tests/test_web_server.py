@@ -0,0 +1,56 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import web_server
+from config.settings import config
+
+
+class FakeTelegramApp:
+    def __init__(self, running=True):
+        self.running = running
+        self.bot = None
+        self.update_queue = asyncio.Queue()
+
+
+def run_with_client(tg_app, scenario, **kwargs):
+    async def run():
+        app = web_server.create_web_app(tg_app, metrics_source=lambda: {"state": {"size": 3}}, **kwargs)
+        async with TestClient(TestServer(app)) as client:
+            return await scenario(client)
+
+    return asyncio.run(run())
+
+
+def test_health_readiness_and_metrics():
+    async def scenario(client):
+        index = await client.get("/")
+        health = await client.get("/healthz")
+        ready = await client.get("/readyz")
+        metrics = await client.get("/metrics")
+        return index.status, health.status, ready.status, await metrics.text()
+
+    assert run_with_client(FakeTelegramApp(), scenario) == (200, 200, 200, "skazkin_state_size 3\n")
+
+
+def test_not_ready_until_application_started():
+    async def scenario(client):
+        return (await client.get("/readyz")).status
+
+    assert run_with_client(FakeTelegramApp(running=False), scenario) == 503
+
+
+def test_webhook_queues_update_and_checks_secret(monkeypatch):
+    monkeypatch.setattr(config.bot, "WEBHOOK_SECRET", "s3cret")
+    tg_app = FakeTelegramApp()
+    path = f"/{config.bot.WEBHOOK_PATH}"
+
+    async def scenario(client):
+        rejected = await client.post(path, json={"update_id": 1})
+        accepted = await client.post(
+            path, json={"update_id": 2}, headers={web_server.SECRET_HEADER: "s3cret"}
+        )
+        return rejected.status, accepted.status
+
+    assert run_with_client(tg_app, scenario, webhook=True) == (403, 200)
+    assert tg_app.update_queue.get_nowait().update_id == 2
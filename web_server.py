@@ -1,12 +1,136 @@
-import os
-from flask import Flask
+"""
+Асинхронный веб-сервер бота: вебхук Telegram, проверки живости и метрики.
+Работает в том же цикле событий, что и приложение python-telegram-bot.
+"""
+import hmac
+import logging
+from typing import Callable, Dict, Optional
 
-app = Flask(__name__)
+from aiohttp import web
+from telegram import Update
 
-@app.route("/")
-def index():
-    return "✅ Skazkin Bot is running!"
+from config.settings import config
 
-if __name__ == "__main__":
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port)
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+TG_APP_KEY = web.AppKey("tg_app", object)
+METRICS_KEY = web.AppKey("metrics", object)
+SINK_KEY = web.AppKey("sink", object)
+
+
+async def index(request: web.Request) -> web.Response:
+    return web.Response(text="✅ Skazkin Bot is running!")
+
+
+async def health(request: web.Request) -> web.Response:
+    """Процесс жив и цикл событий отвечает."""
+    return web.Response(text="ok")
+
+
+async def ready(request: web.Request) -> web.Response:
+    """Бот запущен и готов принимать обновления."""
+    tg_app = request.app[TG_APP_KEY]
+    if not getattr(tg_app, "running", False):
+        return web.Response(status=503, text="starting")
+    return web.Response(text="ready")
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """Счётчики в текстовом формате Prometheus."""
+    lines = []
+    for group, values in request.app[METRICS_KEY]().items():
+        for name, value in values.items():
+            lines.append(f"skazkin_{group}_{name} {value}")
+    return web.Response(text="\n".join(lines) + "\n")
+
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    """Приём обновления от Telegram и передача его в очередь приложения."""
+    secret = config.bot.WEBHOOK_SECRET
+    if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+        return web.Response(status=403)
+
+    tg_app = request.app[TG_APP_KEY]
+    try:
+        data = await request.json()
+        sink = request.app[SINK_KEY]
+        if sink is not None:
+            # Фронт с процессами-обработчиками: обновление уходит как есть, без разбора.
+            # 503 — Telegram повторит доставку позже
+            return web.Response(status=200 if sink(data) else 503)
+        update = Update.de_json(data, tg_app.bot)
+    except ValueError as e:
+        logger.warning(f"Некорректное обновление в вебхуке: {e}")
+        return web.Response(status=400)
+    await tg_app.update_queue.put(update)
+    return web.Response()
+
+
+def collect_metrics() -> Dict[str, Dict[str, int]]:
+    """Счётчики хранилища состояния, пула и кэша сказок, лимитов, очереди и кэша озвучки."""
+    from src.bot.handlers import rate_limiter, story_cache, story_pool, user_store
+    from src.services.admission import admission_stats
+    from src.services.tts_service import tts_service
+
+    result = {
+        "state": user_store.stats(),
+        "story_pool": story_pool.stats(),
+        "story_cache": story_cache.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "tts_cache": tts_service.cache.stats(),
+    }
+    # Контроллеры очереди по провайдерам сводим в общие суммы
+    admission = {}
+    for stats in admission_stats().values():
+        for name, value in stats.items():
+            admission[name] = admission.get(name, 0) + value
+    result["admission"] = admission
+    return result
+
+
+def create_web_app(
+    tg_app,
+    webhook: bool = False,
+    metrics_source: Optional[Callable[[], Dict[str, Dict[str, int]]]] = None,
+    sink: Optional[Callable[[dict], None]] = None,
+) -> web.Application:
+    app = web.Application()
+    app[TG_APP_KEY] = tg_app
+    app[METRICS_KEY] = metrics_source or collect_metrics
+    app[SINK_KEY] = sink
+    app.router.add_get("/", index)
+    app.router.add_get("/healthz", health)
+    app.router.add_get("/readyz", ready)
+    app.router.add_get("/metrics", metrics)
+    if webhook:
+        app.router.add_post(f"/{config.bot.WEBHOOK_PATH.strip('/')}", telegram_webhook)
+    return app
+
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def start(
+    tg_app,
+    webhook: bool = False,
+    metrics_source: Optional[Callable[[], Dict[str, Dict[str, int]]]] = None,
+    sink: Optional[Callable[[dict], None]] = None,
+):
+    """Запуск сервера в текущем цикле событий (из post_init приложения)."""
+    global _runner
+    if _runner is not None:
+        return
+    _runner = web.AppRunner(create_web_app(tg_app, webhook, metrics_source, sink))
+    await _runner.setup()
+    await web.TCPSite(_runner, "0.0.0.0", config.bot.PORT).start()
+    logger.info(f"Веб-сервер слушает порт {config.bot.PORT}")
+
+
+async def stop():
+    global _runner
+    if _runner is None:
+        return
+    await _runner.cleanup()
+    _runner = None